@@ -1,16 +1,10 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-import os
-from matplotlib.ticker import FuncFormatter
-from statsmodels.stats import weightstats as stests
-from statsmodels.stats.proportion import proportions_ztest
-from scipy.stats import norm
-from dotenv import load_dotenv
-from datetime import datetime
-from Vanguard_backend import load_data, get_summary, clear_search, get_individual, confirmation_rate, navigation_time, drop_rate, bounce_rate, error_rate
+from Vanguard_backend import clear_search, plot_confirmation_rate, plot_navigation_time, plot_drop_rate, plot_bounce_rate
+from Vanguard_render import show_tests, show_quantiles
+from Vanguard_engine import get_engine
+from Vanguard_profile import start_trace, phase, end_trace, show_profile_panel
+from Vanguard_panels import panel_workers, show_panels
  
 def main():
     st.set_page_config(
@@ -18,10 +12,13 @@ def main():
     layout="wide",
     initial_sidebar_state="expanded")
  
-    # Load data 
-    data = load_data()
+    # Load data (ENGINE selects in-memory pandas or DuckDB over Parquet)
+    phase('load')
+    engine = get_engine()
+    min_age_value, max_age_value = engine.age_range()
     
     # Interactive widgets
+    phase('sidebar')
     st.sidebar.header('Controls')
 
     if 'search_id' not in st.session_state:
@@ -34,9 +31,9 @@ def main():
 
     min_age, max_age = st.sidebar.slider(
         "Select Age Range",
-        min_value=int(data['clnt_age'].min()),
-        max_value=int(data['clnt_age'].max()),
-        value=(int(data['clnt_age'].min()), int(data['clnt_age'].max())),
+        min_value=min_age_value,
+        max_value=max_age_value,
+        value=(min_age_value, max_age_value),
         step=1)
 
     group_options_variation = ['All', 'Control', 'Test']
@@ -45,28 +42,16 @@ def main():
     group_options_gender = ['All', 'Male', 'Female','Unknown']
     selected_group_gender = st.sidebar.selectbox('Select Group', group_options_gender)
 
-    # Filter by rating
-    filtered_data = data[(data['clnt_age'] >= min_age) & (data['clnt_age'] <= max_age)]
- 
-    if selected_group_variation == 'Control':
-        filtered_data = filtered_data[filtered_data['Variation'] == 'Control']
-    elif selected_group_variation == 'Test':
-        filtered_data = filtered_data[filtered_data['Variation'] == 'Test']
-
-    if selected_group_gender == 'Male':
-        filtered_data = filtered_data[filtered_data['gendr'] == 'M']
-    elif selected_group_gender == 'Female':
-        filtered_data = filtered_data[filtered_data['gendr'] == 'F']
-    elif selected_group_gender == 'Unknown':
-        filtered_data = filtered_data[filtered_data['gendr'] == 'U']
+    # Filter by rating, pushed down to the engine
+    filters = (min_age, max_age, selected_group_variation, selected_group_gender)
 
+    phase('client_search')
     if search_id:
         # Attempt to convert the input to an integer (assuming client_id is an integer)
         try:
             search_id_int = int(search_id)
-            individual_df = data[data['client_id'] == search_id_int]
-            if not individual_df.empty:  # Ensure DataFrame is not empty
-                result_search = get_individual(individual_df)
+            result_search = engine.client(search_id_int)
+            if result_search is not None:  # Ensure the client exists
                 with st.expander("Client Statistics"):
                     col1, col2 = st.columns(2)
                     with col1:
@@ -84,16 +69,22 @@ def main():
                                 for step, count in value.items():
                                     st.text(f"{step}: {count}")
                         st.metric("Group Variation", result_search['Group'][0])
-                        last_access_str = result_search['Last Access'][0]
-                        last_access_datetime = datetime.strptime(last_access_str, '%Y-%m-%d %H:%M:%S')
+                        last_access_datetime = pd.Timestamp(result_search['Last Access'][0])
                         st.metric("Last Use", last_access_datetime.strftime('%Y-%m-%d %H:%M:%S'))
             else:
                 st.write('No client found with that ID.')
         except ValueError:
             st.write('Please enter a valid integer ID.')
 
+    phase('summary')
     st.write("### Summary Statistics")
-    updated_summary = get_summary(filtered_data)
+    updated_summary = engine.summary(filters)
+
+    def margin(column):
+        # '±' bound of a card estimated by the approximate engine (ENGINE=sketch)
+        if column + ' Error' not in updated_summary.columns:
+            return ''
+        return f" <small>±{updated_summary[column + ' Error'][0]:.0f}</small>"
 
     # Use columns to display each statistic in its own 'card'
     col1, col2, col3, col4, col5, col6 = st.columns(6)  # Adjust the number of columns based on your summary statistics
@@ -127,7 +118,7 @@ def main():
         </style>
         <div class="metric">
             <h2>Total Clients</h2>
-            <h1>{clients_count}</h1>
+            <h1>{clients_count}{margin('Clients')}</h1>
         </div>
         """, unsafe_allow_html=True)
 
@@ -229,7 +220,7 @@ def main():
         </style>
         <div class="metric">
             <h2>Control Group (%)</h2>
-            <h1>{percentage_control_rounded}</h1>
+            <h1>{percentage_control_rounded}{margin('Percentage Control')}</h1>
         </div>
         """, unsafe_allow_html=True)
 
@@ -263,15 +254,18 @@ def main():
         </style>
         <div class="metric">
             <h2>Test Group (%)</h2>
-            <h1>{percentage_test_rounded}</h1>
+            <h1>{percentage_test_rounded}{margin('Percentage Test')}</h1>
         </div>
         """, unsafe_allow_html=True)
 
     with col6:
+        error_card = st.empty()
 
-        error_rate_value = error_rate(filtered_data)
+    def show_error_rate(error_rate_value, error_rate_bound=None):
         rounded_error_rate_value = round(error_rate_value * 100)
-        st.markdown(f"""
+        # '±' bound of the approximate engine, in percentage points
+        error_margin = f" <small>±{error_rate_bound * 100:.1f}</small>" if error_rate_bound is not None else ''
+        error_card.markdown(f"""
         <style>
         .metric {{
             background-color: #235e71; 
@@ -298,22 +292,48 @@ def main():
         </style>
         <div class="metric">
             <h2>Avarage Error Rate (%)</h2>
-            <h1>{rounded_error_rate_value}</h1>
+            <h1>{rounded_error_rate_value}{error_margin}</h1>
         </div>
         """, unsafe_allow_html=True)   
 
-    # Display graph
+    # PANEL_WORKERS: error rate, tests and charts computed concurrently and drawn as they arrive
+    if panel_workers:
+        phase('panels')
+        col1_graph, col2_graph = st.columns(2)
+        col1_graph2, col2_graph2 = st.columns(2)
+        show_panels(engine, filters, st.session_state, show_error_rate,
+                    {'confirmation_rate': col1_graph, 'bounce_rate': col2_graph,
+                     'drop_rate': col1_graph2, 'navigation_time': col2_graph2})
+        return
+
+    show_error_rate(engine.error_rate(filters), engine.error_rate_bound(filters))
+
+    # Display graph, each with its Control vs Test p-values and confidence intervals
+    phase('tests')
+    tests = engine.tests(filters)
+    phase('charts')
     col1_graph, col2_graph = st.columns(2) 
     with col1_graph:
-        confirmation_rate(filtered_data)
+        plot_confirmation_rate(engine.confirmation_rates(filters))
+        show_tests(tests, 'Confirmation Rate', scale=100)
     with col2_graph:
-        bounce_rate(filtered_data)
+        plot_bounce_rate(engine.bounce_rates(filters))
+        show_tests(tests, 'Bounce Rate')
 
     col1_graph2, col2_graph2 = st.columns(2) 
     with col1_graph2:
-        drop_rate(filtered_data)
+        plot_drop_rate(engine.drop_rates(filters))
+        show_tests(tests, 'Drop Rate')
     with col2_graph2:
-        navigation_time(filtered_data)
+        plot_navigation_time(engine.navigation_times(filters))
+        show_tests(tests, 'Navigation Time', unit='s')
+        show_quantiles(engine.navigation_quantiles(filters))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Rerun trace for VANGUARD_PROFILE, a no-op otherwise
+    start_trace()
+    try:
+        main()
+    finally:
+        end_trace()
+    show_profile_panel()
\ No newline at end of file
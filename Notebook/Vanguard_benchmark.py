@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from Vanguard_ingest import load_final_df, clear_loaded
+from Vanguard_synthetic import write_final_df
+from Vanguard_cube import build_cube, select_cells, cube_summary, cube_confirmation_rates, cube_drop_rates, \
+    cube_navigation_times, cube_bounce_rates, cube_error_rate, cube_tests
+from Vanguard_filters import get_filter_index, filter_frame
+import Vanguard_core as core
+
+# Benchmark suite for the backend metric functions. Synthetic Final_DF files
+# are generated once per size (and reused on later runs), then every function
+# is timed on every sidebar filter scenario. Wall time is the median of the
+# repeats, with the fastest repeat and their spread kept for comparisons;
+# peak memory is what tracemalloc sees allocated during one extra
+# call. Results are written as JSON, and a run can be compared against an
+# earlier one to flag regressions. Comparisons use the fastest repeat, which
+# is the least disturbed by the rest of the machine.
+#
+#   python Vanguard_benchmark.py --sizes 10k 100k 1M --output bench.json
+#   python Vanguard_benchmark.py --sizes 10k 100k 1M --compare bench.json
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2
+# Differences below this many seconds, or below the spread of the repeats of
+# both runs, are noise (timer and machine load), never a regression
+NOISE_SECONDS = 0.05
+
+benchmark_directory = os.getenv('BENCHMARK_DIR', '.vanguard_bench')
+
+# name -> (min_age, max_age, variation, gender), as picked in the sidebar
+SCENARIOS = {
+    'all': (0, 200, 'All', 'All'),
+    'age_30_50': (30, 50, 'All', 'All'),
+    'test': (0, 200, 'Test', 'All'),
+    'female': (0, 200, 'All', 'Female'),
+    'test_female_30_50': (30, 50, 'Test', 'Female'),
+}
+
+GENDER_CODES = {'Male': 'M', 'Female': 'F', 'Unknown': 'U'}
+
+
+def filter_data(data, min_age, max_age, variation='All', gender='All'):
+    # Same filtering as the dashboard sidebar
+    filtered_data = data[(data['clnt_age'] >= min_age) & (data['clnt_age'] <= max_age)]
+    if variation != 'All':
+        filtered_data = filtered_data[filtered_data['Variation'] == variation]
+    if gender != 'All':
+        filtered_data = filtered_data[filtered_data['gendr'] == GENDER_CODES[gender]]
+    return filtered_data
+
+
+def _dashboard(cells):
+    # Everything a dashboard rerun computes from the segment cube
+    cube_summary(cells)
+    cube_error_rate(cells)
+    cube_confirmation_rates(cells)
+    cube_bounce_rates(cells)
+    cube_drop_rates(cells)
+    cube_navigation_times(cells)
+    cube_tests(cells)
+
+
+# Functions of the filtered frame
+FUNCTIONS = {
+    'get_summary': core.get_summary,
+    'confirmation_rate': core.confirmation_rates,
+    'drop_rate': core.drop_rates,
+    'navigation_time': core.navigation_times,
+    'bounce_rate': core.bounce_rates,
+    'error_rate': core.error_rate,
+}
+
+
+def parse_size(text):
+    text = text.strip().lower().replace('_', '')
+    scale = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def dataset_path(rows, seed=0, data_dir=None):
+    return os.path.join(data_dir or benchmark_directory, f'synthetic_{rows}_{seed}.csv')
+
+
+def ensure_dataset(rows, seed=0, data_dir=None):
+    path = dataset_path(rows, seed, data_dir)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        write_final_df(tmp_path, rows, seed)
+        os.replace(tmp_path, path)
+    return path
+
+
+def measure(function, *args, repeat=DEFAULT_REPEAT):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': float(np.median(times)), 'min_seconds': min(times), 'spread_seconds': max(times) - min(times),
+            'repeat': repeat, 'peak_bytes': peak}
+
+
+def _load(path, cache_dir, cold):
+    clear_loaded()
+    if cold:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return load_final_df(path, cache_dir=cache_dir)
+
+
+def run_size(rows, seed=0, repeat=DEFAULT_REPEAT, data_dir=None, scenarios=None, functions=None, log=None):
+    path = ensure_dataset(rows, seed, data_dir)
+    cache_dir = os.path.join(os.path.dirname(path), '.cache_%d_%d' % (rows, seed))
+    results = []
+
+    def record(function, scenario, measured, scenario_rows):
+        results.append({'rows': rows, 'function': function, 'scenario': scenario, 'scenario_rows': scenario_rows,
+                        **measured})
+        if log:
+            log(f"{rows:>11,} {function:<18} {scenario:<18} {measured['seconds'] * 1000:10.1f} ms "
+                f"{measured['peak_bytes'] / 2 ** 20:9.1f} MiB")
+
+    # Loading is timed without the in-process memo: from CSV, then from the Parquet cache
+    record('load_data_csv', 'all', measure(_load, path, cache_dir, True, repeat=min(repeat, 3)), None)
+    record('load_data', 'all', measure(_load, path, cache_dir, False, repeat=repeat), None)
+    data = _load(path, cache_dir, False)
+
+    record('build_cube', 'all', measure(build_cube, data, repeat=min(repeat, 3)), len(data))
+    cube = build_cube(data)
+
+    for scenario, bounds in (scenarios or SCENARIOS).items():
+        record('filter', scenario, measure(filter_data, data, *bounds, repeat=repeat), len(data))
+        index = get_filter_index(data)
+        record('filter_index', scenario, measure(lambda: (index.selections.clear(), filter_frame(data, *bounds)),
+                                                 repeat=repeat), len(data))
+        filtered_data = filter_frame(data, *bounds)
+        for name, function in (functions or FUNCTIONS).items():
+            record(name, scenario, measure(function, filtered_data, repeat=repeat), len(filtered_data))
+        record('dashboard_rerun', scenario, measure(lambda: _dashboard(select_cells(cube, *bounds)), repeat=repeat),
+               len(filtered_data))
+
+    frame_bytes = int(data.memory_usage(deep=True).sum())
+    return results, {'rows': rows, 'path': path, 'frame_bytes': frame_bytes}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(sizes=None, seed=0, repeat=DEFAULT_REPEAT, data_dir=None, log=None):
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+            'repeat': repeat
+        },
+        'datasets': [],
+        'results': []
+    }
+    for rows in sizes or DEFAULT_SIZES:
+        results, dataset = run_size(rows, seed, repeat, data_dir, log=log)
+        report['results'].extend(results)
+        report['datasets'].append(dataset)
+    return report
+
+
+def _key(result):
+    return result['rows'], result['function'], result['scenario']
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    # Results that got slower or use more memory than the baseline by more than threshold
+    previous = {_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+        # Baselines written before min_seconds was recorded only have the median
+        seconds = [run.get('min_seconds', run['seconds']) for run in (before, result)]
+        noise = max(NOISE_SECONDS, before.get('spread_seconds', 0) + result.get('spread_seconds', 0))
+        slower = seconds[1] > seconds[0] * (1 + threshold) and seconds[1] - seconds[0] > noise
+        larger = result['peak_bytes'] > before['peak_bytes'] * (1 + threshold) and \
+            result['peak_bytes'] - before['peak_bytes'] > 1 << 20
+        if slower or larger:
+            regressions.append({'rows': result['rows'], 'function': result['function'], 'scenario': result['scenario'],
+                                'seconds': seconds,
+                                'peak_bytes': [before['peak_bytes'], result['peak_bytes']]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the backend metric functions on synthetic data.')
+    parser.add_argument('--sizes', nargs='+', default=None, help='rows per dataset, e.g. 10k 100k 1M 10M')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--data-dir', default=None, help=f'where datasets are kept (default: {benchmark_directory})')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown or memory growth reported as a regression')
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes] if args.sizes else DEFAULT_SIZES
+    report = run(sizes, args.seed, args.repeat, args.data_dir, log=print)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        regressions = compare(baseline, report, args.threshold)
+        for regression in regressions:
+            print('REGRESSION', json.dumps(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+# Client-ID index for the sidebar search. Built once per loaded frame: client
+# ids are kept sorted with the offset of each client's first row, so a lookup
+# is a binary search. load_data() returns rows ordered by client_id, so a
+# client's rows are a plain positional slice of the shared frame.
+# The "Client Statistics" card is precomputed for every client in one pass.
+
+# (data, index) for the last frame the index was built from
+_built = (None, None)
+
+
+def client_summaries(data):
+    grouped = data.groupby('client_id', sort=True)
+    summaries = grouped[['Variation', 'clnt_age', 'clnt_tenure_yr', 'gendr']].first()
+    summaries['Balance'] = grouped['bal'].sum() / grouped.size()
+    summaries['Last Access'] = grouped['date_time'].max()
+    step_counts = data.groupby(['client_id', 'process_step'], observed=True).size().unstack(fill_value=0)
+    return summaries, step_counts.reindex(summaries.index, fill_value=0)
+
+
+class ClientIndex:
+    def __init__(self, data):
+        client_ids = data['client_id'].to_numpy()
+        self.order = None
+        if len(client_ids) > 1 and (client_ids[1:] < client_ids[:-1]).any():
+            self.order = np.argsort(client_ids, kind='stable')
+            client_ids = client_ids[self.order]
+        starts = np.flatnonzero(np.diff(client_ids)) + 1
+        self.starts = np.concatenate(([0], starts)) if len(client_ids) else starts
+        self.stops = np.append(self.starts[1:], len(client_ids))
+        self.client_ids = client_ids[self.starts]
+        self.data = data
+        self.summaries, self.step_counts = client_summaries(data)
+
+    def locate(self, client_id):
+        position = np.searchsorted(self.client_ids, client_id)
+        if position < len(self.client_ids) and self.client_ids[position] == client_id:
+            return position
+        return None
+
+    def rows(self, client_id):
+        position = self.locate(client_id)
+        if position is None:
+            return self.data.iloc[0:0]
+        start, stop = self.starts[position], self.stops[position]
+        if self.order is None:
+            return self.data.iloc[start:stop]
+        return self.data.iloc[self.order[start:stop]]
+
+    def summary(self, client_id):
+        position = self.locate(client_id)
+        if position is None:
+            return None
+        client = self.summaries.iloc[position]
+        step_counts = self.step_counts.iloc[position]
+        step_counts = step_counts[step_counts > 0].sort_values(ascending=False, kind='stable')
+        # Same layout as get_individual()
+        individual_summary = pd.DataFrame({
+            'Step Amount': [{str(step): int(count) for step, count in step_counts.items()}],
+            'Group': [client['Variation']],
+            'Age': [client['clnt_age']],
+            'Tenure': [client['clnt_tenure_yr']],
+            'Gender': [client['gendr']],
+            'Balance': [client['Balance']],
+            'Last Access': [client['Last Access']]
+        })
+        return individual_summary
+
+
+def get_client_index(data):
+    global _built
+    if _built[0] is not data:
+        _built = (data, ClientIndex(data))
+    return _built[1]
@@ -0,0 +1,135 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+# Compact in-memory layout for Final_DF. Every conversion is lossless:
+#  - text columns (visitor_id, visit_id, lead, ...) become categoricals
+#  - integer columns and whole-number float columns without gaps become the
+#    smallest integer type holding their range (flags stay 1-byte ints)
+# Columns with fractions stay float64: pandas accumulates float32 means in
+# float32, so narrowing them would change the dashboard numbers.
+# check_metrics() runs every backend metric on both layouts and reports any
+# value that differs.
+
+# Shown as recorded in the client card ("6.0 years"), so never turned into ints
+KEEP_FLOAT = ['clnt_age', 'clnt_tenure_yr', 'bal']
+
+# Text columns with more distinct values than this share of the rows stay as strings
+CATEGORY_RATIO = 0.5
+
+
+def _smallest_int(values):
+    low, high = values.min(), values.max()
+    for kind in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(kind)
+        if info.min <= low and high <= info.max:
+            return kind
+    return None
+
+
+def compact_column(column):
+    if isinstance(column.dtype, pd.CategoricalDtype) or column.dtype.kind == 'M':
+        return column
+    if column.dtype == object:
+        if column.nunique(dropna=True) <= CATEGORY_RATIO * len(column):
+            return column.astype('category')
+        return column
+    if column.dtype.kind in 'iu' and len(column):
+        kind = _smallest_int(column.to_numpy())
+        return column.astype(kind) if kind is not None else column
+    if column.dtype.kind == 'f' and column.name not in KEEP_FLOAT and len(column) and not column.isna().any():
+        values = column.to_numpy()
+        if np.all(values == np.floor(values)):
+            kind = _smallest_int(values)
+            if kind is not None:
+                return column.astype(kind)
+    return column
+
+
+def compact_frame(data):
+    return pd.DataFrame({name: compact_column(data[name]) for name in data.columns}, index=data.index)
+
+
+def memory_report(before, after=None):
+    after = compact_frame(before) if after is None else after
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'dtype_after': after.dtypes.astype(str),
+        'bytes_before': before.memory_usage(deep=True, index=False),
+        'bytes_after': after.memory_usage(deep=True, index=False)
+    })
+    report.loc['total'] = ['', '', report['bytes_before'].sum(), report['bytes_after'].sum()]
+    report['ratio'] = report['bytes_after'] / report['bytes_before']
+    return report
+
+
+def _same(left, right):
+    if isinstance(left, pd.DataFrame):
+        if list(left.columns) != list(right.columns) or len(left) != len(right):
+            return False
+        return all(_same(left[column].tolist(), right[column].tolist()) for column in left.columns)
+    if isinstance(left, dict):
+        return left.keys() == right.keys() and all(_same(left[key], right[key]) for key in left)
+    if isinstance(left, (list, tuple)):
+        return len(left) == len(right) and all(_same(a, b) for a, b in zip(left, right))
+    # Same type too, so an int showing up where a float was ("6" instead of "6.0") counts
+    if type(left) != type(right):
+        return False
+    if isinstance(left, (float, np.floating)) and np.isnan(left):
+        return bool(np.isnan(right))
+    return bool(left == right)
+
+
+def check_metrics(before, after=None, clients=20, seed=0):
+    # Runs every backend metric on both frames for each sidebar scenario; returns the mismatches
+    import Vanguard_core as core
+    from Vanguard_benchmark import SCENARIOS, FUNCTIONS, filter_data
+    from Vanguard_clients import ClientIndex
+    from Vanguard_cube import build_cube
+
+    after = compact_frame(before) if after is None else after
+    mismatches = []
+    for scenario, bounds in SCENARIOS.items():
+        left, right = filter_data(before, *bounds), filter_data(after, *bounds)
+        for name, function in FUNCTIONS.items():
+            if not _same(function(left), function(right)):
+                mismatches.append((name, scenario))
+
+    left_cube, right_cube = build_cube(before), build_cube(after)
+    if not _same(left_cube.reset_index(), right_cube.reset_index()):
+        mismatches.append(('build_cube', 'all'))
+
+    rng = np.random.default_rng(seed)
+    left_index, right_index = ClientIndex(before), ClientIndex(after)
+    for client_id in rng.choice(before['client_id'].unique(), size=min(clients, before['client_id'].nunique()), replace=False):
+        client_id = int(client_id)
+        if not _same(core.get_individual(before[before['client_id'] == client_id]),
+                     core.get_individual(after[after['client_id'] == client_id])):
+            mismatches.append(('get_individual', client_id))
+        if not _same(left_index.summary(client_id), right_index.summary(client_id)):
+            mismatches.append(('client_summary', client_id))
+    return mismatches
+
+
+def main():
+    from Vanguard_ingest import read_final_df_csv
+    parser = argparse.ArgumentParser(description='Per-column memory report and metric check for the compact Final_DF.')
+    parser.add_argument('path', help='Final_DF CSV')
+    parser.add_argument('--skip-check', action='store_true', help='only print the memory report')
+    args = parser.parse_args()
+
+    before = read_final_df_csv(args.path)
+    after = compact_frame(before)
+    report = memory_report(before, after)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(report)
+    if not args.skip_check:
+        mismatches = check_metrics(before, after)
+        for mismatch in mismatches:
+            print('MISMATCH', *mismatch)
+        print('metrics identical' if not mismatches else '%d metric mismatches' % len(mismatches))
+        return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
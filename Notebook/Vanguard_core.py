@@ -0,0 +1,90 @@
+import os
+import pandas as pd
+from Vanguard_ingest import load_final_df
+from Vanguard_funnel import funnel_table, funnel_confirmation_rates, funnel_drop_rates, funnel_navigation_times
+from Vanguard_visits import get_visits, visit_bounce_rates, visit_error_rate
+from Vanguard_profile import profiled
+
+# Compute core of the dashboard: loading Final_DF and every metric the
+# dashboard shows, with nothing but pandas/numpy behind it, so batch jobs and
+# pool workers import it quickly. Charts live in Vanguard_plots and
+# Vanguard_backend keeps the old names for both.
+
+_dotenv_loaded = False
+
+
+def data_path():
+    # DIR + CSV5, read from .env the first time if the environment lacks them
+    global _dotenv_loaded
+    if not _dotenv_loaded and not (os.getenv('DIR') and os.getenv('CSV5')):
+        from dotenv import load_dotenv
+        load_dotenv()
+        _dotenv_loaded = True
+    return os.getenv('DIR') + os.getenv('CSV5')
+
+
+@profiled()
+def load_data():
+    path = data_path()
+    if os.getenv('DATA_STORE'):
+        # Shared memory-mapped copy instead of a private frame per process
+        from Vanguard_store import load_frame
+        return load_frame(path, os.getenv('DATA_STORE'))
+    data = load_final_df(path)
+    return data
+
+
+@profiled()
+def get_summary(data):
+    summary = pd.DataFrame({
+        'Clients': [data['client_id'].nunique()],
+        'Average Age': [data['clnt_age'].mean()],
+        'Average Tenure': [data['clnt_tenure_yr'].mean()],
+        'Percentage Male': [data[data['gendr'] == 'M']['client_id'].nunique() / data['client_id'].nunique() * 100],
+        'Percentage Female': [data[data['gendr'] == 'F']['client_id'].nunique() / data['client_id'].nunique() * 100],
+        'Percentage Unknown': [data[data['gendr'] == 'U']['client_id'].nunique() / data['client_id'].nunique() * 100],
+        'Percentage Control': [data[data['Variation'] == 'Control']['client_id'].nunique() / data['client_id'].nunique() * 100],
+        'Percentage Test': [data[data['Variation'] == 'Test']['client_id'].nunique() / data['client_id'].nunique() * 100]
+    })
+    return summary
+ 
+
+
+@profiled()
+def get_individual(data):
+    step_counts = data['process_step'].value_counts()
+    individual_summary = pd.DataFrame({
+        'Step Amount': [step_counts[step_counts > 0].to_dict()],
+        'Group': [data['Variation'].iloc[0]],
+        'Age': [data['clnt_age'].iloc[0]],
+        'Tenure': [data['clnt_tenure_yr'].iloc[0]],
+        'Gender': [data['gendr'].iloc[0]],
+        'Balance': [data['bal'].sum() / len(data)],
+        'Last Access': [data['date_time'].max()]
+    })
+    return individual_summary
+
+
+@profiled()
+def confirmation_rates(data):
+    return funnel_confirmation_rates(funnel_table(data))
+
+
+@profiled()
+def navigation_times(data):
+    return funnel_navigation_times(funnel_table(data))
+
+
+@profiled()
+def drop_rates(data):
+    return funnel_drop_rates(funnel_table(data))
+
+
+@profiled()
+def bounce_rates(data):
+    return visit_bounce_rates(get_visits(data))
+
+
+@profiled()
+def error_rate(data):
+    return visit_error_rate(get_visits(data), len(data))
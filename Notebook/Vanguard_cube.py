@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+from Vanguard_visits import get_visits
+from Vanguard_funnel import FUNNEL_MEASURES, STEP_ORDER, funnel_table, funnel_confirmation_rates, funnel_drop_rates, funnel_navigation_times
+from Vanguard_stats import funnel_tests, bounce_test
+from Vanguard_profile import profiled
+
+# Pre-aggregated segment cube keyed by (clnt_age, Variation, gendr).
+# Every cell holds additive quantities, so any sidebar filter combination is
+# answered by summing the selected cells instead of rescanning the events.
+# Distinct clients and visits are additive because the keys are client
+# attributes: a client (and therefore each of its visits) lives in one cell.
+
+SEGMENT_KEYS = ['clnt_age', 'Variation', 'gendr']
+
+# Funnel measures are stored as one '<measure>|<step>' column per step
+FUNNEL_COLUMNS = ['%s|%s' % (measure, step) for measure in FUNNEL_MEASURES for step in STEP_ORDER]
+
+GENDER_CODES = {'Male': 'M', 'Female': 'F', 'Unknown': 'U'}
+
+# (data, cube) for the last frame the cube was built from
+_built = (None, None)
+
+
+@profiled()
+def build_cube(data):
+    funnel = funnel_table(data, by=SEGMENT_KEYS).set_index(SEGMENT_KEYS + ['step'])[FUNNEL_MEASURES].unstack('step')
+    funnel.columns = ['%s|%s' % (measure, step) for measure, step in funnel.columns]
+
+    grouped = data.groupby(SEGMENT_KEYS, observed=True, dropna=False, sort=True)
+    cube = pd.DataFrame({'rows': grouped.size()})
+    cube['clients'] = grouped['client_id'].nunique()
+    cube['age_sum'] = grouped['clnt_age'].sum()
+    cube['age_count'] = grouped['clnt_age'].count()
+    cube['tenure_sum'] = grouped['clnt_tenure_yr'].sum()
+    cube['tenure_count'] = grouped['clnt_tenure_yr'].count()
+
+    cube = cube.join(funnel.reindex(columns=FUNNEL_COLUMNS), how='left')
+
+    # Visit level: bounces and backward moves from the shared visit rollup
+    visits = get_visits(data)
+    visit_cells = visits.assign(bounce_visits=(visits['steps'] == 1).astype(np.int64)).groupby(
+        SEGMENT_KEYS, observed=True, dropna=False)[['bounce_visits', 'backward_steps']].sum()
+    cube = cube.join(visit_cells.rename(columns={'backward_steps': 'error_steps'}), how='left').fillna(0)
+    return cube
+
+
+def get_cube(data):
+    global _built
+    if _built[0] is not data:
+        _built = (data, build_cube(data))
+    return _built[1]
+
+
+def select_cells(cube, min_age, max_age, variation='All', gender='All'):
+    ages = cube.index.get_level_values('clnt_age')
+    mask = (ages >= min_age) & (ages <= max_age)
+    if variation != 'All':
+        mask &= cube.index.get_level_values('Variation') == variation
+    if gender != 'All':
+        mask &= cube.index.get_level_values('gendr') == GENDER_CODES.get(gender, gender)
+    return cube[mask]
+
+
+def cube_funnel(cells):
+    # Tidy per-variation funnel table, same shape as funnel_table(data)
+    totals = cells.groupby(level='Variation', observed=True)[FUNNEL_COLUMNS].sum()
+    long = totals.reset_index().astype({'Variation': str}).melt(id_vars='Variation', var_name='column')
+    parts = long['column'].str.split('|')
+    long['measure'], long['step'] = parts.str[0], parts.str[1]
+    table = long.pivot_table(index=['Variation', 'step'], columns='measure', values='value', aggfunc='sum').reset_index()
+    # An empty selection still has every column
+    return table.reindex(columns=['Variation', 'step'] + FUNNEL_MEASURES)
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+
+
+def cube_summary(cells):
+    clients = cells['clients'].sum()
+    genders = cells.groupby(level='gendr', observed=True)['clients'].sum()
+    variations = cells.groupby(level='Variation', observed=True)['clients'].sum()
+    summary = pd.DataFrame({
+        'Clients': [clients],
+        'Average Age': [_ratio(cells['age_sum'].sum(), cells['age_count'].sum())],
+        'Average Tenure': [_ratio(cells['tenure_sum'].sum(), cells['tenure_count'].sum())],
+        'Percentage Male': [_ratio(genders.get('M', 0), clients) * 100],
+        'Percentage Female': [_ratio(genders.get('F', 0), clients) * 100],
+        'Percentage Unknown': [_ratio(genders.get('U', 0), clients) * 100],
+        'Percentage Control': [_ratio(variations.get('Control', 0), clients) * 100],
+        'Percentage Test': [_ratio(variations.get('Test', 0), clients) * 100]
+    })
+    return summary
+
+
+def cube_confirmation_rates(cells):
+    return funnel_confirmation_rates(cube_funnel(cells))
+
+
+def cube_drop_rates(cells):
+    return funnel_drop_rates(cube_funnel(cells))
+
+
+def cube_navigation_times(cells):
+    return funnel_navigation_times(cube_funnel(cells))
+
+
+def cube_bounce_rates(cells):
+    totals = cells.groupby(level='Variation', observed=True)[['visits|start', 'bounce_visits']].sum()
+    totals = totals.reindex(['Control', 'Test'], fill_value=0)
+    rates = {}
+    for group in ['Control', 'Test']:
+        starts = totals.loc[group, 'visits|start']
+        rates[group] = 100 * totals.loc[group, 'bounce_visits'] / starts if starts > 0 else None
+    return rates
+
+
+def cube_error_rate(cells):
+    return _ratio(cells['error_steps'].sum(), cells['rows'].sum())
+
+
+def cube_tests(cells, alternative='two-sided', n_boot=2_000, alpha=0.05, seed=0):
+    # Control vs Test significance and per-group CIs for every dashboard chart
+    tests = funnel_tests(cube_funnel(cells), alternative=alternative, n_boot=n_boot, alpha=alpha, seed=seed)
+    totals = cells.groupby(level='Variation', observed=True)[['visits|start', 'bounce_visits']].sum()
+    totals = totals.reindex(['Control', 'Test'], fill_value=0)
+    bounce = bounce_test(totals['bounce_visits'], totals['visits|start'], alternative, n_boot, alpha, seed)
+    return pd.concat([tests, bounce], ignore_index=True)
@@ -0,0 +1,484 @@
+import glob
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER, TRANSITION_COLUMNS, DROPOFF_COLUMNS, TIME_COLUMNS, FUNNEL_MEASURES, \
+    funnel_confirmation_rates, funnel_drop_rates, funnel_navigation_times
+from Vanguard_stats import funnel_tests, bounce_test, step_time_samples
+from Vanguard_profile import profiled
+
+# Selectable execution engine behind the dashboard metrics. Every metric is a
+# reduction of four small aggregates, which is all an engine has to produce
+# for a sidebar filter (min_age, max_age, variation, gender):
+#  - funnel_table: per Variation and step, events/visits/forward/dropoff/time
+#  - summary: distinct clients overall, per gender and per variation, mean age/tenure
+#  - visit_totals: per Variation, start visits, bounced visits, events, backward moves
+#  - navigation_sketches: per Variation and step, the mergeable quantile sketch
+#    of the navigation times (Vanguard_quantiles)
+# Engines holding the events also give the raw step times, for bootstrap CIs
+# of the mean navigation times in tests(); the others get normal CIs.
+# The shaping into rates, tables and tests is shared, so engines only differ in
+# how they aggregate.
+#
+# ENGINE=pandas (default) answers from the in-memory segment cube.
+# ENGINE=duckdb runs multi-threaded SQL over Parquet files without loading
+# them: PARQUET_SOURCE (a path or glob) or the Final_DF Parquet cache.
+# ENGINE=sketch is the approximate mode for exploring huge data: distinct
+# counts from mergeable HyperLogLog sketches and visit-level measures from a
+# client sample, with error bounds (Vanguard_sketch).
+
+engine_name = os.getenv('ENGINE', 'pandas')
+parquet_source = os.getenv('PARQUET_SOURCE')
+duckdb_threads = os.getenv('DUCKDB_THREADS')
+
+GENDER_CODES = {'Male': 'M', 'Female': 'F', 'Unknown': 'U'}
+SUMMARY_GENDERS = ['M', 'F', 'U']
+
+# Aggregates kept per engine, keyed by (aggregate, filters)
+AGGREGATE_CACHE_ENTRIES = 64
+
+# (name, source) -> engine
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _summary_frame(clients, age, tenure, genders, variations):
+    # Same layout and arithmetic as get_summary()
+    return pd.DataFrame({
+        'Clients': [clients],
+        'Average Age': [age],
+        'Average Tenure': [tenure],
+        'Percentage Male': [_ratio(genders.get('M', 0), clients) * 100],
+        'Percentage Female': [_ratio(genders.get('F', 0), clients) * 100],
+        'Percentage Unknown': [_ratio(genders.get('U', 0), clients) * 100],
+        'Percentage Control': [_ratio(variations.get('Control', 0), clients) * 100],
+        'Percentage Test': [_ratio(variations.get('Test', 0), clients) * 100]
+    })
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+
+
+class Engine(ABC):
+    name = None
+
+    def __init__(self):
+        self.aggregates = OrderedDict()
+        self.computing = {}
+        self.lock = threading.Lock()
+
+    def version(self):
+        # Anything that changes when the underlying data does
+        return None
+
+    def _cached(self, kind, filters, compute):
+        # A rerun asks for the same aggregate several times (rates, tables, tests), and
+        # concurrent panels may ask at the same time: only the first computes it
+        key = (kind, tuple(filters), self.version())
+        with self.lock:
+            if key in self.aggregates:
+                self.aggregates.move_to_end(key)
+                return self.aggregates[key]
+            computing = self.computing.setdefault(key, threading.Lock())
+        with computing:
+            with self.lock:
+                if key in self.aggregates:
+                    self.aggregates.move_to_end(key)
+                    return self.aggregates[key]
+            try:
+                result = compute(filters)
+            finally:
+                with self.lock:
+                    self.computing.pop(key, None)
+            with self.lock:
+                self.aggregates[key] = result
+                while len(self.aggregates) > AGGREGATE_CACHE_ENTRIES:
+                    self.aggregates.popitem(last=False)
+        return result
+
+    @abstractmethod
+    def age_range(self):
+        pass
+
+    @abstractmethod
+    def client(self, client_id):
+        pass
+
+    @abstractmethod
+    def compute_funnel_table(self, filters):
+        pass
+
+    @abstractmethod
+    def compute_summary(self, filters):
+        pass
+
+    @abstractmethod
+    def compute_visit_totals(self, filters):
+        pass
+
+    @abstractmethod
+    def compute_navigation_sketches(self, filters):
+        pass
+
+    def step_time_samples(self, filters):
+        # Per (Variation, step label), the times before each forward move; None without the events
+        return None
+
+    # Cached results are shared by every caller and must not be modified in place
+    def funnel_table(self, filters):
+        return self._cached('funnel_table', filters, self.compute_funnel_table)
+
+    def summary(self, filters):
+        return self._cached('summary', filters, self.compute_summary)
+
+    def visit_totals(self, filters):
+        return self._cached('visit_totals', filters, self.compute_visit_totals)
+
+    def navigation_sketches(self, filters):
+        # Per Variation and step, the quantile sketch of the time before each forward move
+        return self._cached('navigation_sketches', filters, self.compute_navigation_sketches)
+
+    def confirmation_rates(self, filters):
+        return funnel_confirmation_rates(self.funnel_table(filters))
+
+    def drop_rates(self, filters):
+        return funnel_drop_rates(self.funnel_table(filters))
+
+    def navigation_times(self, filters):
+        return funnel_navigation_times(self.funnel_table(filters))
+
+    def navigation_quantiles(self, filters):
+        from Vanguard_quantiles import quantile_table
+        return quantile_table(self.navigation_sketches(filters))
+
+    def bounce_rates(self, filters):
+        totals = self.visit_totals(filters).reindex(['Control', 'Test'], fill_value=0)
+        rates = {}
+        for group in ['Control', 'Test']:
+            starts, bounces = totals.loc[group, 'starts'], totals.loc[group, 'bounces']
+            # NaN bounces: the approximate engine has no sampled visit in the selection
+            rates[group] = 100 * bounces / starts if starts > 0 and not pd.isna(bounces) else None
+        return rates
+
+    def error_rate(self, filters):
+        totals = self.visit_totals(filters)
+        return _ratio(totals['backward_steps'].sum(), totals['events'].sum())
+
+    def error_rate_bound(self, filters):
+        # +/- bound of error_rate for the engines that estimate it, None when it is exact
+        return None
+
+    def tests(self, filters, alternative='two-sided', n_boot=2_000, alpha=0.05, seed=0):
+        # Cached too: the step time bootstrap is the slowest part of a rerun
+        return self._cached(('tests', alternative, n_boot, alpha, seed), filters,
+                            lambda filters: self.compute_tests(filters, alternative, n_boot, alpha, seed))
+
+    def compute_tests(self, filters, alternative, n_boot, alpha, seed):
+        tests = funnel_tests(self.funnel_table(filters), alternative=alternative, n_boot=n_boot, alpha=alpha, seed=seed,
+                             samples=self.step_time_samples(filters))
+        totals = self.visit_totals(filters).reindex(['Control', 'Test'], fill_value=0)
+        bounce = bounce_test(totals['bounces'], totals['starts'], alternative, n_boot, alpha, seed)
+        return pd.concat([tests, bounce], ignore_index=True)
+
+
+class PandasEngine(Engine):
+    name = 'pandas'
+
+    def __init__(self, data):
+        from Vanguard_cube import get_cube
+        super().__init__()
+        self.data = data
+        self.cube = get_cube(data)
+
+    @profiled()
+    def _cells(self, filters):
+        from Vanguard_cube import select_cells
+        return select_cells(self.cube, *filters)
+
+    def age_range(self):
+        return int(self.data['clnt_age'].min()), int(self.data['clnt_age'].max())
+
+    def rows(self, filters):
+        # Row positions of the selection (None: every row), from the bitmap filter index
+        from Vanguard_filters import get_filter_index
+        return get_filter_index(self.data).select(*filters)
+
+    def frame(self, filters, columns=None):
+        # The selected events for metrics the cube does not hold, gathered once
+        from Vanguard_filters import take
+        return take(self.data, self.rows(filters), columns)
+
+    @profiled()
+    def compute_funnel_table(self, filters):
+        from Vanguard_cube import cube_funnel
+        return cube_funnel(self._cells(filters))
+
+    @profiled()
+    def compute_summary(self, filters):
+        from Vanguard_cube import cube_summary
+        return cube_summary(self._cells(filters))
+
+    @profiled()
+    def compute_visit_totals(self, filters):
+        totals = self._cells(filters).groupby(level='Variation', observed=True, dropna=False)[
+            ['visits|start', 'bounce_visits', 'rows', 'error_steps']].sum()
+        return totals.rename(columns={'visits|start': 'starts', 'bounce_visits': 'bounces', 'rows': 'events',
+                                      'error_steps': 'backward_steps'})
+
+    @profiled()
+    def compute_navigation_sketches(self, filters):
+        from Vanguard_quantiles import get_quantile_cube
+        quantiles = get_quantile_cube(self.data)
+        return quantiles.sketches(quantiles.select(*filters))
+
+    @profiled()
+    def step_time_samples(self, filters):
+        return step_time_samples(self.frame(filters, ['Variation'] + TRANSITION_COLUMNS + TIME_COLUMNS))
+
+    @profiled()
+    def client(self, client_id):
+        from Vanguard_clients import get_client_index
+        return get_client_index(self.data).summary(client_id)
+
+
+class SketchEngine(Engine):
+    # Approximate answers from HyperLogLog sketches and a client sample (Vanguard_sketch);
+    # summary() adds a '<column> Error' bound for every estimated card, error_rate_bound() the error rate's
+    name = 'sketch'
+
+    def __init__(self, data):
+        from Vanguard_sketch import get_sketch_cube
+        super().__init__()
+        self.data = data
+        self.sketch = get_sketch_cube(data)
+
+    def age_range(self):
+        return int(self.data['clnt_age'].min()), int(self.data['clnt_age'].max())
+
+    @profiled()
+    def compute_funnel_table(self, filters):
+        from Vanguard_sketch import sketch_funnel
+        return sketch_funnel(self.sketch, self.sketch.select(*filters))
+
+    @profiled()
+    def compute_summary(self, filters):
+        from Vanguard_sketch import sketch_summary
+        return sketch_summary(self.sketch, self.sketch.select(*filters))
+
+    @profiled()
+    def compute_visit_totals(self, filters):
+        from Vanguard_sketch import sketch_visit_totals
+        return sketch_visit_totals(self.sketch, self.sketch.select(*filters))
+
+    def error_rate_bound(self, filters):
+        from Vanguard_sketch import sketch_error_rate_bound
+        return float(sketch_error_rate_bound(self.visit_totals(filters)))
+
+    @profiled()
+    def compute_navigation_sketches(self, filters):
+        from Vanguard_quantiles import get_quantile_cube
+        quantiles = get_quantile_cube(self.data)
+        return quantiles.sketches(quantiles.select(*filters))
+
+    @profiled()
+    def client(self, client_id):
+        from Vanguard_clients import get_client_index
+        return get_client_index(self.data).summary(client_id)
+
+
+def _quote(column):
+    return '"%s"' % column.replace('"', '""')
+
+
+def _sum_of(columns):
+    return ' + '.join('coalesce(CAST(%s AS DOUBLE), 0)' % _quote(column) for column in columns)
+
+
+class DuckDBEngine(Engine):
+    name = 'duckdb'
+
+    def __init__(self, source, threads=None):
+        import duckdb
+        super().__init__()
+        self.source = source
+        self.connection = duckdb.connect()
+        if threads:
+            self.connection.execute('SET threads = %d' % int(threads))
+        self.relation = "read_parquet(%s, filename = true, file_row_number = true)" % self._literal(source)
+
+    def version(self):
+        paths = sorted(glob.glob(self.source))
+        return tuple((path, os.stat(path).st_mtime_ns) for path in paths)
+
+    @staticmethod
+    def _literal(text):
+        return "'%s'" % str(text).replace("'", "''")
+
+    def _query(self, sql, parameters=()):
+        # One cursor per query: Streamlit runs every session in its own thread
+        return self.connection.cursor().execute(sql, list(parameters)).df()
+
+    def _where(self, filters):
+        min_age, max_age, variation, gender = filters
+        clauses, parameters = ['clnt_age >= ?', 'clnt_age <= ?'], [min_age, max_age]
+        if variation != 'All':
+            clauses.append('Variation = ?')
+            parameters.append(variation)
+        if gender != 'All':
+            clauses.append('gendr = ?')
+            parameters.append(GENDER_CODES.get(gender, gender))
+        return ' AND '.join(clauses), parameters
+
+    def age_range(self):
+        ages = self._query('SELECT min(clnt_age) AS low, max(clnt_age) AS high FROM %s' % self.relation)
+        return int(ages['low'][0]), int(ages['high'][0])
+
+    @profiled()
+    def compute_funnel_table(self, filters):
+        where, parameters = self._where(filters)
+        time = '(%s)' % _sum_of(TIME_COLUMNS)
+        table = self._query('''
+            SELECT Variation, process_step AS step,
+                   count(*) AS events,
+                   count(DISTINCT visit_id) AS visits,
+                   sum(%s) AS forward,
+                   sum(%s) AS dropoff,
+                   sum(%s) AS time,
+                   sum(%s * %s) AS time_sq
+            FROM %s
+            WHERE %s AND process_step IN (%s)
+            GROUP BY Variation, process_step
+        ''' % (_sum_of(TRANSITION_COLUMNS), _sum_of(DROPOFF_COLUMNS), time, time, time, self.relation, where,
+               ', '.join(self._literal(step) for step in STEP_ORDER)), parameters)
+        table['step'] = pd.Categorical(table['step'], categories=STEP_ORDER, ordered=True)
+        table[['events', 'visits', 'forward', 'dropoff']] = table[['events', 'visits', 'forward', 'dropoff']].astype(np.int64)
+        return table.sort_values(['Variation', 'step']).reset_index(drop=True)[['Variation', 'step'] + FUNNEL_MEASURES]
+
+    @profiled()
+    def compute_summary(self, filters):
+        where, parameters = self._where(filters)
+        distinct = ', '.join(
+            ["count(DISTINCT client_id) FILTER (WHERE gendr = '%s') AS \"%s\"" % (code, code) for code in SUMMARY_GENDERS] +
+            ["count(DISTINCT client_id) FILTER (WHERE Variation = '%s') AS \"%s\"" % (group, group) for group in ['Control', 'Test']])
+        row = self._query('''
+            SELECT count(DISTINCT client_id) AS clients, avg(clnt_age) AS age, avg(clnt_tenure_yr) AS tenure, %s
+            FROM %s WHERE %s
+        ''' % (distinct, self.relation, where), parameters).iloc[0]
+        clients = int(row['clients'])
+        genders = {code: int(row[code]) for code in SUMMARY_GENDERS}
+        variations = {group: int(row[group]) for group in ['Control', 'Test']}
+        age = np.nan if pd.isna(row['age']) else row['age']
+        tenure = np.nan if pd.isna(row['tenure']) else row['tenure']
+        return _summary_frame(clients, age, tenure, genders, variations)
+
+    @profiled()
+    def compute_visit_totals(self, filters):
+        where, parameters = self._where(filters)
+        positions = ' '.join("WHEN '%s' THEN %d" % (step, position) for position, step in enumerate(STEP_ORDER))
+        totals = self._query('''
+            WITH events AS (
+                SELECT visit_id, Variation, process_step, date_time, filename, file_row_number,
+                       CASE process_step %s END AS position,
+                       lag(CASE process_step %s END) OVER (
+                           PARTITION BY visit_id ORDER BY date_time, filename, file_row_number) AS previous
+                FROM %s WHERE %s
+            ), visits AS (
+                SELECT visit_id,
+                       first(Variation ORDER BY date_time, filename, file_row_number) AS Variation,
+                       count(*) AS events,
+                       count(DISTINCT process_step) AS steps,
+                       bool_or(position = 0) AS has_start,
+                       count(*) FILTER (WHERE position < previous) AS backward_steps
+                FROM events GROUP BY visit_id
+            )
+            SELECT Variation,
+                   count(*) FILTER (WHERE has_start) AS starts,
+                   count(*) FILTER (WHERE steps = 1) AS bounces,
+                   sum(events) AS events,
+                   sum(backward_steps) AS backward_steps
+            FROM visits GROUP BY Variation
+        ''' % (positions, positions, self.relation, where), parameters)
+        totals = totals.astype({'starts': np.int64, 'bounces': np.int64, 'events': np.int64, 'backward_steps': np.int64})
+        return totals.set_index('Variation')
+
+    @profiled()
+    def compute_navigation_sketches(self, filters):
+        # Bucketed in SQL, so only the (Variation, step, bucket) counts come back
+        from Vanguard_funnel import VARIATIONS
+        from Vanguard_quantiles import TIME_STEPS, MIN_TIME, quantile_accuracy, n_buckets
+        where, parameters = self._where(filters)
+        buckets = n_buckets()
+        gamma = (1 + quantile_accuracy) / (1 - quantile_accuracy)
+        counts = self._query('''
+            WITH moves AS (
+                SELECT Variation, process_step AS step, %s AS time
+                FROM %s
+                WHERE %s AND process_step IN (%s) AND %s > 0
+            )
+            SELECT Variation, step,
+                   CASE WHEN time >= %r THEN least(ceil(ln(time / %r) / ln(%r)), %d) + 1 ELSE 0 END AS bucket,
+                   count(*) AS moves
+            FROM moves GROUP BY ALL
+        ''' % (_sum_of(TIME_COLUMNS), self.relation, where, ', '.join(self._literal(step) for step in TIME_STEPS),
+               _sum_of(TRANSITION_COLUMNS), MIN_TIME, MIN_TIME, gamma, buckets - 2), parameters)
+        sketches = np.zeros((len(VARIATIONS), len(TIME_STEPS), buckets))
+        group = pd.Index(VARIATIONS).get_indexer(counts['Variation'])
+        step = pd.Index(TIME_STEPS).get_indexer(counts['step'])
+        known = group >= 0
+        np.add.at(sketches, (group[known], step[known], counts['bucket'].to_numpy(dtype=np.int64)[known]),
+                  counts['moves'].to_numpy(dtype=float)[known])
+        return sketches
+
+    @profiled()
+    def client(self, client_id):
+        from Vanguard_core import get_individual
+        rows = self._query('SELECT * EXCLUDE (filename, file_row_number) FROM %s WHERE client_id = ? '
+                           'ORDER BY filename, file_row_number' % self.relation, [client_id])
+        if rows.empty:
+            return None
+        return get_individual(rows)
+
+
+def default_parquet_source(path=None):
+    # The Final_DF Parquet cache, built from the CSV the first time
+    from Vanguard_ingest import cache_paths, load_final_df
+    if path is None:
+        from Vanguard_core import data_path
+        path = data_path()
+    parquet_path, _ = cache_paths(path)
+    if not os.path.exists(parquet_path):
+        load_final_df(path)
+    return parquet_path
+
+
+IN_MEMORY_ENGINES = {'pandas': PandasEngine, 'sketch': SketchEngine}
+
+
+def get_engine(name=None, data=None, source=None):
+    name = name or engine_name
+    if name in IN_MEMORY_ENGINES:
+        if data is None:
+            from Vanguard_core import load_data
+            data = load_data()
+        key = (name, id(data))
+    elif name == 'duckdb':
+        source = source or parquet_source or default_parquet_source()
+        key = (name, source)
+    else:
+        raise ValueError(f'unknown engine {name!r}, expected pandas, sketch or duckdb')
+
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None or (name in IN_MEMORY_ENGINES and engine.data is not data):
+            engine = IN_MEMORY_ENGINES[name](data) if name in IN_MEMORY_ENGINES else DuckDBEngine(source, duckdb_threads)
+            if name in IN_MEMORY_ENGINES:
+                # Only the current frame is kept
+                for stale in [other for other in _engines if other[0] == name]:
+                    del _engines[stale]
+            _engines[key] = engine
+    return engine
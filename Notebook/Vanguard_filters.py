@@ -0,0 +1,141 @@
+import argparse
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Row selection for the sidebar filters without copying the frame per filter.
+# Built once per loaded frame (or store version):
+#  - one packed bitmap (np.packbits, 1 bit per row) per Variation and gendr value
+#  - the row ids ordered by clnt_age, so an age range is a binary search
+#    giving one contiguous slice of that ordering
+# A sidebar combination is the age bitmap ANDed with the value bitmaps, and
+# the result is the sorted row ids of the selection. Metrics then gather the
+# columns they need once (take), instead of every chained boolean index
+# copying the whole frame. The dashboard metrics come from the segment cube;
+# the ones it cannot hold (the raw step times behind the bootstrap CIs of
+# the tests) read their rows through PandasEngine.frame. Recent selections
+# are kept per filter tuple, shared by every session thread.
+
+GENDER_CODES = {'Male': 'M', 'Female': 'F', 'Unknown': 'U'}
+
+FILTER_COLUMNS = ['Variation', 'gendr']
+
+SELECTION_CACHE_ENTRIES = 32
+
+# (data, index) for the last frame the index was built from
+_built = (None, None)
+
+
+def _value_codes(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    codes, categories = pd.factorize(column, sort=True)
+    return codes, categories
+
+
+class FilterIndex:
+    def __init__(self, data):
+        self.rows = len(data)
+        self.bitmaps = {}
+        for column in FILTER_COLUMNS:
+            codes, categories = _value_codes(data[column])
+            self.bitmaps[column] = {value: np.packbits(codes == code) for code, value in enumerate(categories)}
+        ages = data['clnt_age'].to_numpy()
+        self.age_order = np.argsort(ages, kind='stable')
+        self.sorted_ages = ages[self.age_order]
+        self.all_rows = np.packbits(np.ones(self.rows, dtype=bool))
+        self.none_rows = np.zeros_like(self.all_rows)
+        self.selections = OrderedDict()
+        self.lock = threading.Lock()
+
+    def age_bitmap(self, min_age, max_age):
+        low = np.searchsorted(self.sorted_ages, min_age, side='left')
+        high = np.searchsorted(self.sorted_ages, max_age, side='right')
+        if low == 0 and high == self.rows:
+            return self.all_rows
+        mask = np.zeros(self.rows, dtype=bool)
+        mask[self.age_order[low:high]] = True
+        return np.packbits(mask)
+
+    def value_bitmap(self, column, value):
+        return self.bitmaps[column].get(value, self.none_rows)
+
+    def bitmap(self, min_age, max_age, variation='All', gender='All'):
+        bits = self.age_bitmap(min_age, max_age)
+        if variation != 'All':
+            bits = bits & self.value_bitmap('Variation', variation)
+        if gender != 'All':
+            bits = bits & self.value_bitmap('gendr', GENDER_CODES.get(gender, gender))
+        return bits
+
+    def select(self, min_age, max_age, variation='All', gender='All'):
+        # Sorted row positions of the selection, or None when every row matches
+        key = (min_age, max_age, variation, gender)
+        with self.lock:
+            if key in self.selections:
+                self.selections.move_to_end(key)
+                return self.selections[key]
+        bits = self.bitmap(*key)
+        rows = None
+        if bits is not self.all_rows:
+            rows = np.flatnonzero(np.unpackbits(bits, count=self.rows))
+            if len(rows) == self.rows:
+                rows = None
+        with self.lock:
+            self.selections[key] = rows
+            while len(self.selections) > SELECTION_CACHE_ENTRIES:
+                self.selections.popitem(last=False)
+        return rows
+
+    def count(self, min_age, max_age, variation='All', gender='All'):
+        rows = self.select(min_age, max_age, variation, gender)
+        return self.rows if rows is None else len(rows)
+
+
+def get_filter_index(data):
+    global _built
+    if _built[0] is not data:
+        _built = (data, FilterIndex(data))
+    return _built[1]
+
+
+def take(data, rows, columns=None):
+    # One gather of the needed columns; the frame itself when every row is selected
+    frame = data if columns is None else data[list(columns)]
+    return frame if rows is None else frame.take(rows)
+
+
+def filter_frame(data, min_age, max_age, variation='All', gender='All', columns=None):
+    # Same rows as the sidebar's chained filters, in the same order
+    return take(data, get_filter_index(data).select(min_age, max_age, variation, gender), columns)
+
+
+def main():
+    from Vanguard_ingest import load_final_df
+    from Vanguard_benchmark import SCENARIOS, filter_data
+    parser = argparse.ArgumentParser(description='Time the filter index against chained boolean filtering.')
+    parser.add_argument('path', help='Final_DF CSV')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    data = load_final_df(args.path)
+    start = time.perf_counter()
+    index = get_filter_index(data)
+    print('index built in %.1f ms' % ((time.perf_counter() - start) * 1000))
+    for scenario, bounds in SCENARIOS.items():
+        timings = {}
+        for name, select in (('chained', lambda: filter_data(data, *bounds)),
+                             ('bitmap', lambda: (index.selections.clear(), index.select(*bounds)))):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                select()
+            timings[name] = (time.perf_counter() - start) / args.repeat * 1000
+        same = filter_data(data, *bounds).index.equals(filter_frame(data, *bounds).index)
+        print('%-18s rows %9d  chained %8.2f ms  bitmap %8.3f ms  same %s' % (
+            scenario, index.count(*bounds), timings['chained'], timings['bitmap'], same))
+
+
+if __name__ == '__main__':
+    main()
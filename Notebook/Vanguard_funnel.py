@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+# Single-pass funnel engine. One grouped aggregation over (by..., process_step)
+# yields a tidy table with, for every step: events, distinct visits, forward
+# transitions to the next step, dropoffs and the sum and sum of squares of the
+# time spent before moving on.
+# Every column is additive across groups, so tables can be summed freely.
+
+# (process_step value, short name used in the Final_DF column names)
+FUNNEL_STEPS = [('start', 'start'), ('step_1', 'step1'), ('step_2', 'step2'), ('step_3', 'step3'), ('confirm', 'confirm')]
+STEP_ORDER = [step for step, _ in FUNNEL_STEPS]
+VARIATIONS = ['Control', 'Test']
+
+TRANSITION_COLUMNS = ['process_%s-%s' % (short, FUNNEL_STEPS[i + 1][1]) for i, (_, short) in enumerate(FUNNEL_STEPS[:-1])]
+DROPOFF_COLUMNS = ['process_%s-dropoff' % short for _, short in FUNNEL_STEPS[:-1]]
+TIME_COLUMNS = ['%s_time' % short for _, short in FUNNEL_STEPS[:-1]]
+
+STEP_LABELS = [short.capitalize() for _, short in FUNNEL_STEPS[:-1]]
+DROP_LABELS = ['%s-%s' % (short.capitalize(), FUNNEL_STEPS[i + 1][1].capitalize()) for i, (_, short) in enumerate(FUNNEL_STEPS[:-1])]
+
+FUNNEL_MEASURES = ['events', 'visits', 'forward', 'dropoff', 'time', 'time_sq']
+
+
+def _row_sum(data, columns):
+    present = [column for column in columns if column in data.columns]
+    if not present:
+        return np.zeros(len(data))
+    return data[present].to_numpy().sum(axis=1)
+
+
+def funnel_table(data, by=('Variation',)):
+    by = list(by)
+    # Each row carries at most one transition/dropoff flag and it belongs to its own
+    # process_step, so collapsing the per-step columns keeps every step's totals intact
+    time = _row_sum(data, TIME_COLUMNS).astype(float)
+    rows = data[by + ['process_step', 'visit_id']].assign(
+        forward=_row_sum(data, TRANSITION_COLUMNS),
+        dropoff=_row_sum(data, DROPOFF_COLUMNS),
+        time=time,
+        time_sq=time * time)
+    table = rows.groupby(by + ['process_step'], observed=True, dropna=False).agg(
+        events=('visit_id', 'size'),
+        visits=('visit_id', 'nunique'),
+        forward=('forward', 'sum'),
+        dropoff=('dropoff', 'sum'),
+        time=('time', 'sum'),
+        time_sq=('time_sq', 'sum')).reset_index()
+    table = table.rename(columns={'process_step': 'step'})
+    table = table[table['step'].isin(STEP_ORDER)]
+    table['step'] = pd.Categorical(table['step'].astype(str), categories=STEP_ORDER, ordered=True)
+    return table.sort_values(by + ['step']).reset_index(drop=True)
+
+
+def _by_variation(table):
+    # Variation x step grid of every measure, with Control/Test always present
+    table = table.dropna(subset=['Variation'])
+    grid = table.assign(Variation=table['Variation'].astype(str), step=table['step'].astype(str)).groupby(
+        ['Variation', 'step'])[FUNNEL_MEASURES].sum()
+    variations = list(dict.fromkeys(VARIATIONS + list(grid.index.get_level_values('Variation'))))
+    full_index = pd.MultiIndex.from_product([variations, STEP_ORDER], names=['Variation', 'step'])
+    return grid.reindex(full_index, fill_value=0), variations
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+
+
+def funnel_confirmation_rates(table):
+    grid, variations = _by_variation(table)
+    rates = {}
+    for group in variations:
+        start = grid.loc[(group, STEP_ORDER[0]), 'visits']
+        confirm = grid.loc[(group, STEP_ORDER[-1]), 'visits']
+        # A group without any start or confirm visit has no rate
+        rates[group] = confirm / start if start > 0 and confirm > 0 else np.nan
+    return rates
+
+
+def funnel_drop_rates(table):
+    grid, variations = _by_variation(table)
+    drop_rates = pd.DataFrame({'Step': DROP_LABELS})
+    for group in variations:
+        steps = grid.loc[group].loc[STEP_ORDER[:-1]]
+        drops = steps['dropoff'].to_numpy(dtype=float)
+        drop_rates[group] = _ratio(100 * drops, drops + steps['forward'].to_numpy(dtype=float))
+    return drop_rates
+
+
+def funnel_navigation_times(table):
+    grid, variations = _by_variation(table)
+    avg_times = pd.DataFrame({'Step': STEP_LABELS})
+    for group in variations:
+        steps = grid.loc[group].loc[STEP_ORDER[:-1]]
+        avg_times[group] = _ratio(steps['time'], steps['forward'])
+    return avg_times
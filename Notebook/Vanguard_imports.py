@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+# Import-time budget check. Each module is imported in a fresh interpreter
+# (so nothing is cached in sys.modules), timed, and checked for the heavy
+# packages the compute modules must never pull in at import time. Exits 1
+# when a module is over budget or loads one of them, so it can run next to
+# the benchmarks in CI:
+#
+#   python Vanguard_imports.py
+#   python Vanguard_imports.py Vanguard_core --budget 0.5
+
+# Modules workers, batch jobs and the report CLI import; they must stay pandas/numpy only
+LIGHT_MODULES = ['Vanguard_core', 'Vanguard_backend', 'Vanguard_engine', 'Vanguard_stats', 'Vanguard_cube',
+                 'Vanguard_segments', 'Vanguard_incremental', 'Vanguard_report', 'Vanguard_store',
+                 'Vanguard_filters', 'Vanguard_sketch', 'Vanguard_quantiles']
+
+# Loaded lazily, on first use only
+HEAVY_MODULES = ['streamlit', 'matplotlib', 'seaborn', 'statsmodels', 'scipy', 'dotenv']
+
+import_budget = float(os.getenv('IMPORT_BUDGET', 1.0))
+DEFAULT_REPEAT = 3
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def cold_import(module, heavy=HEAVY_MODULES):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=heavy)], cwd=directory,
+                            capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': directory})
+    if result.returncode:
+        raise RuntimeError(f'importing {module} failed:\n{result.stderr}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check(modules=None, budget=None, repeat=DEFAULT_REPEAT):
+    # Median cold import time per module and the heavy packages it loaded; returns (results, failures)
+    budget = import_budget if budget is None else budget
+    results, failures = [], []
+    for module in modules or LIGHT_MODULES:
+        runs = [cold_import(module) for _ in range(repeat)]
+        result = {'module': module, 'seconds': float(np.median([run['seconds'] for run in runs])),
+                  'heavy': runs[0]['heavy'], 'budget': budget}
+        results.append(result)
+        if result['seconds'] > budget:
+            failures.append('%s imports in %.3fs, over the %.3fs budget' % (module, result['seconds'], budget))
+        if result['heavy']:
+            failures.append('%s loads %s at import' % (module, ', '.join(result['heavy'])))
+    return results, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail when a module imports too slowly or loads heavy packages.')
+    parser.add_argument('modules', nargs='*', help=f'modules to check (default: {" ".join(LIGHT_MODULES)})')
+    parser.add_argument('--budget', type=float, default=None, help=f'seconds per module (default: {import_budget})')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    args = parser.parse_args()
+
+    results, failures = check(args.modules, args.budget, args.repeat)
+    for result in results:
+        print('%-22s %6.3fs  %s' % (result['module'], result['seconds'], ', '.join(result['heavy']) or '-'))
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
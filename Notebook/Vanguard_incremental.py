@@ -0,0 +1,364 @@
+import argparse
+import io
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER, FUNNEL_MEASURES, VARIATIONS, funnel_confirmation_rates, funnel_drop_rates, \
+    funnel_navigation_times
+from Vanguard_stats import MSPRT_EFFECT, sequential_tests
+from Vanguard_quantiles import TIME_STEPS, quantile_accuracy, n_buckets, bucket_keys, quantile_table
+
+# Incremental funnel aggregation for a growing event file (raw web logs or
+# Final_DF). The state keeps the per-variation funnel counts of
+# Vanguard_funnel.funnel_table (events, distinct visits, forward moves,
+# dropoffs, step time sums), the quantile sketch of every step's navigation
+# times (Vanguard_quantiles; buckets are fixed, so each load adds its moves to
+# the sketch) and, per open visit, its variation, the set of steps
+# it touched and its last event. A refresh reads only the bytes appended
+# since the checkpoint:
+#  - the last event of a visit has no lead yet, so it counts as a dropoff
+#    until the visit's next event arrives and turns it into a forward move
+#    (or neither), exactly like a full recompute of the rows seen so far
+#  - distinct visits per step and bounces come from the per-visit step sets
+# Events older than their visit's last consumed event are applied in arrival
+# order and counted as late_events; the web exports keep visits together, so
+# this should stay at zero.
+#
+# Visits are kept sorted by id and looked up with a binary search. A visit
+# with no event in the VISIT_EXPIRY_HOURS before the newest consumed event
+# is closed and dropped from the state, so a refresh costs the open visits
+# and not the whole history; an event that still arrives for it starts a
+# new visit. Vanguard visits last minutes, so the default never changes
+# the counts.
+#
+# Sequential tests: every refresh is a look of the mSPRT in Vanguard_stats and
+# the state keeps the running minimum p-value, which stays valid however often
+# the experiment is checked.
+#
+#   python Vanguard_incremental.py web_events.csv --state-dir .vanguard_live --watch 60
+
+incremental_directory = os.getenv('INCREMENTAL_DIR', '.vanguard_live')
+visit_expiry_hours = float(os.getenv('VISIT_EXPIRY_HOURS', 24))
+
+STATE_FILE = 'state.json'
+READ_CHUNK_ROWS = 500_000
+# Bit of the visit step set used for any process_step outside the funnel
+OTHER_STEP = len(STEP_ORDER)
+LAST_FUNNEL_STEP = len(STEP_ORDER) - 1
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.int8)
+# Per open visit, in visit id order
+VISIT_ARRAYS = ('visit_ids', 'variation', 'step_mask', 'last_step', 'last_time')
+
+
+class IncrementalFunnel:
+    def __init__(self, effect=MSPRT_EFFECT):
+        # Variation x measure x step, in FUNNEL_MEASURES order
+        self.counts = np.zeros((len(VARIATIONS), len(FUNNEL_MEASURES), len(STEP_ORDER)))
+        self.bounces = np.zeros(len(VARIATIONS))
+        self.accuracy = quantile_accuracy
+        # Variation x step x bucket
+        self.time_sketch = np.zeros((len(VARIATIONS), len(TIME_STEPS), n_buckets(self.accuracy)))
+        self.checkpoint = {'path': None, 'inode': None, 'offset': 0, 'header': None}
+        self.stats = {'rows': 0, 'late_events': 0, 'looks': 0, 'expired_visits': 0}
+        self.effect = effect
+        self.min_p_values = {}
+        self.generation = 0
+        # Per open visit, sorted by visit id
+        self.visit_ids = np.zeros(0, dtype=str)
+        self.variation = np.zeros(0, dtype=np.int8)
+        self.step_mask = np.zeros(0, dtype=np.uint8)
+        self.last_step = np.zeros(0, dtype=np.int8)
+        self.last_time = np.zeros(0, dtype=np.int64)
+
+    def _measure(self, name):
+        return FUNNEL_MEASURES.index(name)
+
+    def _find(self, visit_ids):
+        # Slot of every id among the open visits, -1 for the ones not in the state
+        slots = np.searchsorted(self.visit_ids, visit_ids)
+        found = slots < len(self.visit_ids)
+        found[found] = self.visit_ids[slots[found]] == visit_ids[found]
+        return np.where(found, slots, -1)
+
+    def _insert(self, visit_ids, *values):
+        # Merges new visits, sorted by id, into the open visits
+        size = len(self.visit_ids) + len(visit_ids)
+        inserted = np.searchsorted(self.visit_ids, visit_ids) + np.arange(len(visit_ids))
+        kept = np.ones(size, dtype=bool)
+        kept[inserted] = False
+        for name, new in zip(VISIT_ARRAYS, (visit_ids,) + values):
+            old = getattr(self, name)
+            merged = np.empty(size, dtype=np.result_type(old, new))
+            merged[kept] = old
+            merged[inserted] = new
+            setattr(self, name, merged)
+
+    def _expire(self):
+        # Drops the visits whose last event is more than visit_expiry_hours before the newest one
+        if not len(self.last_time):
+            return
+        open_visits = self.last_time >= self.last_time.max() - int(visit_expiry_hours * 3600e9)
+        if open_visits.all():
+            return
+        self.stats['expired_visits'] = self.stats.get('expired_visits', 0) + int((~open_visits).sum())
+        for name in VISIT_ARRAYS:
+            setattr(self, name, getattr(self, name)[open_visits])
+
+    def consume(self, rows):
+        # rows: visit_id, process_step, date_time, Variation, in file order
+        rows = rows[rows['Variation'].isin(VARIATIONS)]
+        if rows.empty:
+            return 0
+        visit_codes, visit_ids = pd.factorize(rows['visit_id'])
+        visit_ids = np.asarray(visit_ids, dtype=str)
+        n_visits = len(visit_ids)
+        times = pd.to_datetime(rows['date_time']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        steps = pd.Categorical(rows['process_step'], categories=STEP_ORDER).codes.astype(np.int8)
+        variation = pd.Categorical(rows['Variation'], categories=VARIATIONS).codes.astype(np.int8)
+
+        slots = self._find(visit_ids)
+        known = np.flatnonzero(slots >= 0)
+        first_times = np.full(n_visits, np.iinfo(np.int64).max)
+        np.minimum.at(first_times, visit_codes, times)
+        self.stats['late_events'] += int((first_times[known] < self.last_time[slots[known]]).sum())
+
+        # The last consumed event of every known visit goes first, then the new rows by time
+        all_codes = np.concatenate([known, visit_codes])
+        all_steps = np.concatenate([self.last_step[slots[known]], steps])
+        all_times = np.concatenate([self.last_time[slots[known]], times])
+        all_variation = np.concatenate([self.variation[slots[known]], variation])
+        is_new = np.concatenate([np.zeros(len(known), dtype=np.int8), np.ones(len(rows), dtype=np.int8)])
+        order = np.lexsort((all_times, is_new, all_codes))
+        all_codes, all_steps, all_times, all_variation, is_new = (
+            values[order] for values in (all_codes, all_steps, all_times, all_variation, is_new))
+        has_next = np.zeros(len(order), dtype=bool)
+        has_next[:-1] = all_codes[1:] == all_codes[:-1]
+
+        counts = self.counts
+        funnel_step = (all_steps >= 0) & (all_steps < LAST_FUNNEL_STEP)
+        # Forward moves and the time spent on the step before them
+        forward = np.flatnonzero(has_next & funnel_step)
+        forward = forward[all_steps[forward + 1] == all_steps[forward] + 1]
+        elapsed = np.nan_to_num((all_times[forward + 1] - all_times[forward]) / 1e9)
+        index = (all_variation[forward], all_steps[forward])
+        np.add.at(counts[:, self._measure('forward')], index, 1)
+        np.add.at(counts[:, self._measure('time')], index, elapsed)
+        np.add.at(counts[:, self._measure('time_sq')], index, elapsed * elapsed)
+        np.add.at(self.time_sketch, index + (bucket_keys(elapsed, self.accuracy),), 1)
+        # Previous last events now have a lead and stop being dropoffs; new last events are
+        resolved = np.flatnonzero((is_new == 0) & funnel_step)
+        np.add.at(counts[:, self._measure('dropoff')], (all_variation[resolved], all_steps[resolved]), -1)
+        pending = np.flatnonzero(~has_next & funnel_step)
+        np.add.at(counts[:, self._measure('dropoff')], (all_variation[pending], all_steps[pending]), 1)
+        counted = steps >= 0
+        np.add.at(counts[:, self._measure('events')], (variation[counted], steps[counted]), 1)
+
+        # Step sets: a visit counts once per step, a bounce is a visit with a single step
+        batch_mask = np.zeros(n_visits, dtype=np.uint8)
+        np.bitwise_or.at(batch_mask, visit_codes, np.left_shift(1, np.where(steps >= 0, steps, OTHER_STEP)).astype(np.uint8))
+        old_mask = np.zeros(n_visits, dtype=np.uint8)
+        old_mask[known] = self.step_mask[slots[known]]
+        new_mask = old_mask | batch_mask
+        visit_variation = np.empty(n_visits, dtype=np.int8)
+        visit_variation[visit_codes[::-1]] = variation[::-1]
+        visit_variation[known] = self.variation[slots[known]]
+        added = new_mask & ~old_mask
+        for step in range(len(STEP_ORDER)):
+            counts[:, self._measure('visits'), step] += np.bincount(
+                visit_variation, weights=(added >> step) & 1, minlength=len(VARIATIONS))
+        bounce_change = (_POPCOUNT[new_mask] == 1).astype(int) - (_POPCOUNT[old_mask] == 1).astype(int)
+        self.bounces += np.bincount(visit_variation, weights=bounce_change, minlength=len(VARIATIONS))
+
+        # Every visit's state moves to its last event; new visits are merged in, closed ones dropped
+        last = ~has_next
+        last_step = np.empty(n_visits, dtype=np.int8)
+        last_time = np.empty(n_visits, dtype=np.int64)
+        last_step[all_codes[last]] = all_steps[last]
+        last_time[all_codes[last]] = all_times[last]
+        self.step_mask[slots[known]] = new_mask[known]
+        self.last_step[slots[known]] = last_step[known]
+        self.last_time[slots[known]] = last_time[known]
+        new_visits = np.flatnonzero(slots < 0)
+        new_visits = new_visits[np.argsort(visit_ids[new_visits], kind='stable')]
+        self._insert(visit_ids[new_visits], visit_variation[new_visits], new_mask[new_visits],
+                     last_step[new_visits], last_time[new_visits])
+        self._expire()
+        self.stats['rows'] += len(rows)
+        return len(rows)
+
+    def funnel_table(self):
+        # Same shape as funnel_table(data) over every row consumed so far
+        variation, measure, step = np.indices(self.counts.shape).reshape(3, -1)
+        table = pd.DataFrame({'Variation': np.array(VARIATIONS)[variation], 'step': np.array(STEP_ORDER)[step],
+                              'measure': np.array(FUNNEL_MEASURES)[measure], 'value': self.counts.ravel()})
+        table = table.pivot(index=['Variation', 'step'], columns='measure', values='value').reset_index()
+        for measure in ('events', 'visits', 'forward', 'dropoff'):
+            table[measure] = table[measure].round().astype(np.int64)
+        table['step'] = pd.Categorical(table['step'], categories=STEP_ORDER, ordered=True)
+        return table[['Variation', 'step'] + FUNNEL_MEASURES].sort_values(['Variation', 'step']).reset_index(drop=True)
+
+    def confirmation_rates(self):
+        return funnel_confirmation_rates(self.funnel_table())
+
+    def drop_rates(self):
+        return funnel_drop_rates(self.funnel_table())
+
+    def navigation_times(self):
+        return funnel_navigation_times(self.funnel_table())
+
+    def navigation_quantiles(self):
+        return quantile_table(self.time_sketch, self.accuracy)
+
+    def bounce_rates(self):
+        starts = self.counts[:, self._measure('visits'), 0]
+        return {group: 100 * self.bounces[index] / starts[index] if starts[index] > 0 else None
+                for index, group in enumerate(VARIATIONS)}
+
+    def look(self):
+        # One mSPRT look; p_value is the always-valid running minimum over all looks
+        tests = sequential_tests(self.funnel_table(), self.bounces, self.effect)
+        tests = tests.rename(columns={'p_value': 'look_p_value'})
+        keys = tests['metric'] + '|' + tests['step']
+        previous = keys.map(self.min_p_values).fillna(1.0)
+        tests['p_value'] = np.minimum(previous, tests['look_p_value'])
+        self.min_p_values = dict(zip(keys, tests['p_value'].astype(float)))
+        self.stats['looks'] += 1
+        return tests
+
+    def save(self, directory):
+        # Visit arrays go to a new generation file first, so a crash never pairs new counts with old visits
+        os.makedirs(directory, exist_ok=True)
+        generation = self.generation + 1
+        visits_name = 'visits.%d.npz' % generation
+        with open(os.path.join(directory, visits_name), 'wb') as handle:
+            np.savez(handle, time_sketch=self.time_sketch, **{name: getattr(self, name) for name in VISIT_ARRAYS})
+        state = {'generation': generation, 'visits': visits_name, 'counts': self.counts.tolist(),
+                 'bounces': self.bounces.tolist(), 'checkpoint': self.checkpoint, 'stats': self.stats,
+                 'effect': self.effect, 'min_p_values': self.min_p_values, 'quantile_accuracy': self.accuracy}
+        state_path = os.path.join(directory, STATE_FILE)
+        with open(state_path + '.tmp', 'w') as handle:
+            json.dump(state, handle, indent=2)
+        os.replace(state_path + '.tmp', state_path)
+        previous = os.path.join(directory, 'visits.%d.npz' % self.generation)
+        if self.generation and os.path.exists(previous):
+            os.remove(previous)
+        self.generation = generation
+
+    @classmethod
+    def load(cls, directory):
+        try:
+            with open(os.path.join(directory, STATE_FILE)) as handle:
+                state = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        funnel = cls(state['effect'])
+        funnel.counts = np.array(state['counts'], dtype=float)
+        funnel.bounces = np.array(state['bounces'], dtype=float)
+        funnel.checkpoint, funnel.stats = state['checkpoint'], state['stats']
+        funnel.min_p_values, funnel.generation = state['min_p_values'], state['generation']
+        funnel.accuracy = state.get('quantile_accuracy', quantile_accuracy)
+        with np.load(os.path.join(directory, state['visits'])) as visits:
+            # Sorted again for states saved before the visits were kept in id order
+            order = np.argsort(visits['visit_ids'], kind='stable')
+            for name in VISIT_ARRAYS:
+                setattr(funnel, name, visits[name][order])
+            if 'time_sketch' in visits.files:
+                funnel.time_sketch = visits['time_sketch']
+            else:
+                # State from before the sketches: only the moves consumed from now on are in them
+                funnel.time_sketch = np.zeros((len(VARIATIONS), len(TIME_STEPS), n_buckets(funnel.accuracy)))
+        return funnel
+
+
+def read_appended(path, checkpoint, chunk_rows=READ_CHUNK_ROWS):
+    # Chunks of the complete lines appended since the checkpoint; advances checkpoint['offset']
+    stat = os.stat(path)
+    if checkpoint['path'] is None:
+        checkpoint.update({'path': os.path.abspath(path), 'inode': stat.st_ino, 'offset': 0, 'header': None})
+    elif checkpoint['path'] != os.path.abspath(path) or checkpoint['inode'] != stat.st_ino or \
+            stat.st_size < checkpoint['offset']:
+        raise ValueError(f'{path} is not the file the state was built from, rebuild the state')
+    with open(path, 'rb') as handle:
+        handle.seek(checkpoint['offset'])
+        if checkpoint['header'] is None:
+            line = handle.readline()
+            if not line.endswith(b'\n'):
+                return
+            checkpoint['header'] = line.decode().strip().split(',')
+            checkpoint['offset'] = handle.tell()
+        appended = handle.read()
+    # A line still being written stays for the next refresh
+    complete = appended.rfind(b'\n') + 1
+    if not complete:
+        return
+    for chunk in pd.read_csv(io.BytesIO(appended[:complete]), names=checkpoint['header'], header=None,
+                             chunksize=chunk_rows):
+        yield chunk
+    checkpoint['offset'] += complete
+
+
+def refresh(path, state_dir=None, lookups=None, effect=MSPRT_EFFECT, rebuild=False):
+    # Consume what was appended to path since the last run, persist, and return (state, sequential tests).
+    # Raw web logs carry no Variation; lookups=(df_client, df_variation) merges them like the pipeline.
+    state_dir = state_dir or incremental_directory
+    funnel = None if rebuild else IncrementalFunnel.load(state_dir)
+    if funnel is None:
+        funnel = IncrementalFunnel(effect)
+    for chunk in read_appended(path, funnel.checkpoint):
+        if 'Variation' not in chunk.columns:
+            from Vanguard_pipeline import merge_chunk
+            chunk = merge_chunk(chunk, *lookups)
+        funnel.consume(chunk)
+    tests = funnel.look()
+    funnel.save(state_dir)
+    return funnel, tests
+
+
+def report(funnel, tests):
+    lines = ['rows %d  open visits %d  expired visits %d  late events %d  looks %d' % (
+        funnel.stats['rows'], len(funnel.visit_ids), funnel.stats.get('expired_visits', 0),
+        funnel.stats['late_events'], funnel.stats['looks'])]
+    rates = funnel.confirmation_rates()
+    bounces = funnel.bounce_rates()
+    lines.append('confirmation rate  Control %.4f  Test %.4f' % (rates['Control'], rates['Test']))
+    lines.append('bounce rate        Control %s  Test %s' % tuple(
+        '%.2f%%' % bounces[group] if bounces[group] is not None else 'n/a' for group in VARIATIONS))
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        lines.append(funnel.navigation_quantiles().to_string(index=False, float_format='%.1f'))
+        lines.append(tests.to_string(index=False))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the funnel metrics from events appended since the last run.')
+    parser.add_argument('path', nargs='?', help='growing event file (default: DIR + CSV5 from .env)')
+    parser.add_argument('--state-dir', default=None, help=f'where the state is kept (default: {incremental_directory})')
+    parser.add_argument('--raw', action='store_true', help='path is a raw web log, merge it with the CSV1/CSV2 lookups')
+    parser.add_argument('--effect', type=float, default=MSPRT_EFFECT,
+                        help='mSPRT mixing sd in per-observation sds; only used when the state is created')
+    parser.add_argument('--rebuild', action='store_true', help='drop the state and consume the file from the start')
+    parser.add_argument('--watch', type=float, default=None, help='refresh every this many seconds')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    path = args.path or os.getenv('DIR') + os.getenv('CSV5')
+    lookups = None
+    if args.raw:
+        from Vanguard_pipeline import load_lookups
+        lookups = load_lookups(os.getenv('DIR') + os.getenv('CSV1'), os.getenv('DIR') + os.getenv('CSV2'))
+
+    rebuild = args.rebuild
+    while True:
+        funnel, tests = refresh(path, args.state_dir, lookups, args.effect, rebuild)
+        rebuild = False
+        print(report(funnel, tests), flush=True)
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
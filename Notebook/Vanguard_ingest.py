@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import pandas as pd
+from Vanguard_compact import compact_frame
+from Vanguard_profile import profiled
+
+# Typed reader for Final_DF with a Parquet cache next to the source CSV.
+# The cache is rebuilt when the CSV changes (mtime/size, confirmed by hash)
+# and the parsed frame is memoized in-process so Streamlit reruns reuse it.
+# Rows are kept ordered by client_id so a client's events form one slice, and
+# the frame is compacted (see Vanguard_compact) before it is cached.
+
+SCHEMA_VERSION = 3
+
+STEP_ORDER = ['start', 'step_1', 'step_2', 'step_3', 'confirm']
+
+CATEGORY_COLUMNS = ['process_step', 'Variation', 'gendr']
+
+DATETIME_COLUMNS = ['date_time', 'leadtime']
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+FLAG_COLUMNS = [
+    'Variation_numeric',
+    'process_start', 'process_step1', 'process_step2', 'process_step3', 'process_confirm',
+    'process_start-step1', 'process_step1-step2', 'process_step2-step3', 'process_step3-confirm',
+    'process_start-dropoff', 'process_step1-dropoff', 'process_step2-dropoff', 'process_step3-dropoff'
+]
+
+SCHEMA = {**{column: 'category' for column in CATEGORY_COLUMNS},
+          **{column: 'int8' for column in FLAG_COLUMNS}}
+
+cache_directory = os.getenv('CACHE_DIR')
+
+# path -> (source stat, DataFrame)
+_loaded_frames = {}
+
+
+def read_final_df_csv(path):
+    header = pd.read_csv(path, nrows=0).columns
+    dtype = {column: kind for column, kind in SCHEMA.items() if column in header}
+    data = pd.read_csv(path, dtype=dtype)
+    for column in DATETIME_COLUMNS:
+        if column in data.columns:
+            data[column] = pd.to_datetime(data[column], format=DATETIME_FORMAT)
+    return data.sort_values('client_id', kind='stable', ignore_index=True)
+
+
+def _source_stat(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def cache_paths(path, cache_dir=None):
+    cache_dir = cache_dir or cache_directory or os.path.join(os.path.dirname(os.path.abspath(path)), '.vanguard_cache')
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, name + '.parquet'), os.path.join(cache_dir, name + '.meta.json')
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(meta_path, meta):
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump(meta, handle)
+    os.replace(tmp_path, meta_path)
+
+
+def _cache_is_fresh(path, stat, meta):
+    if meta is None or meta.get('schema_version') != SCHEMA_VERSION:
+        return False
+    if meta['source'] == stat:
+        return True
+    # Touched but possibly unchanged: only trust the cache if the content hash still matches
+    return meta['source']['size'] == stat['size'] and meta.get('sha256') == _file_digest(path)
+
+
+@profiled()
+def load_final_df(path, cache_dir=None):
+    stat = _source_stat(path)
+    loaded = _loaded_frames.get(path)
+    if loaded is not None and loaded[0] == stat:
+        return loaded[1]
+
+    if not _parquet_available():
+        data = compact_frame(read_final_df_csv(path))
+        _loaded_frames[path] = (stat, data)
+        return data
+
+    parquet_path, meta_path = cache_paths(path, cache_dir)
+    meta = _read_meta(meta_path)
+    if os.path.exists(parquet_path) and _cache_is_fresh(path, stat, meta):
+        data = pd.read_parquet(parquet_path)
+        if meta['source'] != stat:
+            meta['source'] = stat
+            _write_json(meta_path, meta)
+    else:
+        data = compact_frame(read_final_df_csv(path))
+        os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+        tmp_path = parquet_path + '.tmp'
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+        _write_json(meta_path, {'schema_version': SCHEMA_VERSION, 'source': stat, 'sha256': _file_digest(path)})
+
+    # The memoized frame is shared by every rerun and session, callers must not modify it in place
+    _loaded_frames[path] = (stat, data)
+    return data
+
+
+def clear_loaded():
+    _loaded_frames.clear()
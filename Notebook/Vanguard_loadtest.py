@@ -0,0 +1,250 @@
+import argparse
+import gc
+import heapq
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+# Headless load test for the dashboard. Every simulated analyst is an AppTest
+# session (streamlit.testing, Streamlit >= 1.28) running Vanguard_Frontend.py
+# in this process, so sessions share the module state (frame, cube, chart
+# cache) the way sessions of one server do. Each session replays a scripted
+# sequence of sidebar interactions (age slider, Variation/Gender selectboxes,
+# client search); the sessions are interleaved and every rerun is timed.
+#
+# AppTest runs one script at a time per process, so concurrency is not driven
+# with threads. Reruns of one server are serialized by the GIL anyway: the
+# measured rerun times are replayed through a single-server queue where each
+# analyst interacts again after an exponential think time, and the capacity
+# is the largest number of analysts whose p95 response time stays under the
+# target. Seeds are fixed, so the number is repeatable for a given dataset.
+#
+#   python Vanguard_loadtest.py --rows 1M --sessions 32 --think-time 10
+
+FRONTEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Vanguard_Frontend.py')
+
+DEFAULT_STEPS = 10
+DEFAULT_TARGET_P95 = 1.0
+DEFAULT_THINK_TIME = 10.0
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+# Interactions simulated per analyst at every concurrency level
+SIMULATED_REQUESTS = 200
+
+# Interaction -> share of the scripted steps
+INTERACTIONS = {'age_slider': 0.4, 'variation': 0.2, 'gender': 0.2, 'search': 0.15, 'clear_search': 0.05}
+VARIATION_OPTIONS = ['All', 'Control', 'Test']
+GENDER_OPTIONS = ['All', 'Male', 'Female', 'Unknown']
+
+
+def configure_dataset(path):
+    # The dashboard reads DIR/CSV5 when it first loads the data, so this runs before any session starts
+    directory, name = os.path.split(os.path.abspath(path))
+    os.environ['DIR'] = directory + os.sep
+    os.environ['CSV5'] = name
+
+
+def make_script(rng, steps, min_age, max_age, client_ids):
+    script = []
+    names = list(INTERACTIONS)
+    for name in rng.choice(names, size=steps, p=list(INTERACTIONS.values())):
+        if name == 'age_slider':
+            low, high = sorted(rng.integers(min_age, max_age + 1, size=2))
+            script.append((name, (int(low), int(high))))
+        elif name == 'variation':
+            script.append((name, str(rng.choice(VARIATION_OPTIONS))))
+        elif name == 'gender':
+            script.append((name, str(rng.choice(GENDER_OPTIONS))))
+        elif name == 'search':
+            # Mostly existing clients, sometimes an id that is not in the data
+            client_id = int(rng.choice(client_ids)) if rng.random() < 0.9 else int(rng.integers(1, 100))
+            script.append((name, str(client_id)))
+        else:
+            script.append((name, None))
+    return script
+
+
+def apply(app, action, value):
+    if action == 'age_slider':
+        app.sidebar.slider[0].set_value(value)
+    elif action == 'variation':
+        app.sidebar.selectbox[0].select(value)
+    elif action == 'gender':
+        app.sidebar.selectbox[1].select(value)
+    elif action == 'search':
+        app.sidebar.text_input[0].input(value)
+    elif action == 'clear_search':
+        app.sidebar.button[0].click()
+    else:
+        raise ValueError(f'unknown interaction {action}')
+
+
+def new_session(timeout):
+    from streamlit.testing.v1 import AppTest
+    return AppTest.from_file(FRONTEND, default_timeout=timeout)
+
+
+def replay(scripts, timeout):
+    # Interleave the sessions, one interaction each in turn; returns [(action, seconds)]
+    apps = [new_session(timeout) for _ in scripts]
+    timings = []
+    for app in apps:
+        start = time.perf_counter()
+        app.run()
+        timings.append(('load', time.perf_counter() - start))
+    for step in range(max(len(script) for script in scripts)):
+        for app, script in zip(apps, scripts):
+            if step >= len(script):
+                continue
+            action, value = script[step]
+            apply(app, action, value)
+            start = time.perf_counter()
+            app.run()
+            timings.append((action, time.perf_counter() - start))
+            if len(app.exception):
+                raise RuntimeError(f'{action}={value!r} raised: {app.exception[0].value}')
+    return timings
+
+
+def percentiles(seconds):
+    if not len(seconds):
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+    return {'count': len(seconds), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(np.max(seconds))}
+
+
+def session_memory(scripts, timeout):
+    # Bytes still allocated per idle session after it has replayed its script
+    sessions = []
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        for script in scripts:
+            app = new_session(timeout)
+            app.run()
+            for action, value in script:
+                apply(app, action, value)
+                app.run()
+            sessions.append(app)
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'sessions': len(sessions), 'retained_bytes_per_session': (after - before) / len(sessions),
+            'peak_bytes': peak - before}
+
+
+def simulate(service_times, analysts, think_time=DEFAULT_THINK_TIME, requests=SIMULATED_REQUESTS, seed=0):
+    # Response times of one server handling reruns in arrival order. Every analyst
+    # thinks, interacts, waits for the rerun to finish and thinks again.
+    rng = np.random.default_rng(seed)
+    arrivals = [(rng.exponential(think_time), analyst) for analyst in range(analysts)]
+    heapq.heapify(arrivals)
+    remaining = [requests] * analysts
+    free_at = 0.0
+    responses = []
+    while arrivals:
+        arrival, analyst = heapq.heappop(arrivals)
+        finished = max(arrival, free_at) + rng.choice(service_times)
+        free_at = finished
+        responses.append(finished - arrival)
+        remaining[analyst] -= 1
+        if remaining[analyst]:
+            heapq.heappush(arrivals, (finished + rng.exponential(think_time), analyst))
+    return np.array(responses), free_at
+
+
+def run(data_path, sessions=16, steps=DEFAULT_STEPS, concurrency=None, target_p95=DEFAULT_TARGET_P95,
+        think_time=DEFAULT_THINK_TIME, memory_sessions=4, seed=0, timeout=120, log=None):
+    configure_dataset(data_path)
+    from Vanguard_core import load_data
+    data = load_data()
+    rng = np.random.default_rng(seed)
+    min_age, max_age = int(data['clnt_age'].min()), int(data['clnt_age'].max())
+    client_ids = data['client_id'].unique()
+    scripts = [make_script(rng, steps, min_age, max_age, client_ids) for _ in range(sessions)]
+
+    # Warm the shared caches (frame, cube, indexes) so the sessions are not charged for them
+    replay([[]], timeout)
+
+    report = {'data': os.path.abspath(data_path), 'rows': len(data), 'sessions': sessions, 'steps': steps,
+              'seed': seed, 'target_p95': target_p95, 'think_time': think_time, 'levels': [], 'capacity': 0}
+
+    timings = replay(scripts, timeout)
+    by_action = {}
+    for action, seconds in timings:
+        by_action.setdefault(action, []).append(seconds)
+    service_times = np.array([seconds for action, seconds in timings if action != 'load'])
+    report['rerun'] = percentiles(service_times)
+    report['by_action'] = {action: percentiles(seconds) for action, seconds in by_action.items()}
+    if log:
+        log('rerun: p50 %.3fs  p95 %.3fs  p99 %.3fs over %d reruns' % (
+            report['rerun']['p50'], report['rerun']['p95'], report['rerun']['p99'], report['rerun']['count']))
+        for action, result in report['by_action'].items():
+            log('  %-13s p50 %.3fs  p95 %.3fs  (%d)' % (action, result['p50'], result['p95'], result['count']))
+
+    # After the replay, so shared chart renders are not charged to the measured sessions
+    if memory_sessions:
+        report['memory'] = session_memory(scripts[:memory_sessions], timeout)
+        if log:
+            log('memory per session: %.1f MiB retained, %.1f MiB peak over %d sessions' % (
+                report['memory']['retained_bytes_per_session'] / 2 ** 20, report['memory']['peak_bytes'] / 2 ** 20,
+                report['memory']['sessions']))
+
+    for level in concurrency or DEFAULT_CONCURRENCY:
+        responses, busy_until = simulate(service_times, level, think_time, seed=seed)
+        result = {'concurrency': level, 'response': percentiles(responses),
+                  'utilization': float(service_times.mean() * len(responses) / busy_until)}
+        report['levels'].append(result)
+        if log:
+            log('analysts %4d: p50 %.3fs  p95 %.3fs  p99 %.3fs  utilization %3.0f%%' % (
+                level, result['response']['p50'], result['response']['p95'], result['response']['p99'],
+                100 * min(result['utilization'], 1)))
+        if result['response']['p95'] > target_p95:
+            break
+        # Concurrent analysts one server handles while keeping p95 under the target
+        report['capacity'] = level
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay scripted dashboard sessions and report rerun latency.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--data', help='Final_DF CSV to serve (default: DIR + CSV5 from .env)')
+    source.add_argument('--rows', help='generate a synthetic dataset of this many rows, e.g. 100k or 1M')
+    parser.add_argument('--data-dir', default=None, help='where synthetic datasets are kept')
+    parser.add_argument('--sessions', type=int, default=16, help='simulated analysts per concurrency level')
+    parser.add_argument('--steps', type=int, default=DEFAULT_STEPS, help='interactions per session')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=DEFAULT_CONCURRENCY,
+                        help='numbers of concurrent analysts to evaluate')
+    parser.add_argument('--target-p95', type=float, default=DEFAULT_TARGET_P95, help='seconds')
+    parser.add_argument('--think-time', type=float, default=DEFAULT_THINK_TIME,
+                        help='mean seconds an analyst waits between interactions')
+    parser.add_argument('--memory-sessions', type=int, default=4,
+                        help='sessions used to measure per-session memory (0 to skip)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=120, help='seconds allowed for one rerun')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    if args.rows:
+        from Vanguard_benchmark import parse_size, ensure_dataset
+        data_path = ensure_dataset(parse_size(args.rows), args.seed, args.data_dir)
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        data_path = args.data or os.path.join(os.getenv('DIR', ''), os.getenv('CSV5', ''))
+
+    report = run(data_path, args.sessions, args.steps, args.concurrency, args.target_p95, args.think_time,
+                 args.memory_sessions, args.seed, args.timeout, log=print)
+    print('capacity: %d concurrent analysts with p95 <= %.2fs' % (report['capacity'], args.target_p95))
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
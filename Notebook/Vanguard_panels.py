@@ -0,0 +1,189 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError, FIRST_COMPLETED, wait, \
+    TimeoutError
+import streamlit as st
+from Vanguard_plots import CHARTS
+from Vanguard_render import chart_request, make_payload, cached_payload, store_payload, show_payload, show_tests, \
+    show_quantiles
+from Vanguard_profile import profiled, current_trace, attached
+
+# Concurrent, progressive dashboard panels. With PANEL_WORKERS > 0 the error
+# rate card, the tests, the navigation time quantiles and the four charts are
+# submitted to a thread pool shared by every session of the server, and each
+# panel is drawn as soon as its result arrives instead of one after another.
+# Workers never call Streamlit: they return metrics and chart payloads, and
+# the script thread renders them into placeholders laid out in page order.
+#
+# Rasterizing the charts is most of a rerun and holds the GIL, so with
+# PANEL_EXECUTOR=process the PNGs are drawn in a process pool instead (only
+# the small metric tables are sent over). The shared chart cache is still
+# checked first, in the server process.
+#
+# A rerun with other filters cancels the panels of the previous one that are
+# still queued, and running ones stop at their next checkpoint (a chart
+# waiting on the process pool checks every tick). The wait loop updates a
+# progress line every tick, which is where Streamlit stops a script run that
+# a widget change has made stale. A run with a failed panel is never picked
+# up again, so a rerun retries it instead of showing the same exception.
+
+panel_workers = int(os.getenv('PANEL_WORKERS', 0))
+panel_executor = os.getenv('PANEL_EXECUTOR', 'thread')
+
+PANEL_TICK = 0.1
+
+# Chart name -> (metric in the tests table, show_tests keyword arguments)
+TEST_CAPTIONS = {
+    'confirmation_rate': ('Confirmation Rate', {'scale': 100}),
+    'bounce_rate': ('Bounce Rate', {}),
+    'drop_rate': ('Drop Rate', {}),
+    'navigation_time': ('Navigation Time', {'unit': 's'}),
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(kind):
+    with _pools_lock:
+        if kind not in _pools:
+            if kind == 'process':
+                # spawn: forking a server with live threads is not safe
+                _pools[kind] = ProcessPoolExecutor(panel_workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                _pools[kind] = ThreadPoolExecutor(panel_workers, thread_name_prefix='panel')
+        return _pools[kind]
+
+
+class PanelRun:
+    def __init__(self, key):
+        self.key = key
+        self.cancelled = threading.Event()
+        self.futures = {}
+        # Profiling: the rerun trace the panels are recorded in
+        self.trace = current_trace()
+
+    def checkpoint(self):
+        if self.cancelled.is_set():
+            raise CancelledError()
+
+    def cancel(self):
+        self.cancelled.set()
+        for future in self.futures.values():
+            future.cancel()
+
+    def failed(self):
+        return any(future.done() and not future.cancelled() and future.exception() is not None
+                   for future in self.futures.values())
+
+    def wait(self, future):
+        # Result of a process pool future, given up at the first tick after the run is cancelled
+        while True:
+            try:
+                return future.result(timeout=PANEL_TICK)
+            except TimeoutError:
+                if self.cancelled.is_set():
+                    future.cancel()
+                    raise CancelledError()
+
+
+@profiled()
+def chart_panel(engine, filters, name, run):
+    metric, draw, spec, _ = CHARTS[name]
+    run.checkpoint()
+    metrics = getattr(engine, metric)(filters)
+    run.checkpoint()
+    fmt, key = chart_request(name, metrics, spec)
+    found, payload = cached_payload(key)
+    if not found:
+        if panel_executor == 'process':
+            payload = run.wait(_pool('process').submit(make_payload, fmt, metrics, draw, spec))
+        else:
+            payload = make_payload(fmt, metrics, draw, spec)
+        store_payload(key, payload)
+    return fmt, payload
+
+
+def _value_panel(method, filters, run):
+    run.checkpoint()
+    return method(filters)
+
+
+def _error_rate_panel(engine, filters, run):
+    run.checkpoint()
+    return engine.error_rate(filters), engine.error_rate_bound(filters)
+
+
+def _traced(run, panel, *args):
+    # Runs a panel in a pool thread, its profiled calls nested in the rerun that started it
+    with attached(run.trace):
+        return panel(*args)
+
+
+def start_panels(engine, filters, state):
+    # The PanelRun for these filters: the in-flight one when it matches, else a new one
+    key = (id(engine), engine.version(), tuple(filters))
+    previous = state.get('panel_run')
+    if previous is not None and previous.key == key and not previous.cancelled.is_set() and not previous.failed():
+        return previous
+    if previous is not None:
+        previous.cancel()
+    run = PanelRun(key)
+    pool = _pool('thread')
+    run.futures['error_rate'] = pool.submit(_traced, run, _error_rate_panel, engine, filters, run)
+    run.futures['tests'] = pool.submit(_traced, run, _value_panel, engine.tests, filters, run)
+    run.futures['navigation_quantiles'] = pool.submit(_traced, run, _value_panel, engine.navigation_quantiles,
+                                                      filters, run)
+    for name in CHARTS:
+        run.futures[name] = pool.submit(_traced, run, chart_panel, engine, filters, name, run)
+    state['panel_run'] = run
+    return run
+
+
+def show_panels(engine, filters, state, show_error_rate, chart_columns):
+    # Draws every panel as it completes; chart_columns: chart name -> Streamlit column
+    run = start_panels(engine, filters, state)
+    slots = {}
+    for name, column in chart_columns.items():
+        with column:
+            slots[name] = (st.empty(), st.empty())
+            slots[name][0].caption('Computing...')
+    # The navigation time quantiles go under that chart's tests
+    with chart_columns['navigation_time']:
+        quantile_slot = st.empty()
+    progress = st.empty()
+    pending = {future: name for name, future in run.futures.items()}
+    tests, drawn = None, []
+    while pending:
+        done, _ = wait(list(pending), timeout=PANEL_TICK, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            result = future.result()
+            if name == 'error_rate':
+                show_error_rate(*result)
+            elif name == 'navigation_quantiles':
+                with quantile_slot.container():
+                    show_quantiles(result)
+            elif name == 'tests':
+                tests = result
+                for chart in drawn:
+                    _show_caption(slots[chart][1], tests, chart)
+            else:
+                with slots[name][0].container():
+                    show_payload(*result, empty_message=CHARTS[name][3])
+                drawn.append(name)
+                if tests is not None:
+                    _show_caption(slots[name][1], tests, name)
+        if pending:
+            # Also where Streamlit stops this run when a widget changed; the next run
+            # cancels these panels if its filters differ, or picks them up if not
+            progress.caption('%d of %d panels ready' % (len(run.futures) - len(pending), len(run.futures)))
+    progress.empty()
+
+
+def _show_caption(slot, tests, name):
+    metric, options = TEST_CAPTIONS[name]
+    with slot.container():
+        show_tests(tests, metric, **options)
+
@@ -0,0 +1,226 @@
+import argparse
+import json
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER
+from Vanguard_visits import visit_order
+
+# Where visitors really go: every event's process_step and its successor in
+# the same visit are encoded as small integers (funnel steps 0-4, 'other' for
+# anything outside the funnel, 'exit' after a visit's last event), and the
+# step x successor transition counts of every segment come out of a single
+# np.bincount over segment * states^2 + step * states + successor.
+# Visit paths are packed into one int64 per visit (3 bits per step, up to
+# MAX_PATH_STEPS steps) so top-k paths are a value_counts, and the Sankey
+# links are transitions keyed by their depth in the visit.
+
+OTHER = 'other'
+EXIT = 'exit'
+STATES = STEP_ORDER + [OTHER]
+SUCCESSORS = STATES + [EXIT]
+OTHER_CODE = len(STEP_ORDER)
+EXIT_CODE = len(STATES)
+
+# 3 bits per step (codes 1-6, 7 marks a truncated path) keep 21 digits inside an int64
+PATH_BITS = 3
+MAX_PATH_STEPS = 20
+TRUNCATED = (1 << PATH_BITS) - 1
+
+SANKEY_DEPTH = 6
+
+
+def encode_events(data, by=()):
+    # Visit-ordered arrays: step codes, successor codes, segment code per event,
+    # position inside the visit, and the segment keys
+    by = list(by)
+    visit_codes, _ = pd.factorize(data['visit_id'])
+    times = data['date_time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    steps = pd.Categorical(data['process_step'], categories=STEP_ORDER).codes.astype(np.int8)
+    steps[steps < 0] = OTHER_CODE
+    if by:
+        grouped = data.groupby(by, observed=True, sort=True)
+        segments = grouped.ngroup().to_numpy()
+        keys = grouped.size().index.to_frame(index=False)
+    else:
+        segments = np.zeros(len(data), dtype=np.int64)
+        keys = pd.DataFrame(index=[0])
+
+    order = visit_order(visit_codes, times)
+    if order is not None:
+        visit_codes, steps, segments = visit_codes[order], steps[order], segments[order]
+
+    same_visit_next = np.zeros(len(steps), dtype=bool)
+    same_visit_next[:-1] = visit_codes[1:] == visit_codes[:-1]
+    successors = np.full(len(steps), EXIT_CODE, dtype=np.int8)
+    successors[:-1][same_visit_next[:-1]] = steps[1:][same_visit_next[:-1]]
+
+    starts = np.flatnonzero(np.concatenate(([True], ~same_visit_next[:-1]))) if len(steps) else np.zeros(0, dtype=np.int64)
+    lengths = np.diff(np.append(starts, len(steps)))
+    visits = np.repeat(np.arange(len(starts)), lengths)
+    depth = np.arange(len(steps)) - starts[visits]
+    return {'steps': steps, 'successors': successors, 'segments': segments, 'depth': depth, 'starts': starts,
+            'visits': visits, 'keys': keys}
+
+
+def _keyed(keys, frame, per_segment):
+    if keys.columns.empty:
+        return frame
+    key_rows = keys.iloc[np.repeat(np.arange(len(keys)), per_segment)].reset_index(drop=True)
+    return pd.concat([key_rows, frame], axis=1)
+
+
+def transition_matrix(data, by=('Variation',), events=None):
+    # (segment keys, counts[segment, step, successor]) over STATES x SUCCESSORS
+    events = encode_events(data, by) if events is None else events
+    valid = events['segments'] >= 0
+    n_segments = len(events['keys'])
+    flat = (events['segments'][valid] * len(STATES) + events['steps'][valid]) * len(SUCCESSORS) + \
+        events['successors'][valid]
+    counts = np.bincount(flat, minlength=n_segments * len(STATES) * len(SUCCESSORS))
+    return events['keys'], counts.reshape(n_segments, len(STATES), len(SUCCESSORS))
+
+
+def transition_table(data, by=('Variation',), events=None):
+    # Tidy transitions with the share of each step's events going to each successor
+    keys, counts = transition_matrix(data, by, events)
+    totals = counts.sum(axis=2, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = counts / totals
+    n_pairs = len(STATES) * len(SUCCESSORS)
+    frame = pd.DataFrame({
+        'step': np.tile(np.repeat(STATES, len(SUCCESSORS)), len(keys)),
+        'next_step': np.tile(SUCCESSORS, len(STATES) * len(keys)),
+        'count': counts.ravel(),
+        'share': shares.ravel()
+    })
+    frame = _keyed(keys, frame, n_pairs)
+    return frame[frame['count'] > 0].reset_index(drop=True)
+
+
+def loop_counts(data, by=('Variation',), events=None):
+    # Per segment: visits, repeated steps (same step twice in a row), backward moves
+    # between funnel steps, and visits with at least one backward move
+    events = encode_events(data, by) if events is None else events
+    keys, counts = transition_matrix(data, by, events)
+    funnel = np.arange(len(STEP_ORDER))
+    repeats = counts[:, funnel, funnel].sum(axis=1)
+    backward = np.tril(counts[:, :len(STEP_ORDER), :len(STEP_ORDER)], k=-1).sum(axis=(1, 2))
+
+    moves_back = (events['successors'] < OTHER_CODE) & (events['steps'] < OTHER_CODE) & \
+        (events['successors'] < events['steps'])
+    looping = np.zeros(len(events['starts']), dtype=bool)
+    looping[events['visits'][moves_back]] = True
+    visit_segments = events['segments'][events['starts']]
+    valid = visit_segments >= 0
+    visits = np.bincount(visit_segments[valid], minlength=len(keys))
+    looping_visits = np.bincount(visit_segments[valid], weights=looping[valid], minlength=len(keys))
+    frame = pd.DataFrame({'visits': visits, 'repeated_steps': repeats, 'backward_moves': backward,
+                          'looping_visits': looping_visits.astype(np.int64)})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frame['looping_share'] = frame['looping_visits'] / frame['visits']
+    return _keyed(keys, frame, 1)
+
+
+def _path_codes(events, collapse_repeats):
+    steps, starts = events['steps'], events['starts']
+    keep = np.ones(len(steps), dtype=bool)
+    if collapse_repeats and len(steps):
+        # An event repeating the previous step of the same visit adds nothing to the path
+        keep[1:] = steps[1:] != steps[:-1]
+        keep[starts] = True
+    visit_of_event, digits = events['visits'][keep], steps[keep].astype(np.int64) + 1
+    kept_starts = np.searchsorted(visit_of_event, np.arange(len(starts)))
+    position = np.arange(len(digits)) - np.repeat(kept_starts, np.diff(np.append(kept_starts, len(digits))))
+    # Past MAX_PATH_STEPS only one TRUNCATED digit is kept
+    digits = np.where(position < MAX_PATH_STEPS, digits, TRUNCATED)
+    inside = position <= MAX_PATH_STEPS
+    shifted = np.left_shift(digits[inside], PATH_BITS * position[inside])
+    if not len(shifted):
+        return np.zeros(len(starts), dtype=np.int64)
+    # Every visit keeps its first event, so each visit is a non-empty run of the kept events
+    return np.add.reduceat(shifted, np.searchsorted(visit_of_event[inside], np.arange(len(starts))))
+
+
+def decode_path(code):
+    names = []
+    while code:
+        digit = code & TRUNCATED
+        names.append('...' if digit == TRUNCATED else STATES[digit - 1])
+        code >>= PATH_BITS
+    return ' > '.join(names)
+
+
+def top_paths(data, by=('Variation',), k=10, collapse_repeats=True, events=None):
+    # The k most frequent visit paths per segment, with their share of the segment's visits
+    events = encode_events(data, by) if events is None else events
+    codes = _path_codes(events, collapse_repeats)
+    visit_segments = events['segments'][events['starts']]
+    frame = pd.DataFrame({'segment': visit_segments, 'code': codes})
+    frame = frame[frame['segment'] >= 0]
+    counts = frame.groupby(['segment', 'code']).size().rename('visits').reset_index()
+    counts['share'] = counts['visits'] / counts.groupby('segment')['visits'].transform('sum')
+    top = counts.sort_values(['segment', 'visits', 'code'], ascending=[True, False, True]).groupby('segment').head(k)
+    top['path'] = [decode_path(int(code)) for code in top['code']]
+    top['rank'] = top.groupby('segment').cumcount() + 1
+    keys = events['keys']
+    result = top[['rank', 'path', 'visits', 'share']].reset_index(drop=True)
+    if not keys.columns.empty:
+        result = pd.concat([keys.iloc[top['segment'].to_numpy()].reset_index(drop=True), result], axis=1)
+    return result
+
+
+def sankey(data, depth=SANKEY_DEPTH, events=None, **filters):
+    # Sankey nodes and links for the first `depth` steps of every visit: node i is a
+    # (depth, state) pair and links carry visit counts. filters: column=value.
+    for column, value in filters.items():
+        data = data[data[column] == value]
+    events = encode_events(data, ()) if events is None else events
+    inside = events['depth'] < depth
+    step_depth, steps, successors = events['depth'][inside], events['steps'][inside], events['successors'][inside]
+    flat = (step_depth * len(STATES) + steps) * len(SUCCESSORS) + successors
+    counts = np.bincount(flat, minlength=depth * len(STATES) * len(SUCCESSORS)).reshape(
+        depth, len(STATES), len(SUCCESSORS))
+
+    nodes, index = [], {}
+
+    def node(level, name):
+        if (level, name) not in index:
+            index[(level, name)] = len(nodes)
+            nodes.append({'name': '%d. %s' % (level + 1, name), 'depth': level, 'step': name})
+        return index[(level, name)]
+
+    links = []
+    for level, step, successor in zip(*np.nonzero(counts)):
+        links.append({'source': node(int(level), STATES[step]), 'target': node(int(level) + 1, SUCCESSORS[successor]),
+                      'value': int(counts[level, step, successor])})
+    return {'nodes': nodes, 'links': links}
+
+
+def main():
+    from Vanguard_ingest import load_final_df
+    parser = argparse.ArgumentParser(description='Step transitions, loops, top visit paths and Sankey links.')
+    parser.add_argument('path', help='Final_DF CSV')
+    parser.add_argument('--by', nargs='*', default=['Variation'], help='segment columns (default: Variation)')
+    parser.add_argument('--top', type=int, default=10, help='paths per segment')
+    parser.add_argument('--keep-repeats', action='store_true', help='keep a step repeated in a row in the paths')
+    parser.add_argument('--sankey', help='write Sankey nodes/links JSON here')
+    parser.add_argument('--sankey-depth', type=int, default=SANKEY_DEPTH)
+    parser.add_argument('--variation', help='only this Variation in the Sankey')
+    args = parser.parse_args()
+
+    data = load_final_df(args.path)
+    events = encode_events(data, args.by)
+    with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.max_colwidth', 120):
+        print(transition_table(data, args.by, events).to_string(index=False))
+        print()
+        print(loop_counts(data, args.by, events).to_string(index=False))
+        print()
+        print(top_paths(data, args.by, args.top, not args.keep_repeats, events).to_string(index=False))
+    if args.sankey:
+        filters = {'Variation': args.variation} if args.variation else {}
+        with open(args.sankey, 'w') as handle:
+            json.dump(sankey(data, args.sankey_depth, **filters), handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from Vanguard_funnel import FUNNEL_STEPS, TRANSITION_COLUMNS, TIME_COLUMNS
+from Vanguard_sessions import LOG_ORDERS, sessionize, split_open
+
+# Chunked build of Final_DF from the raw web logs, the same steps as
+# Data_Vanguard.ipynb without holding the logs in memory.
+#
+# The web logs are read in chunks and merged with the (small) client and
+# variation tables. The raw exports keep each client's events together, so
+# only the client at the end of a chunk can continue in the next one: its
+# rows are carried over and every other visit is complete and written out.
+# Peak memory is one chunk plus the carried client and the lookup tables.
+# The ordering is checked within that bound: a client whose rows are split
+# inside a chunk (the carried one included), or that comes back right after
+# its rows were written (the clients of the previous chunk, across runs the
+# last one written), raises instead of being split into wrong dropoffs and
+# lost transitions. Logs in any other order must be sorted by client_id
+# first, or built with session_gap.
+#
+# A state file next to the output records which log files were processed,
+# so a re-run only reads log files that were added since.
+#
+# With session_gap the visit ids of the logs are not trusted: every chunk is
+# sessionized (Vanguard_sessions) from client_id and date_time first, and the
+# rows of its last client (or, for time-ordered logs, the visits still within
+# the gap) are what gets carried over.
+
+load_dotenv()
+
+directory = os.getenv('DIR')
+df_final_demo_csv = os.getenv('CSV1')
+df_final_experiment_clients_csv = os.getenv('CSV2')
+df_final_web_data_pt_1_csv = os.getenv('CSV3')
+df_final_web_data_pt_2_csv = os.getenv('CSV4')
+df_final_data = os.getenv('CSV5')
+
+WEB_COLUMNS = ['client_id', 'visitor_id', 'visit_id', 'process_step', 'date_time']
+DEFAULT_CHUNK_SIZE = 500_000
+
+
+def load_lookups(demo_path, clients_path):
+    df_client = pd.read_csv(demo_path)
+    df_client = df_client[df_client['clnt_age'].notnull()]
+    df_variation = pd.read_csv(clients_path)
+    return df_client, df_variation
+
+
+def merge_chunk(web, df_client, df_variation):
+    merged = web.merge(df_variation, how='inner', on='client_id')
+    merged = merged.dropna(how='any')
+    return merged.merge(df_client, how='inner', on='client_id')
+
+
+def derive_funnel_columns(frame):
+    # frame holds complete visits; sorting once lets lead/leadtime be plain shifts
+    frame = frame.sort_values(['visit_id', 'date_time'], kind='stable').reset_index(drop=True)
+    frame['Variation_numeric'] = frame['Variation'].map({'Test': 1, 'Control': 0})
+
+    step = frame['process_step']
+    for value, short in FUNNEL_STEPS:
+        frame['process_' + short] = np.where(step == value, 1, 0)
+
+    visit_id = frame['visit_id'].to_numpy()
+    same_visit_next = np.zeros(len(frame), dtype=bool)
+    same_visit_next[:-1] = visit_id[1:] == visit_id[:-1]
+
+    frame['lead'] = step.shift(-1).where(same_visit_next)
+    for (value, short), (next_value, _), column in zip(FUNNEL_STEPS[:-1], FUNNEL_STEPS[1:], TRANSITION_COLUMNS):
+        frame[column] = np.where((step == value) & (frame['lead'] == next_value), 1, 0)
+    for value, short in FUNNEL_STEPS[:-1]:
+        frame['process_%s-dropoff' % short] = np.where((step == value) & frame['lead'].isnull(), 1, 0)
+
+    date_time = pd.to_datetime(frame['date_time'])
+    frame['leadtime'] = date_time.shift(-1).where(same_visit_next)
+    frame['date_time'] = date_time
+    elapsed = (frame['leadtime'] - frame['date_time']).dt.total_seconds()
+    for time_column, column in zip(TIME_COLUMNS, TRANSITION_COLUMNS):
+        frame[time_column] = np.where(frame[column] == 1, elapsed, 0)
+    return frame
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def state_paths(output_path):
+    base = os.path.splitext(output_path)[0]
+    return base + '.state.json', base + '.carry.csv'
+
+
+def _check_client_order(frame, written, path):
+    # Raises when a client's rows are not together in frame, or it is one of the clients just written
+    clients = frame['client_id'].to_numpy()
+    runs = clients[np.concatenate(([True], clients[1:] != clients[:-1]))] if len(clients) else clients
+    split = np.concatenate([runs[pd.Index(runs).duplicated()], runs[np.isin(runs, written)]])
+    if len(split):
+        raise ValueError(f"client {split[0]!r} in {path} continues after other clients' rows: the web logs must "
+                         "keep each client's events together (sort them by client_id, or rebuild the visits "
+                         "with session_gap)")
+
+
+def _read_state(state_path):
+    try:
+        with open(state_path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(state_path, state):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump(state, handle, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def build_final_df(web_paths, demo_path, clients_path, output_path, chunk_size=DEFAULT_CHUNK_SIZE,
+                   rebuild=False, hold_open=False, session_gap=None, log_order='client'):
+    state_path, carry_path = state_paths(output_path)
+    state = None if rebuild else _read_state(state_path)
+    if state is None or not os.path.exists(output_path):
+        state = {'files': {}, 'rows_written': 0}
+        for path in (output_path, carry_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    new_paths = []
+    for path in web_paths:
+        key = os.path.abspath(path)
+        if key in state['files']:
+            if state['files'][key] != _file_stat(path):
+                raise ValueError(f'{path} changed since it was processed, rebuild with rebuild=True')
+            continue
+        new_paths.append(path)
+
+    stats = {'files': len(new_paths), 'chunks': 0, 'rows_read': 0, 'rows_written': 0}
+    if not new_paths:
+        return stats
+
+    df_client, df_variation = load_lookups(demo_path, clients_path)
+    carry = pd.read_csv(carry_path) if os.path.exists(carry_path) else None
+    header = state['rows_written'] == 0
+    # Clients of the last write, which must not come back; with session_gap the visits are rebuilt, so not checked
+    written = np.array(state.get('last_client', []))
+
+    def write(frame):
+        nonlocal header, written
+        if frame.empty:
+            return
+        derive_funnel_columns(frame).to_csv(output_path, mode='a', header=header, index=False)
+        header = False
+        stats['rows_written'] += len(frame)
+        written = frame['client_id'].unique()
+        state['last_client'] = frame['client_id'].iloc[-1:].tolist()
+
+    for path in new_paths:
+        for chunk in pd.read_csv(path, usecols=WEB_COLUMNS, chunksize=chunk_size):
+            stats['chunks'] += 1
+            stats['rows_read'] += len(chunk)
+            merged = merge_chunk(chunk, df_client, df_variation)
+            if carry is not None:
+                merged = pd.concat([carry, merged], ignore_index=True)
+            if merged.empty:
+                carry = None
+                continue
+            if session_gap is not None:
+                last_client = merged['client_id'].iloc[-1]
+                merged = sessionize(merged, session_gap)
+                merged.attrs['last_client'] = last_client
+                done, carry = split_open(merged, session_gap, log_order)
+                write(done)
+                continue
+            _check_client_order(merged, written, path)
+            # Only the last client of the chunk can still receive events; carrying all of its
+            # rows also keeps visits whole in logs sorted by client, whose visits interleave
+            is_open = (merged['client_id'] == merged['client_id'].iloc[-1]).to_numpy()
+            carry = merged[is_open]
+            write(merged[~is_open])
+        state['files'][os.path.abspath(path)] = _file_stat(path)
+
+    if hold_open and carry is not None and not carry.empty:
+        carry.to_csv(carry_path, index=False)
+    else:
+        if carry is not None:
+            write(carry)
+        if os.path.exists(carry_path):
+            os.remove(carry_path)
+
+    state['rows_written'] += stats['rows_written']
+    _write_state(state_path, state)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build Final_DF from the raw web logs in bounded memory.')
+    parser.add_argument('web_files', nargs='*',
+                        help="web log files in order (default: CSV3 and CSV4 from .env); each client's events must be "
+                             "together, as in the raw exports (sort by client_id otherwise, or use --session-gap)")
+    parser.add_argument('--output', help='Final_DF path (default: CSV5 from .env)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--rebuild', action='store_true', help='ignore the state file and rebuild from scratch')
+    parser.add_argument('--hold-open', action='store_true',
+                        help='keep the last client pending until the next run instead of writing it out')
+    parser.add_argument('--session-gap', type=float, default=None,
+                        help='rebuild visit ids with this inactivity gap in minutes (Vanguard_sessions)')
+    parser.add_argument('--log-order', choices=LOG_ORDERS, default='client',
+                        help="with --session-gap: 'client' if each client's events are together, 'time' otherwise")
+    args = parser.parse_args()
+
+    web_files = args.web_files or [directory + df_final_web_data_pt_1_csv, directory + df_final_web_data_pt_2_csv]
+    output = args.output or directory + df_final_data
+    stats = build_final_df(web_files, directory + df_final_demo_csv, directory + df_final_experiment_clients_csv,
+                           output, chunk_size=args.chunk_size, rebuild=args.rebuild, hold_open=args.hold_open,
+                           session_gap=args.session_gap, log_order=args.log_order)
+    print(json.dumps(stats))
+
+
+if __name__ == '__main__':
+    main()
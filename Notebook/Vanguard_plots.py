@@ -0,0 +1,218 @@
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+from Vanguard_core import confirmation_rates, navigation_times, drop_rates, bounce_rates
+from Vanguard_profile import profiled
+from Vanguard_render import show_chart, confirmation_rate_spec, navigation_time_spec, drop_rate_spec, bounce_rate_spec
+
+# Matplotlib charts of the dashboard metrics, shown through the render cache.
+# seaborn is only imported when a confirmation chart is actually drawn.
+
+plot_width, plot_height = 10, 6
+
+
+@profiled()
+def draw_confirmation_rate(rates):
+    # Preparing data for plotting
+    groups = ['Control', 'Test']
+    rates = [rates['Control'], rates['Test']]
+    colors = {'Control': 'blue', 'Test': 'green'}
+    group_colors = [colors[group] for group in groups if not np.isnan(rates[groups.index(group)])]
+
+    # Filter out NaN values for plotting
+    groups = [group for group in groups if not np.isnan(rates[groups.index(group)])]
+    rates = [rate for rate in rates if not np.isnan(rate)]
+    
+    if not groups:
+        return None
+
+    text_color = 'white'  # Define a text color for visibility on dark background
+    fig = Figure(figsize=(plot_width, plot_height))
+    ax = fig.subplots()
+    ax.set_facecolor('none')  # Set the plot background to be transparent
+
+    import seaborn as sns
+    sns.barplot(x=groups, y=rates, palette=group_colors, ax=ax)
+    ax.set_title('Confirmation Rates by Group', color=text_color)
+    ax.set_ylabel('Confirmation Rate', color=text_color)
+    ax.set_xlabel('Group', color=text_color)
+    
+    # Setting the y-axis to have a maximum of 100%
+    ax.set_ylim(0, 1)  # Sets the y-axis to range from 0 to 1 (0% to 100%)
+    
+    # Format the y-ticks as percentages
+    formatter = FuncFormatter(lambda y, _: f'{int(y*100)}%')
+    ax.yaxis.set_major_formatter(formatter)
+
+    # Set the tick colors
+    ax.tick_params(axis='both', colors=text_color)
+
+    # Customize grid to be visible on a dark background
+    ax.grid(True, color='lightgray', linestyle='--', linewidth=0.5)
+
+    return fig
+
+
+@profiled()
+def plot_confirmation_rate(rates):
+    show_chart('confirmation_rate', rates, draw_confirmation_rate, confirmation_rate_spec,
+               empty_message="Not enough data to display confirmation rates.")
+
+
+def confirmation_rate(data):
+    plot_confirmation_rate(confirmation_rates(data))
+
+
+@profiled()
+def draw_navigation_time(avg_times):
+    avg_times = avg_times.copy()
+
+    # Calculating overall average time for conclusion
+    avg_times['Overall Average'] = avg_times[['Control', 'Test']].mean(axis=1)
+
+    # Plotting
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.set_facecolor('none')
+    text_color = 'white'
+    
+    for column in ['Control', 'Test', 'Overall Average']:
+        ax.plot(avg_times['Step'], avg_times[column], marker='o', label=column)
+
+    ax.set_title('Average Time for Each Step by Group', color=text_color)
+    ax.set_xlabel('Step', color=text_color)
+    ax.set_ylabel('Average Time in minutes', color=text_color)
+    ax.legend()
+    ax.grid(True, color='lightgray', linestyle='--', linewidth=0.5)
+
+    # Setting tick colors
+    ax.tick_params(colors=text_color)
+
+    return fig
+
+
+@profiled()
+def plot_navigation_time(avg_times):
+    show_chart('navigation_time', avg_times, draw_navigation_time, navigation_time_spec)
+
+
+def navigation_time(data):
+    plot_navigation_time(navigation_times(data))
+
+
+@profiled()
+def draw_drop_rate(drop_rates):
+    steps = list(drop_rates['Step'])
+    control_rates = list(drop_rates['Control'])
+    test_rates = list(drop_rates['Test'])
+
+    # Plotting
+    text_color = 'white'
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.plot(steps, control_rates, marker='o', color='blue', label='Control Drop Rate')
+    ax.plot(steps, test_rates, marker='o', color='green', label='Test Drop Rate')
+
+    # Set the plot background to be transparent and color the text to be visible on dark theme
+    ax.set_facecolor('none') 
+    ax.set_title('Drop Rates by Step for Control and Test Groups (%)', color=text_color)
+    ax.set_xlabel('Process Step', color=text_color)
+    ax.set_ylabel('Drop Rate (%)', color=text_color)
+    ax.set_ylim(0, 100)  # Ensure y-axis goes up to 100%
+    
+    # Formatting y-axis to show percentages with a "%" sign
+    formatter = FuncFormatter(lambda y, _: f'{int(y)}%')
+    ax.yaxis.set_major_formatter(formatter)
+
+    # Customize grid to be visible on a dark background
+    ax.grid(True, color='lightgray', linestyle='--', linewidth=0.5)
+    
+    # Set the tick parameters for both axes to be lighter
+    ax.tick_params(axis='x', colors=text_color)
+    ax.tick_params(axis='y', colors=text_color)
+
+    # Set the legend with a lighter text color
+    legend = ax.legend()
+    for text in legend.get_texts():
+        text.set_color('black') 
+
+    # Avoiding negative or over 100% labels due to automatic tick selection
+    ax.set_yticks(range(0, 101, 10))
+
+    return fig
+
+
+@profiled()
+def plot_drop_rate(drop_rates):
+    show_chart('drop_rate', drop_rates, draw_drop_rate, drop_rate_spec)
+
+
+def drop_rate(data):
+    plot_drop_rate(drop_rates(data))
+
+
+@profiled()
+def draw_bounce_rate(rates):
+    bounce_rate_control = rates['Control']
+    bounce_rate_test = rates['Test']
+
+    # Plotting
+    text_color = 'white'
+
+    fig = Figure(figsize=(plot_width, plot_height))
+    ax = fig.subplots()
+    # Setting the face and edge color of the figure to transparent
+    fig.patch.set_facecolor('none')
+    fig.patch.set_edgecolor('none')
+    fig.patch.set_alpha(0)
+    ax.set_facecolor('none')  # The plot background is transparent
+    groups = ['Control', 'Test']
+    bounce_rates = [bounce_rate_control if bounce_rate_control is not None else 0,
+                    bounce_rate_test if bounce_rate_test is not None else 0]
+
+    # Ensure we have at least one non-None value to plot
+    if any(rate is not None for rate in bounce_rates):
+        ax.bar(groups, bounce_rates, color=['blue', 'green'])
+
+    ax.set_title('Bounce Rates by Group (%)', color=text_color)
+    ax.set_ylabel('Bounce Rate (%)', color=text_color)
+
+    # Set y-axis to show up to 100%
+    ax.set_ylim(0, 100)
+    
+    # Formatting y-axis to show percentages with a "%" sign
+    formatter = FuncFormatter(lambda y, _: f'{int(y)}%')
+    ax.yaxis.set_major_formatter(formatter)
+    
+    # Ensure y-axis ticks are set sensibly
+    ax.tick_params(axis='both', which='both', length=0)  # Hide the ticks
+    ax.tick_params(axis='both', colors=text_color)  # Set the color of the tick labels
+
+    # Customize grid to be visible on a dark background
+    ax.grid(True, color='lightgray', linestyle='--', linewidth=0.5)
+
+    # Hide the spines
+    for spine in ax.spines.values():
+        spine.set_visible(False)  # Hide the spines
+
+    return fig
+
+
+@profiled()
+def plot_bounce_rate(rates):
+    show_chart('bounce_rate', rates, draw_bounce_rate, bounce_rate_spec)
+
+
+def bounce_rate(data):
+    plot_bounce_rate(bounce_rates(data))
+
+
+# Chart name -> (engine metric, draw, Vega-Lite spec, message when there is nothing to draw),
+# in page order, for the concurrent panels (Vanguard_panels)
+CHARTS = {
+    'confirmation_rate': ('confirmation_rates', draw_confirmation_rate, confirmation_rate_spec,
+                          "Not enough data to display confirmation rates."),
+    'bounce_rate': ('bounce_rates', draw_bounce_rate, bounce_rate_spec, None),
+    'drop_rate': ('drop_rates', draw_drop_rate, drop_rate_spec, None),
+    'navigation_time': ('navigation_times', draw_navigation_time, navigation_time_spec, None),
+}
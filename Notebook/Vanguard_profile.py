@@ -0,0 +1,319 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+import pandas as pd
+
+# Opt-in instrumentation of the backend and of the dashboard rerun phases.
+#   VANGUARD_PROFILE=1       wall time and rows in/out of every instrumented call
+#   VANGUARD_PROFILE=memory  also peak allocations (tracemalloc, slows the app down)
+#   VANGUARD_PROFILE_DIR     write the recorded reruns there as JSON and Chrome trace,
+#                            at the end of every rerun; calls traced outside a rerun
+#                            (scripts, the report CLI) at most every EXPORT_SECONDS
+#                            and at exit, so the files are not rewritten per call
+# Disabled, @profiled returns the function itself and phase() only checks a
+# flag, so nothing is measured and nothing is allocated.
+#
+# A rerun is one trace: the phases of main() plus every instrumented call made
+# while it runs, nested by call depth. Work it hands to pool threads (the
+# dashboard panels) joins the same trace through attached(current_trace()).
+# The last PROFILE_HISTORY traces of the process are kept for the sidebar
+# debug panel and the exports; Chrome traces open in chrome://tracing or
+# https://ui.perfetto.dev.
+
+profile_mode = os.getenv('VANGUARD_PROFILE', '').strip().lower()
+profiling = profile_mode not in ('', '0', 'false', 'off')
+profile_memory = profile_mode == 'memory'
+profile_directory = os.getenv('VANGUARD_PROFILE_DIR')
+
+PROFILE_HISTORY = 50
+EXPORT_SECONDS = 10.0
+
+_history = deque(maxlen=PROFILE_HISTORY)
+_history_lock = threading.Lock()
+_local = threading.local()
+_trace_ids = iter(range(1, 1 << 62))
+# Monotonic time the next throttled export is allowed at, and whether traces wait for one
+_export = {'due': 0.0, 'pending': False}
+
+
+def _rows(value):
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+def _current():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+        _local.trace = None
+        _local.base_depth = 0
+    return _local
+
+
+class _Span:
+    __slots__ = ('record', 'started', 'memory_start', 'child_peak')
+
+    def __init__(self, name, rows_in=None):
+        local = _current()
+        self.record = {'name': name, 'depth': local.base_depth + len(local.stack), 'rows_in': rows_in,
+                       'rows_out': None, 'peak_bytes': None, 'thread': threading.get_ident()}
+        self.child_peak = 0
+        if profile_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.memory_start, outer_peak = tracemalloc.get_traced_memory()
+            # reset_peak() forgets the enclosing span's peak, so it is handed over explicitly
+            if local.stack:
+                local.stack[-1].child_peak = max(local.stack[-1].child_peak, outer_peak)
+            tracemalloc.reset_peak()
+        local.stack.append(self)
+        self.started = time.perf_counter_ns()
+
+    def close(self, rows_out=None):
+        ended = time.perf_counter_ns()
+        local = _current()
+        local.stack.pop()
+        self.record['start_us'] = self.started / 1000
+        self.record['duration_ms'] = (ended - self.started) / 1e6
+        self.record['rows_out'] = rows_out
+        if profile_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            self.record['peak_bytes'] = peak - self.memory_start
+            if local.stack:
+                local.stack[-1].child_peak = max(local.stack[-1].child_peak, peak)
+        if local.trace is not None:
+            # Worker threads attached to the trace append to it too
+            with _history_lock:
+                local.trace['spans'].append(self.record)
+        else:
+            _finish({'id': next(_trace_ids), 'name': self.record['name'], 'spans': [self.record]})
+
+
+def profiled(name=None):
+    # Decorator recording every call; rows_in is the first DataFrame argument's length
+    def decorate(function):
+        if not profiling:
+            return function
+        label = name or '%s.%s' % (function.__module__.replace('Vanguard_', ''), function.__qualname__)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            rows_in = next((len(arg) for arg in args if isinstance(arg, (pd.DataFrame, pd.Series))), None)
+            span = _Span(label, rows_in)
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                span.close(_rows(result))
+        return wrapper
+    return decorate
+
+
+class span:
+    # with span('name'): ... for a block that is not a function
+    def __init__(self, name, rows_in=None):
+        self.name, self.rows_in, self.span = name, rows_in, None
+
+    def __enter__(self):
+        if profiling:
+            self.span = _Span(self.name, self.rows_in)
+        return self
+
+    def __exit__(self, *exc):
+        if self.span is not None:
+            self.span.close()
+        return False
+
+
+def current_trace():
+    # (trace, depth) of the calling thread, for the work it hands to pool threads; None outside a trace
+    if not profiling:
+        return None
+    local = _current()
+    if local.trace is None:
+        return None
+    return local.trace, local.base_depth + len(local.stack)
+
+
+class attached:
+    # with attached(current_trace()) in a pool thread: its spans are recorded in that trace,
+    # nested under the span that was open when the work was handed over
+    def __init__(self, context):
+        self.context, self.saved = context, None
+
+    def __enter__(self):
+        if self.context is not None:
+            local = _current()
+            self.saved = (local.trace, local.base_depth)
+            local.trace, local.base_depth = self.context
+        return self
+
+    def __exit__(self, *exc):
+        if self.saved is not None:
+            local = _current()
+            local.trace, local.base_depth = self.saved
+        return False
+
+
+def start_trace(name='rerun'):
+    if not profiling:
+        return
+    local = _current()
+    local.trace = {'id': next(_trace_ids), 'name': name, 'spans': []}
+    local.phase = None
+    local.trace_span = _Span(name)
+
+
+def phase(name):
+    # Ends the running phase of the current trace and starts the next one
+    if not profiling:
+        return
+    local = _current()
+    if getattr(local, 'trace', None) is None:
+        return
+    if local.phase is not None:
+        _close_to(local.phase)
+    local.phase = _Span(name)
+
+
+def _close_to(target):
+    # Closes target and anything an exception left open inside it
+    local = _current()
+    while local.stack:
+        top = local.stack[-1]
+        top.close()
+        if top is target:
+            break
+
+
+def end_trace():
+    if not profiling:
+        return None
+    local = _current()
+    if getattr(local, 'trace', None) is None:
+        return None
+    _close_to(local.trace_span)
+    trace = local.trace
+    local.trace, local.phase, local.trace_span = None, None, None
+    with _history_lock:
+        trace['spans'].sort(key=lambda record: record['start_us'])
+    _finish(trace, export=True)
+    return trace
+
+
+def _finish(trace, export=False):
+    with _history_lock:
+        _history.append(trace)
+        if not profile_directory:
+            return
+        now = time.monotonic()
+        if not export and now < _export['due']:
+            _export['pending'] = True
+            return
+        _export['due'], _export['pending'] = now + EXPORT_SECONDS, False
+        traces = list(_history)
+    _write_exports(traces)
+
+
+def _write_exports(traces):
+    export_json(os.path.join(profile_directory, 'profile_%d.json' % os.getpid()), traces)
+    export_chrome_trace(os.path.join(profile_directory, 'profile_%d.trace.json' % os.getpid()), traces)
+
+
+def _flush_exports():
+    # Traces that were waiting for a throttled export
+    with _history_lock:
+        if not _export['pending']:
+            return
+        _export['pending'] = False
+        traces = list(_history)
+    _write_exports(traces)
+
+
+if profiling and profile_directory:
+    atexit.register(_flush_exports)
+
+
+def history():
+    with _history_lock:
+        return list(_history)
+
+
+def last_trace(name='rerun'):
+    for trace in reversed(history()):
+        if trace['name'] == name:
+            return trace
+    return None
+
+
+def spans_frame(traces):
+    rows = [{'trace': trace['id'], **record} for trace in traces for record in trace['spans']]
+    columns = ['trace', 'name', 'depth', 'duration_ms', 'rows_in', 'rows_out', 'peak_bytes', 'start_us', 'thread']
+    return pd.DataFrame(rows, columns=columns)
+
+
+def summary_frame(traces):
+    # Calls, total and worst time per instrumented name, slowest first
+    spans = spans_frame(traces)
+    if spans.empty:
+        return spans
+    grouped = spans.groupby('name')
+    result = pd.DataFrame({'calls': grouped.size(), 'total_ms': grouped['duration_ms'].sum(),
+                           'mean_ms': grouped['duration_ms'].mean(), 'max_ms': grouped['duration_ms'].max(),
+                           'max_peak_bytes': grouped['peak_bytes'].max()})
+    return result.sort_values('total_ms', ascending=False).reset_index()
+
+
+def chrome_trace(traces):
+    events = []
+    for trace in traces:
+        for record in trace['spans']:
+            events.append({'name': record['name'], 'cat': trace['name'], 'ph': 'X', 'pid': os.getpid(),
+                           'tid': record['thread'], 'ts': record['start_us'], 'dur': record['duration_ms'] * 1000,
+                           'args': {'trace': trace['id'], 'rows_in': record['rows_in'],
+                                    'rows_out': record['rows_out'], 'peak_bytes': record['peak_bytes']}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def _write_json(path, payload):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump(payload, handle)
+    os.replace(tmp_path, path)
+
+
+def export_json(path, traces=None):
+    _write_json(path, {'memory': profile_memory, 'traces': history() if traces is None else traces})
+
+
+def export_chrome_trace(path, traces=None):
+    _write_json(path, chrome_trace(history() if traces is None else traces))
+
+
+def show_profile_panel():
+    # Sidebar debug panel with the last rerun, totals over the kept reruns and downloads
+    if not profiling:
+        return
+    import streamlit as st
+    trace = last_trace()
+    with st.sidebar.expander('Debug: profile'):
+        if trace is None:
+            st.write('No rerun recorded yet.')
+            return
+        spans = spans_frame([trace])
+        spans['name'] = ['  ' * depth + name for depth, name in zip(spans['depth'], spans['name'])]
+        columns = ['name', 'duration_ms', 'rows_in', 'rows_out'] + (['peak_bytes'] if profile_memory else [])
+        st.caption('Last rerun: %.0f ms' % spans['duration_ms'].iloc[0])
+        st.dataframe(spans[columns], hide_index=True)
+        traces = history()
+        st.caption('Last %d reruns' % sum(trace['name'] == 'rerun' for trace in traces))
+        st.dataframe(summary_frame(traces), hide_index=True)
+        st.download_button('Profile (JSON)', json.dumps({'memory': profile_memory, 'traces': traces}),
+                           file_name='vanguard_profile.json', mime='application/json')
+        st.download_button('Chrome trace', json.dumps(chrome_trace(traces)),
+                           file_name='vanguard_profile.trace.json', mime='application/json')
@@ -0,0 +1,214 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER, VARIATIONS, STEP_LABELS, TRANSITION_COLUMNS, TIME_COLUMNS
+from Vanguard_profile import profiled
+
+# Quantile sketches of the time spent on a step before moving to the next one.
+# The mean (time sum / forward moves) is dragged up by visits that leave a tab
+# open, so the dashboard also shows p50/p90/p99 and a trimmed mean, read from
+# a sketch instead of sorting the raw times.
+#
+# The sketch is a log-bucket histogram (as in DDSketch): a time t goes to
+# bucket ceil(log(t / MIN_TIME) / log(gamma)) with gamma = (1 + a) / (1 - a),
+# a = QUANTILE_ACCURACY, and a bucket stands for the value at its relative
+# middle, so every quantile is within a relative error of a. Times under
+# MIN_TIME share bucket 0 (read as 0), times over MAX_TIME the last one.
+# Buckets are fixed, so sketches merge by adding their counts: the same as
+# the cube, any sidebar selection is the sum of its cells' sketches, and an
+# incremental load adds its moves to the running sketch (Vanguard_incremental).
+#
+# Cells are the cube's (clnt_age, Variation, gendr). Only the non-empty
+# (cell, step, bucket) counts are kept, so a query costs the size of the
+# sketches it merges and never the number of events.
+
+quantile_accuracy = float(os.getenv('QUANTILE_ACCURACY', 0.01))
+
+SEGMENT_KEYS = ['clnt_age', 'Variation', 'gendr']
+QUANTILES = [0.5, 0.9, 0.99]
+# Share of the moves left out at each end for the trimmed mean
+TRIM_SHARE = 0.05
+
+MIN_TIME = 1e-3
+MAX_TIME = 1e7
+
+# The steps with a next step, one sketch each
+TIME_STEPS = STEP_ORDER[:-1]
+
+QUANTILE_STATISTICS = ['p%g' % (100 * quantile) for quantile in QUANTILES] + ['Trimmed Mean']
+QUANTILE_COLUMNS = ['Step', 'Variation', 'Moves'] + QUANTILE_STATISTICS
+
+# (data, quantile cube) for the last frame the sketches were built from
+_built = (None, None)
+
+
+def _gamma(accuracy):
+    return (1 + accuracy) / (1 - accuracy)
+
+
+def n_buckets(accuracy=None):
+    # The zero bucket plus the log buckets covering [MIN_TIME, MAX_TIME]
+    accuracy = quantile_accuracy if accuracy is None else accuracy
+    return 2 + int(np.ceil(np.log(MAX_TIME / MIN_TIME) / np.log(_gamma(accuracy))))
+
+
+def bucket_keys(times, accuracy=None):
+    accuracy = quantile_accuracy if accuracy is None else accuracy
+    times = np.asarray(times, dtype=float)
+    keys = np.zeros(len(times), dtype=np.int64)
+    positive = times >= MIN_TIME
+    scaled = np.ceil(np.log(times[positive] / MIN_TIME) / np.log(_gamma(accuracy)))
+    keys[positive] = np.minimum(scaled, n_buckets(accuracy) - 2).astype(np.int64) + 1
+    return keys
+
+
+def bucket_values(accuracy=None):
+    # The value every bucket is read as
+    accuracy = quantile_accuracy if accuracy is None else accuracy
+    gamma = _gamma(accuracy)
+    values = 2 * MIN_TIME * np.power(gamma, np.arange(n_buckets(accuracy) - 1)) / (gamma + 1)
+    return np.concatenate([[0.0], values])
+
+
+def sketch_quantiles(counts, quantiles=QUANTILES, accuracy=None):
+    # counts: (..., buckets) sketches -> (..., len(quantiles)), NaN for an empty sketch
+    counts = np.asarray(counts, dtype=float)
+    values = bucket_values(accuracy)
+    total = counts.sum(axis=-1)
+    cumulative = np.cumsum(counts, axis=-1)
+    result = []
+    for quantile in quantiles:
+        rank = quantile * (total - 1)
+        key = np.argmax(cumulative > rank[..., None], axis=-1)
+        result.append(np.where(total > 0, values[key], np.nan))
+    return np.stack(result, axis=-1)
+
+
+def sketch_trimmed_mean(counts, trim=TRIM_SHARE, accuracy=None):
+    # Mean of the moves between the trim and 1 - trim quantiles; a bucket on the edge counts in part
+    counts = np.asarray(counts, dtype=float)
+    values = bucket_values(accuracy)
+    total = counts.sum(axis=-1, keepdims=True)
+    cumulative = np.cumsum(counts, axis=-1)
+    low, high = trim * total, (1 - trim) * total
+    kept = np.clip(cumulative, low, high) - np.clip(cumulative - counts, low, high)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (kept * values).sum(axis=-1) / kept.sum(axis=-1)
+
+
+def quantile_table(sketches, accuracy=None):
+    # sketches: (VARIATIONS, TIME_STEPS, buckets) -> one row per step and variation
+    quantiles = sketch_quantiles(sketches, QUANTILES, accuracy)
+    trimmed = sketch_trimmed_mean(sketches, TRIM_SHARE, accuracy)
+    moves = np.asarray(sketches).sum(axis=-1)
+    rows = []
+    for step, label in enumerate(STEP_LABELS):
+        for group, variation in enumerate(VARIATIONS):
+            rows.append([label, variation, int(moves[group, step])] + list(quantiles[group, step]) +
+                        [trimmed[group, step]])
+    return pd.DataFrame(rows, columns=QUANTILE_COLUMNS)
+
+
+def move_times(data):
+    # (row, step position, time before the move) of every forward move in Final_DF
+    steps = pd.Categorical(data['process_step'], categories=TIME_STEPS).codes.astype(np.int64)
+    forward = data[TRANSITION_COLUMNS].to_numpy().sum(axis=1) > 0
+    moves = np.flatnonzero(forward & (steps >= 0))
+    times = sum(data[column].to_numpy(dtype=float)[moves] for column in TIME_COLUMNS if column in data.columns)
+    return moves, steps[moves], np.asarray(times, dtype=float)
+
+
+class QuantileCube:
+    def __init__(self, cells, entry_cells, entry_keys, entry_counts, accuracy):
+        # Non-empty (cell, step * buckets + bucket) counts, sorted by cell
+        self.cells = cells
+        self.entry_cells = entry_cells
+        self.entry_keys = entry_keys
+        self.entry_counts = entry_counts
+        self.accuracy = accuracy
+        self.buckets = n_buckets(accuracy)
+        variations = cells.index.get_level_values('Variation')
+        self.cell_variation = pd.Index(VARIATIONS).get_indexer(variations.astype(object))
+
+    def select(self, min_age, max_age, variation='All', gender='All'):
+        from Vanguard_cube import select_cells
+        return select_cells(self.cells, min_age, max_age, variation, gender)['position'].to_numpy()
+
+    def sketches(self, positions):
+        # (VARIATIONS, TIME_STEPS, buckets) counts merged over the selected cells
+        selected = np.zeros(len(self.cells), dtype=bool)
+        selected[positions] = True
+        selected &= self.cell_variation >= 0
+        entries = selected[self.entry_cells]
+        flat = self.cell_variation[self.entry_cells[entries]] * len(TIME_STEPS) * self.buckets + self.entry_keys[entries]
+        counts = np.bincount(flat, weights=self.entry_counts[entries],
+                             minlength=len(VARIATIONS) * len(TIME_STEPS) * self.buckets)
+        return counts.reshape(len(VARIATIONS), len(TIME_STEPS), self.buckets)
+
+
+@profiled()
+def build_quantile_cube(data, accuracy=None):
+    accuracy = quantile_accuracy if accuracy is None else accuracy
+    grouped = data.groupby(SEGMENT_KEYS, observed=True, dropna=False, sort=True)
+    cell_codes = grouped.ngroup().to_numpy()
+    cells = pd.DataFrame({'position': np.arange(grouped.ngroups)}, index=grouped.size().index)
+
+    moves, steps, times = move_times(data)
+    buckets = n_buckets(accuracy)
+    flat = (cell_codes[moves] * len(TIME_STEPS) + steps) * buckets + bucket_keys(times, accuracy)
+    entries, counts = np.unique(flat, return_counts=True)
+    return QuantileCube(cells, entries // (len(TIME_STEPS) * buckets), entries % (len(TIME_STEPS) * buckets),
+                        counts.astype(float), accuracy)
+
+
+def get_quantile_cube(data):
+    global _built
+    if _built[0] is not data:
+        _built = (data, build_quantile_cube(data))
+    return _built[1]
+
+
+def exact_table(data, trim=TRIM_SHARE):
+    # The same table from the sorted raw times, to check the sketches against
+    moves, steps, times = move_times(data)
+    variations = data['Variation'].astype(object).to_numpy()[moves]
+    rows = []
+    for step, label in enumerate(STEP_LABELS):
+        for variation in VARIATIONS:
+            values = np.sort(times[(steps == step) & (variations == variation)])
+            if not len(values):
+                rows.append([label, variation, 0] + [np.nan] * (len(QUANTILES) + 1))
+                continue
+            # Trimmed as in sketch_trimmed_mean, a value on the edge counting in part
+            rank = np.arange(len(values))
+            low, high = trim * len(values), (1 - trim) * len(values)
+            kept = np.clip(rank + 1, low, high) - np.clip(rank, low, high)
+            rows.append([label, variation, len(values)] + list(np.quantile(values, QUANTILES, method='lower')) +
+                        [(kept * values).sum() / kept.sum()])
+    return pd.DataFrame(rows, columns=QUANTILE_COLUMNS)
+
+
+def main():
+    from Vanguard_ingest import load_final_df
+    parser = argparse.ArgumentParser(description='Navigation time quantiles from the sketches, against the exact ones.')
+    parser.add_argument('path', help='Final_DF CSV')
+    parser.add_argument('--accuracy', type=float, default=quantile_accuracy, help='relative accuracy of the sketches')
+    args = parser.parse_args()
+
+    data = load_final_df(args.path)
+    start = time.perf_counter()
+    cube = build_quantile_cube(data, args.accuracy)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    sketched = quantile_table(cube.sketches(np.arange(len(cube.cells))), args.accuracy)
+    queried = time.perf_counter() - start
+    print('built in %.1f ms, %d entries; query %.2f ms' % (built * 1000, len(cube.entry_counts), queried * 1000))
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print('sketch\n%s' % sketched.to_string(index=False, float_format='%.1f'))
+        print('exact\n%s' % exact_table(data).to_string(index=False, float_format='%.1f'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import io
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import streamlit as st
+from Vanguard_profile import profiled
+
+# Render layer for the dashboard charts. A chart is identified by its name and
+# the metrics it shows (never the raw frame), and the rendered PNG bytes are
+# kept in a bounded LRU shared by every session of the server process, so an
+# identical filter state is rasterized once. With CHART_FORMAT=vega the charts
+# are sent as Vega-Lite JSON specs and drawn by the browser instead.
+
+chart_format = os.getenv('CHART_FORMAT', 'png')
+chart_cache_entries = int(os.getenv('CHART_CACHE_ENTRIES', 256))
+chart_cache_bytes = int(os.getenv('CHART_CACHE_BYTES', 64 << 20))
+render_dpi = 140
+
+GROUP_COLORS = {'Control': 'blue', 'Test': 'green'}
+
+
+class ChartCache:
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, payload):
+        size = _payload_size(payload)
+        with self.lock:
+            if key in self.entries:
+                self.size -= _payload_size(self.entries.pop(key))
+            self.entries[key] = payload
+            self.size += size
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= _payload_size(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+def _payload_size(payload):
+    if payload is None:
+        return 0
+    if isinstance(payload, bytes):
+        return len(payload)
+    return len(json.dumps(payload))
+
+
+_chart_cache = ChartCache(chart_cache_entries, chart_cache_bytes)
+
+
+def _plain(value):
+    # JSON-able form of the chart metrics, used for cache keys and specs
+    if isinstance(value, pd.DataFrame):
+        return {'columns': [str(column) for column in value.columns],
+                'data': [[_plain(item) for item in row] for row in value.itertuples(index=False)]}
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def chart_key(name, metrics, fmt):
+    return json.dumps([name, fmt, _plain(metrics)], sort_keys=True, default=str)
+
+
+@profiled()
+def render_png(fig):
+    buffer = io.BytesIO()
+    # st.pyplot renders at dpi=200 and Streamlit then downsizes anything wider than
+    # 1460px on every call; rendering a 10in figure at 140dpi stays under that width,
+    # so cached bytes are served as-is
+    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=render_dpi, transparent=True)
+    fig.clf()
+    return buffer.getvalue()
+
+
+def chart_request(name, metrics, spec=None):
+    # (format, cache key) the chart is served as
+    fmt = 'vega' if chart_format == 'vega' and spec is not None else 'png'
+    return fmt, chart_key(name, metrics, fmt)
+
+
+def make_payload(fmt, metrics, draw, spec=None):
+    # Vega-Lite spec or PNG bytes (None when there is nothing to draw); needs no Streamlit,
+    # so it can run in a panel worker thread or process
+    if fmt == 'vega':
+        return spec(metrics)
+    fig = draw(metrics)
+    return render_png(fig) if fig is not None else None
+
+
+def cached_payload(key):
+    return _chart_cache.get(key)
+
+
+def store_payload(key, payload):
+    _chart_cache.put(key, payload)
+
+
+def chart_payload(name, metrics, draw, spec=None):
+    fmt, key = chart_request(name, metrics, spec)
+    found, payload = _chart_cache.get(key)
+    if not found:
+        payload = make_payload(fmt, metrics, draw, spec)
+        _chart_cache.put(key, payload)
+    return fmt, payload
+
+
+def show_payload(fmt, payload, empty_message=None):
+    if payload is None:
+        st.write(empty_message)
+    elif fmt == 'vega':
+        st.vega_lite_chart(payload, use_container_width=True)
+    else:
+        st.image(payload, use_column_width=True)
+
+
+@profiled()
+def show_chart(name, metrics, draw, spec=None, empty_message=None):
+    fmt, payload = chart_payload(name, metrics, draw, spec)
+    show_payload(fmt, payload, empty_message)
+
+
+def _line_spec(title, x_title, y_title, values, y_domain=None, y_format=None, colors=None):
+    y = {'field': 'value', 'type': 'quantitative', 'title': y_title}
+    if y_domain is not None:
+        y['scale'] = {'domain': y_domain}
+    if y_format is not None:
+        y['axis'] = {'format': y_format}
+    color = {'field': 'series', 'type': 'nominal', 'title': None}
+    if colors is not None:
+        color['scale'] = {'domain': list(colors), 'range': list(colors.values())}
+    return {
+        'title': title,
+        'data': {'values': values},
+        'mark': {'type': 'line', 'point': True},
+        'encoding': {
+            'x': {'field': 'step', 'type': 'ordinal', 'sort': None, 'title': x_title},
+            'y': y,
+            'color': color
+        }
+    }
+
+
+def _bar_spec(title, y_title, values, y_domain, y_format):
+    return {
+        'title': title,
+        'data': {'values': values},
+        'mark': 'bar',
+        'encoding': {
+            'x': {'field': 'group', 'type': 'nominal', 'title': 'Group'},
+            'y': {'field': 'value', 'type': 'quantitative', 'title': y_title,
+                  'scale': {'domain': y_domain}, 'axis': {'format': y_format}},
+            'color': {'field': 'group', 'type': 'nominal', 'legend': None,
+                      'scale': {'domain': list(GROUP_COLORS), 'range': list(GROUP_COLORS.values())}}
+        }
+    }
+
+
+def confirmation_rate_spec(rates):
+    values = [{'group': group, 'value': _plain(rates[group])} for group in GROUP_COLORS
+              if _plain(rates[group]) is not None]
+    if not values:
+        return None
+    return _bar_spec('Confirmation Rates by Group', 'Confirmation Rate', values, [0, 1], '.0%')
+
+
+def bounce_rate_spec(rates):
+    values = [{'group': group, 'value': _plain(rates[group]) or 0} for group in GROUP_COLORS]
+    return _bar_spec('Bounce Rates by Group (%)', 'Bounce Rate (%)', values, [0, 100], 'd')
+
+
+def drop_rate_spec(drop_rates):
+    values = [{'step': row['Step'], 'series': group + ' Drop Rate', 'value': _plain(row[group])}
+              for _, row in drop_rates.iterrows() for group in GROUP_COLORS]
+    colors = {group + ' Drop Rate': color for group, color in GROUP_COLORS.items()}
+    return _line_spec('Drop Rates by Step for Control and Test Groups (%)', 'Process Step', 'Drop Rate (%)',
+                      values, y_domain=[0, 100], colors=colors)
+
+
+def navigation_time_spec(avg_times):
+    avg_times = avg_times.copy()
+    avg_times['Overall Average'] = avg_times[['Control', 'Test']].mean(axis=1)
+    values = [{'step': row['Step'], 'series': series, 'value': _plain(row[series])}
+              for _, row in avg_times.iterrows() for series in ['Control', 'Test', 'Overall Average']]
+    return _line_spec('Average Time for Each Step by Group', 'Step', 'Average Time in minutes', values)
+
+
+def _interval(row, group, unit, scale):
+    value, low, high = (_plain(row[column]) for column in (group, group + ' Low', group + ' High'))
+    if value is None:
+        return f'{group} n/a'
+    if low is None:
+        return f'{group} {value * scale:.1f}{unit}'
+    return f'{group} {value * scale:.1f}{unit} [{low * scale:.1f}, {high * scale:.1f}]'
+
+
+def show_tests(tests, metric, unit='%', scale=1, level=95):
+    # One caption line per step: both groups with their CI and the Control vs Test p-value
+    lines = []
+    for _, row in tests[tests['metric'] == metric].iterrows():
+        groups = ' vs '.join(_interval(row, group, unit, scale) for group in GROUP_COLORS)
+        p_value = _plain(row['p_value'])
+        lines.append(f"{row['step']}: {groups}, p={'n/a' if p_value is None else f'{p_value:.3f}'}")
+    if lines:
+        st.caption(f'{level}% CI, two-sided z-test  \n' + '  \n'.join(lines))
+
+
+def _quantiles(row):
+    if not row['Moves']:
+        return f"{row['Variation']} n/a"
+    return f"{row['Variation']} p50 {row['p50']:.0f}s, p90 {row['p90']:.0f}s, p99 {row['p99']:.0f}s, " \
+           f"trimmed mean {row['Trimmed Mean']:.0f}s"
+
+
+def show_quantiles(quantiles):
+    # One caption line per step with both groups' navigation time quantiles, from the sketches
+    from Vanguard_quantiles import TRIM_SHARE
+    lines = [f"{step}: {' vs '.join(_quantiles(row) for _, row in rows.iterrows())}"
+             for step, rows in quantiles.groupby('Step', sort=False)]
+    if lines:
+        st.caption(f'Navigation time quantiles, mean trimmed {TRIM_SHARE * 100:g}% each end  \n' + '  \n'.join(lines))
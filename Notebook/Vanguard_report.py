@@ -0,0 +1,269 @@
+import argparse
+import html
+import itertools
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from Vanguard_engine import get_engine, default_parquet_source
+from Vanguard_ingest import load_final_df
+from Vanguard_quantiles import QUANTILE_STATISTICS
+
+# Headless batch report: the summary cards, error rate, the four chart metrics,
+# the navigation time quantiles and the Control vs Test tests for a list of
+# sidebar filters, computed by the dashboard's engine (Vanguard_engine)
+# without Streamlit or matplotlib.
+# Loading the data also refreshes the Final_DF Parquet cache the dashboard
+# starts from, so running this after every data refresh keeps the first
+# dashboard load warm.
+#
+#   python Vanguard_report.py --filter age=30-50,variation=Test,gender=Female --output report.html
+#   python Vanguard_report.py --all-segments --output report.json --output report.csv
+
+VARIATION_OPTIONS = ['All', 'Control', 'Test']
+GENDER_OPTIONS = ['All', 'Male', 'Female', 'Unknown']
+
+# Upper bound of every rate the tests report
+RATE_LIMITS = {'Drop Rate': 100, 'Bounce Rate': 100, 'Confirmation Rate': 1}
+
+# Summary cards in dashboard order
+SUMMARY_CARDS = ['Clients', 'Average Age', 'Average Tenure', 'Percentage Control', 'Percentage Test']
+
+
+def parse_filter(text, min_age, max_age):
+    # "age=30-50,variation=Test,gender=Female"; missing keys mean the whole range / 'All'
+    spec = {'min_age': min_age, 'max_age': max_age, 'variation': 'All', 'gender': 'All'}
+    for part in filter(None, text.split(',')):
+        key, _, value = part.partition('=')
+        key, value = key.strip().lower(), value.strip()
+        if key == 'age':
+            low, _, high = value.partition('-')
+            spec['min_age'], spec['max_age'] = int(low or min_age), int(high or max_age)
+        elif key in ('min_age', 'max_age'):
+            spec[key] = int(value)
+        elif key == 'variation' and value.capitalize() in VARIATION_OPTIONS:
+            spec['variation'] = value.capitalize()
+        elif key == 'gender' and value.capitalize() in GENDER_OPTIONS:
+            spec['gender'] = value.capitalize()
+        else:
+            raise ValueError(f'unknown filter {part!r}')
+    return spec
+
+
+def all_segments(min_age, max_age, age_bins=None):
+    # Every sidebar Variation x Gender option, over the full age range and each age bin
+    from Vanguard_segments import AGE_BINS
+    age_bins = AGE_BINS if age_bins is None else age_bins
+    ranges = [(min_age, max_age)] + [(max(int(low), min_age), min(int(math.ceil(high)) - 1, max_age))
+                                     for low, high in zip(age_bins[:-1], age_bins[1:])]
+    ranges = [(low, high) for low, high in dict.fromkeys(ranges) if low <= high]
+    return [{'min_age': low, 'max_age': high, 'variation': variation, 'gender': gender}
+            for (low, high), variation, gender in itertools.product(ranges, VARIATION_OPTIONS, GENDER_OPTIONS)]
+
+
+def age_windows(min_age, max_age, width=1):
+    # Every Variation x Gender option over consecutive age windows of `width` years
+    return [{'min_age': low, 'max_age': min(low + width - 1, max_age), 'variation': variation, 'gender': gender}
+            for low, variation, gender in itertools.product(range(min_age, max_age + 1, width), VARIATION_OPTIONS,
+                                                            GENDER_OPTIONS)]
+
+
+def check_tests(engine, specs, n_boot=200, seed=0):
+    # tests() must run on any sidebar filter; rates and CIs in range, p-values in [0, 1] or NaN.
+    # Returns the failures, one line each.
+    failures = []
+    for spec in specs:
+        try:
+            tests = engine.tests(_filters(spec), n_boot=n_boot, seed=seed)
+        except Exception as error:
+            failures.append('%s: %s: %s' % (segment_name(spec), type(error).__name__, error))
+            continue
+        for record in tests.to_dict(orient='records'):
+            # Mean times have normal CIs on the engines without raw times, which may dip below zero
+            limit = RATE_LIMITS.get(record['metric'])
+            values = [record[column] for column in ('Control', 'Control Low', 'Control High', 'Test', 'Test Low',
+                                                    'Test High')] if limit is not None else []
+            if any(value < 0 or value > limit for value in values if not pd.isna(value)) or \
+                    not (pd.isna(record['p_value']) or 0 <= record['p_value'] <= 1):
+                failures.append('%s: %s %s out of range' % (segment_name(spec), record['metric'], record['step']))
+    return failures
+
+
+def segment_name(spec):
+    return 'age %d-%d, %s, %s' % (spec['min_age'], spec['max_age'], spec['variation'], spec['gender'])
+
+
+def _filters(spec):
+    return spec['min_age'], spec['max_age'], spec['variation'], spec['gender']
+
+
+def evaluate(engine, spec, n_boot=2_000, seed=0):
+    filters = _filters(spec)
+    summary = engine.summary(filters)
+    return {
+        'segment': segment_name(spec),
+        'filters': spec,
+        'summary': {column: summary[column].iloc[0] for column in summary.columns},
+        'error_rate': engine.error_rate(filters),
+        'error_rate_bound': engine.error_rate_bound(filters),
+        'confirmation_rates': engine.confirmation_rates(filters),
+        'bounce_rates': engine.bounce_rates(filters),
+        'drop_rates': engine.drop_rates(filters),
+        'navigation_times': engine.navigation_times(filters),
+        'navigation_quantiles': engine.navigation_quantiles(filters),
+        'tests': engine.tests(filters, n_boot=n_boot, seed=seed),
+    }
+
+
+def build_report(engine, specs, n_boot=2_000, seed=0):
+    return [evaluate(engine, spec, n_boot, seed) for spec in specs]
+
+
+def _plain(value):
+    if isinstance(value, pd.DataFrame):
+        return [_plain(record) for record in value.to_dict(orient='records')]
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, (np.integer, np.bool_)):
+        return value.item()
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.ndarray):
+        return _plain(value.item() if value.ndim == 0 else value.tolist())
+    return value
+
+
+def report_rows(report):
+    # One row per segment, metric, step and statistic
+    rows = []
+    for entry in report:
+        keys = {'segment': entry['segment'], **entry['filters']}
+        for card, value in entry['summary'].items():
+            rows.append({**keys, 'metric': card, 'step': None, 'statistic': 'value', 'value': value})
+        rows.append({**keys, 'metric': 'Error Rate', 'step': None, 'statistic': 'value', 'value': entry['error_rate']})
+        if entry['error_rate_bound'] is not None:
+            rows.append({**keys, 'metric': 'Error Rate', 'step': None, 'statistic': 'error',
+                         'value': entry['error_rate_bound']})
+        for metric, rates in (('Confirmation Rate', entry['confirmation_rates']), ('Bounce Rate', entry['bounce_rates'])):
+            for group, value in rates.items():
+                rows.append({**keys, 'metric': metric, 'step': None, 'statistic': group, 'value': value})
+        for metric, table in (('Drop Rate', entry['drop_rates']), ('Navigation Time', entry['navigation_times'])):
+            for group in table.columns[1:]:
+                for step, value in zip(table['Step'], table[group]):
+                    rows.append({**keys, 'metric': metric, 'step': step, 'statistic': group, 'value': value})
+        for record in entry['navigation_quantiles'].to_dict(orient='records'):
+            for statistic in QUANTILE_STATISTICS:
+                rows.append({**keys, 'metric': 'Navigation Time', 'step': record['Step'],
+                             'statistic': '%s %s' % (record['Variation'], statistic), 'value': record[statistic]})
+        tests = entry['tests']
+        for record in tests.to_dict(orient='records'):
+            for statistic in ('Control Low', 'Control High', 'Test Low', 'Test High', 'z', 'p_value'):
+                rows.append({**keys, 'metric': record['metric'], 'step': record['step'], 'statistic': statistic,
+                             'value': record[statistic]})
+    frame = pd.DataFrame(rows)
+    frame['value'] = pd.to_numeric(frame['value'], errors='coerce')
+    return frame
+
+
+def write_json(report, path):
+    with open(path, 'w') as handle:
+        json.dump(_plain(report), handle, indent=2)
+
+
+def write_csv(report, path):
+    report_rows(report).to_csv(path, index=False)
+
+
+def write_html(report, path):
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>Vanguard A/B report</title>',
+             '<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin-bottom:1em}'
+             'td,th{border:1px solid #ccc;padding:0.2em 0.6em;text-align:right}</style></head><body>',
+             '<h1>Vanguard A/B report</h1>']
+    for entry in report:
+        parts.append('<h2>%s</h2>' % html.escape(entry['segment']))
+        cards = pd.DataFrame([{**{card: entry['summary'][card] for card in SUMMARY_CARDS},
+                               'Error Rate (%)': 100 * entry['error_rate']}])
+        parts.append(cards.to_html(index=False, float_format='%.2f', na_rep='n/a'))
+        parts.append(entry['tests'].to_html(index=False, float_format='%.4g', na_rep='n/a'))
+        parts.append(entry['navigation_quantiles'].to_html(index=False, float_format='%.1f', na_rep='n/a'))
+    parts.append('</body></html>')
+    with open(path, 'w') as handle:
+        handle.write('\n'.join(parts))
+
+
+WRITERS = {'.json': write_json, '.csv': write_csv, '.html': write_html, '.htm': write_html}
+
+
+def write_report(report, path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(f'unsupported report format {extension!r}, expected one of {sorted(WRITERS)}')
+    WRITERS[extension](report, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the dashboard metrics for sidebar filters without Streamlit.')
+    parser.add_argument('--data', help='Final_DF CSV (default: DIR + CSV5 from .env)')
+    parser.add_argument('--engine', choices=['pandas', 'duckdb', 'sketch'], default=None,
+                        help='default: ENGINE from the env; sketch is approximate, for exploration only')
+    parser.add_argument('--filter', action='append', default=[], dest='filters',
+                        help='age=30-50,variation=Test,gender=Female (repeatable)')
+    parser.add_argument('--specs', help='JSON file with a list of {min_age, max_age, variation, gender}')
+    parser.add_argument('--all-segments', action='store_true',
+                        help='every Variation x Gender option over the full age range and each age bin')
+    parser.add_argument('--n-boot', type=int, default=2_000, help='bootstrap resamples for the CIs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', action='append', default=[], help='.json, .csv or .html (repeatable)')
+    parser.add_argument('--check-windows', type=int, metavar='YEARS', default=None,
+                        help='instead of a report, run the tests over every age window of YEARS x Variation x Gender '
+                             'option and fail on errors or out-of-range values')
+    args = parser.parse_args()
+
+    if args.data is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+    path = args.data or os.getenv('DIR') + os.getenv('CSV5')
+
+    start = time.perf_counter()
+    engine_name = args.engine or os.getenv('ENGINE', 'pandas')
+    if engine_name == 'duckdb':
+        engine = get_engine('duckdb', source=os.getenv('PARQUET_SOURCE') or default_parquet_source(path))
+    else:
+        engine = get_engine(engine_name, data=load_final_df(path))
+    min_age, max_age = engine.age_range()
+
+    if args.check_windows:
+        specs = age_windows(min_age, max_age, args.check_windows)
+        failures = check_tests(engine, specs, seed=args.seed)
+        for failure in failures:
+            print('FAIL', failure)
+        print('%d segments checked, %d failures in %.2fs' % (len(specs), len(failures), time.perf_counter() - start),
+              file=sys.stderr)
+        return 1 if failures else 0
+
+    specs = [parse_filter(text, min_age, max_age) for text in args.filters]
+    if args.specs:
+        with open(args.specs) as handle:
+            specs += [{'min_age': min_age, 'max_age': max_age, 'variation': 'All', 'gender': 'All', **spec}
+                      for spec in json.load(handle)]
+    if args.all_segments:
+        specs += all_segments(min_age, max_age)
+    if not specs:
+        specs = [parse_filter('', min_age, max_age)]
+
+    report = build_report(engine, specs, args.n_boot, args.seed)
+    for output in args.output:
+        write_report(report, output)
+    if not args.output:
+        print(report_rows(report).to_string(index=False))
+    print('%d segments in %.2fs' % (len(report), time.perf_counter() - start), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
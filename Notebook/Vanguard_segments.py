@@ -0,0 +1,157 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER, STEP_LABELS, DROP_LABELS
+from Vanguard_cube import build_cube
+
+# Segment sweep: the full dashboard metric set for every age bin x gendr x
+# Variation segment in one pass, instead of one filter-and-recompute pass per
+# segment. The frame is split at client boundaries into one slice per worker
+# and every worker builds the segment cube (Vanguard_cube) of its slice; the
+# cells are additive, so the partial cubes are summed, regrouped by age bin
+# and turned into metrics once. The result is a tidy table with one row per
+# segment, metric and step, with numerator and denominator so rows can be
+# re-aggregated.
+#
+#   python Vanguard_segments.py --bins 0 18 30 40 60 100 --margins --output segments.csv
+
+# Age groups used in Data_Vanguard.ipynb, left-closed like pd.cut(..., right=False) there
+AGE_BINS = [0, 18, 30, 40, 60, 100]
+AGE_LABELS = ['1-18', '18-30', '31-40', '41-60', '61-100']
+
+SEGMENT_KEYS = ['age_group', 'gendr', 'Variation']
+ALL = 'All'
+
+sweep_workers = int(os.getenv('SWEEP_WORKERS', os.cpu_count() or 1))
+# Rows per worker below which a process pool costs more than it saves
+MIN_ROWS_PER_WORKER = 200_000
+
+
+def _client_slices(data, parts):
+    # Row ranges of about equal size that never split a client
+    client_ids = data['client_id'].to_numpy()
+    if len(client_ids) > 1 and (client_ids[1:] < client_ids[:-1]).any():
+        data = data.sort_values('client_id', kind='stable')
+        client_ids = data['client_id'].to_numpy()
+    cuts = [0]
+    for part in range(1, parts):
+        cut = np.searchsorted(client_ids, client_ids[len(client_ids) * part // parts], side='left')
+        if cut > cuts[-1]:
+            cuts.append(cut)
+    cuts.append(len(client_ids))
+    return [data.iloc[start:stop] for start, stop in zip(cuts[:-1], cuts[1:]) if stop > start]
+
+
+def parallel_cube(data, workers=None):
+    # build_cube(data), with slices of whole clients built in worker processes
+    workers = sweep_workers if workers is None else workers
+    workers = max(1, min(workers, len(data) // MIN_ROWS_PER_WORKER))
+    if workers == 1:
+        return build_cube(data)
+    slices = _client_slices(data, workers)
+    with ProcessPoolExecutor(max_workers=len(slices)) as pool:
+        cubes = list(pool.map(build_cube, slices))
+    return pd.concat(cubes).groupby(level=cubes[0].index.names, observed=True, dropna=False, sort=True).sum()
+
+
+def segment_counts(cube, age_bins=AGE_BINS, age_labels=AGE_LABELS):
+    # Cube cells summed per age bin x gendr x Variation
+    cells = cube.reset_index()
+    cells['age_group'] = pd.cut(cells['clnt_age'], bins=age_bins, labels=age_labels, right=False)
+    return cells.drop(columns='clnt_age').groupby(SEGMENT_KEYS, observed=True, dropna=False).sum()
+
+
+def _with_margins(counts):
+    # Add 'All' rows for every subset of the segment keys, like the sidebar's 'All' options
+    frames = [counts]
+    keys = counts.index.names
+    for size in range(len(keys)):
+        for kept in itertools.combinations(keys, size):
+            if kept:
+                totals = counts.groupby(level=list(kept), observed=True, dropna=False).sum().reset_index()
+            else:
+                totals = counts.sum().to_frame().T
+            for key in keys:
+                if key not in kept:
+                    totals[key] = ALL
+            frames.append(totals.set_index(keys))
+    index = pd.MultiIndex.from_frame(pd.concat(
+        [frame.index.to_frame(index=False).astype(object) for frame in frames], ignore_index=True))
+    result = pd.concat(frames, ignore_index=True)
+    result.index = index
+    return result
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+
+
+def segment_metrics(counts):
+    # Tidy metrics from per-segment counts, same definitions as the dashboard
+    keys = counts.index.to_frame(index=False).astype(object)
+    frames = []
+
+    def add(metric, step, numerator, denominator, value):
+        frames.append(keys.assign(metric=metric, step=step, value=value, numerator=np.asarray(numerator, dtype=float),
+                                  denominator=np.asarray(denominator, dtype=float)))
+
+    starts, confirms = counts['visits|' + STEP_ORDER[0]], counts['visits|' + STEP_ORDER[-1]]
+    add('Confirmation Rate', 'Start-Confirm', confirms, starts,
+        np.where((starts > 0) & (confirms > 0), _ratio(confirms, starts), np.nan))
+    for step, drop_label, step_label in zip(STEP_ORDER[:-1], DROP_LABELS, STEP_LABELS):
+        drops, forward = counts['dropoff|' + step], counts['forward|' + step]
+        add('Drop Rate', drop_label, drops, drops + forward, _ratio(100 * drops, drops + forward))
+    for step, step_label in zip(STEP_ORDER[:-1], STEP_LABELS):
+        time, forward = counts['time|' + step], counts['forward|' + step]
+        add('Navigation Time', step_label, time, forward, _ratio(time, forward))
+    add('Bounce Rate', 'Start', counts['bounce_visits'], starts, _ratio(100 * counts['bounce_visits'], starts))
+    add('Error Rate', 'All', counts['error_steps'], counts['rows'], _ratio(counts['error_steps'], counts['rows']))
+    add('Clients', 'All', counts['clients'], np.ones(len(counts)), counts['clients'].to_numpy(dtype=float))
+    return pd.concat(frames, ignore_index=True)
+
+
+def sweep_segments(data=None, age_bins=AGE_BINS, age_labels=AGE_LABELS, margins=False, workers=None, cube=None):
+    # Pass the dashboard's cube (get_cube) to skip rebuilding it; any binning is then a regroup of its cells
+    if age_labels is None or len(age_labels) != len(age_bins) - 1:
+        age_labels = ['%g-%g' % (low, high) for low, high in zip(age_bins[:-1], age_bins[1:])]
+    cube = parallel_cube(data, workers) if cube is None else cube
+    counts = segment_counts(cube, age_bins, age_labels)
+    if margins:
+        counts = _with_margins(counts)
+    return segment_metrics(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dashboard metrics for every age bin x gender x variation segment.')
+    parser.add_argument('--data', help='Final_DF CSV (default: DIR + CSV5 from .env)')
+    parser.add_argument('--bins', type=float, nargs='+', default=AGE_BINS, help='age bin edges, left-closed')
+    parser.add_argument('--labels', nargs='+', help='age bin labels (default: the notebook labels or "low-high")')
+    parser.add_argument('--margins', action='store_true', help="add 'All' rows for every key")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', help='write the table as CSV (or JSON for a .json path)')
+    args = parser.parse_args()
+
+    from Vanguard_ingest import load_final_df
+    if args.data:
+        data = load_final_df(args.data)
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        data = load_final_df(os.getenv('DIR') + os.getenv('CSV5'))
+
+    labels = args.labels or (AGE_LABELS if args.bins == AGE_BINS else None)
+    table = sweep_segments(data, args.bins, labels, args.margins, args.workers)
+    if not args.output:
+        print(table.to_string(index=False))
+    elif args.output.endswith('.json'):
+        table.to_json(args.output, orient='records', indent=2)
+    else:
+        table.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
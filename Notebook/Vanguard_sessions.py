@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Sessionization: rebuilds visit_id from client_id and date_time for logs
+# whose visit ids are missing or broken. Events are sorted once by (client,
+# time); a new visit starts at a client's first event, after an inactivity
+# gap longer than SESSION_GAP_MINUTES, and (restart_on_start) when a 'start'
+# follows any other step. Ids are '<client_id>_<first event ns>', so the same
+# events get the same ids however the log is chunked.
+#
+# Chunked logs: a visit is complete once no later row can join it. With
+# log_order='client' (the raw exports, one client's events together) that is
+# every client but the last one of the chunk; with log_order='time' (a live
+# log) it is every visit whose last event is more than the gap before the
+# chunk's newest event. Open rows are carried into the next chunk and
+# sessionized again with it.
+
+session_gap_minutes = float(os.getenv('SESSION_GAP_MINUTES', 30))
+
+LOG_ORDERS = ['client', 'time']
+DEFAULT_CHUNK_SIZE = 500_000
+
+
+def _client_time_order(clients, times):
+    # None when the rows already are in (client, time) order
+    same_client = clients[1:] == clients[:-1]
+    if np.all(clients[1:] >= clients[:-1]) and np.all(times[1:][same_client] >= times[:-1][same_client]):
+        return None
+    return np.lexsort((times, clients))
+
+
+def session_starts(clients, times, is_start, gap_ns, restart_on_start=True):
+    # New-visit flag of every event, arrays in (client, time) order
+    new = np.ones(len(clients), dtype=bool)
+    new[1:] = (clients[1:] != clients[:-1]) | (times[1:] - times[:-1] > gap_ns)
+    if restart_on_start:
+        new[1:] |= is_start[1:] & ~is_start[:-1]
+    return new
+
+
+def session_ids(clients, times, new):
+    # '<client_id>_<first event ns>' per visit, '_<n>' added if two visits of a client start at the same instant
+    first = np.flatnonzero(new)
+    ids = pd.Series(clients[first]).astype(str) + '_' + pd.Series(times[first]).astype(str)
+    duplicate = ids.groupby(ids).cumcount()
+    if duplicate.any():
+        ids = ids.where(duplicate == 0, ids + '_' + duplicate.astype(str))
+    return ids.to_numpy()[np.cumsum(new) - 1]
+
+
+def sessionize(data, gap_minutes=None, restart_on_start=True, keep_source_ids=False):
+    # data sorted by (client_id, date_time) with visit_id rebuilt; the old ids go to
+    # source_visit_id when keep_source_ids
+    gap_minutes = session_gap_minutes if gap_minutes is None else gap_minutes
+    date_time = pd.to_datetime(data['date_time'])
+    clients = data['client_id'].to_numpy()
+    times = date_time.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    order = _client_time_order(clients, times)
+    if order is not None:
+        data, clients, times, date_time = data.iloc[order], clients[order], times[order], date_time.iloc[order]
+    data = data.reset_index(drop=True)
+    is_start = (data['process_step'] == 'start').to_numpy()
+    new = session_starts(clients, times, is_start, int(gap_minutes * 60e9), restart_on_start)
+    if keep_source_ids and 'visit_id' in data.columns:
+        data['source_visit_id'] = data['visit_id']
+    data['visit_id'] = session_ids(clients, times, new)
+    data['date_time'] = date_time.to_numpy()
+    return data
+
+
+def split_open(data, gap_minutes=None, log_order='client'):
+    # (complete visits, open visits) of a sessionize() result
+    if log_order not in LOG_ORDERS:
+        raise ValueError(f'log_order must be one of {LOG_ORDERS}')
+    if data.empty:
+        return data, data
+    gap_minutes = session_gap_minutes if gap_minutes is None else gap_minutes
+    clients = data['client_id'].to_numpy()
+    if log_order == 'client':
+        # The exports do not keep a client's events in time order, so the whole of the
+        # last client read stays open (the sort moved it, hence attrs['last_client'])
+        open_rows = clients == data.attrs.get('last_client', clients[-1])
+    else:
+        # In a time-ordered log only the last visit of a client can still grow
+        visits = data['visit_id'].to_numpy()
+        last_of_client = np.ones(len(data), dtype=bool)
+        last_of_client[:-1] = clients[1:] != clients[:-1]
+        last_visit = pd.Series(visits[last_of_client], index=clients[last_of_client])
+        is_last_visit = visits == last_visit.reindex(clients).to_numpy()
+        times = data['date_time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        visit_end = pd.Series(times).groupby(visits).transform('max').to_numpy()
+        open_rows = is_last_visit & (visit_end >= times.max() - int(gap_minutes * 60e9))
+    return data[~open_rows], data[open_rows]
+
+
+def sessionize_chunks(chunks, gap_minutes=None, restart_on_start=True, log_order='client', keep_source_ids=False):
+    # Yields complete visits chunk by chunk; open visits are carried and the rest flushed at the end
+    carry = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        last_client = chunk['client_id'].iloc[-1]
+        if carry is not None:
+            if 'source_visit_id' in carry.columns:
+                carry = carry.assign(visit_id=carry['source_visit_id']).drop(columns='source_visit_id')
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        sessions = sessionize(chunk, gap_minutes, restart_on_start, keep_source_ids)
+        sessions.attrs['last_client'] = last_client
+        done, carry = split_open(sessions, gap_minutes, log_order)
+        if not done.empty:
+            yield done
+    if carry is not None and not carry.empty:
+        yield carry
+
+
+def sessionize_file(source, output, gap_minutes=None, restart_on_start=True, log_order='client',
+                    chunk_size=DEFAULT_CHUNK_SIZE, keep_source_ids=False):
+    # Rewrites a raw web log with rebuilt visit ids, one chunk in memory at a time
+    stats = {'rows': 0, 'visits': 0}
+    header = True
+    tmp_path = output + '.tmp'
+    for done in sessionize_chunks(pd.read_csv(source, chunksize=chunk_size), gap_minutes, restart_on_start,
+                                  log_order, keep_source_ids):
+        done.to_csv(tmp_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        stats['rows'] += len(done)
+        stats['visits'] += done['visit_id'].nunique()
+    if header:
+        pd.DataFrame(columns=pd.read_csv(source, nrows=0).columns).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild visit ids of a raw web log from client_id and date_time.')
+    parser.add_argument('source', help='raw web log CSV (client_id, visitor_id, visit_id, process_step, date_time)')
+    parser.add_argument('output', help='sessionized CSV, ready for Vanguard_pipeline')
+    parser.add_argument('--gap', type=float, default=session_gap_minutes, help='inactivity gap in minutes')
+    parser.add_argument('--no-restart-on-start', action='store_true',
+                        help="do not start a new visit when 'start' follows another step")
+    parser.add_argument('--log-order', choices=LOG_ORDERS, default='client',
+                        help="'client': each client's events are together, 'time': the log is in time order")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--keep-source-ids', action='store_true', help='keep the old ids as source_visit_id')
+    args = parser.parse_args()
+
+    stats = sessionize_file(args.source, args.output, args.gap, not args.no_restart_on_start, args.log_order,
+                            args.chunk_size, args.keep_source_ids)
+    print(json.dumps(stats))
+
+
+if __name__ == '__main__':
+    main()
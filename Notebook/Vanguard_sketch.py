@@ -0,0 +1,265 @@
+import os
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER, TRANSITION_COLUMNS, DROPOFF_COLUMNS, TIME_COLUMNS, FUNNEL_MEASURES
+from Vanguard_profile import profiled
+
+# Approximate segment cube for exploring huge datasets (ENGINE=sketch).
+# Same cells as Vanguard_cube, (clnt_age, Variation, gendr), but nothing
+# needs a hash table of client or visit ids:
+#  - distinct clients per cell and distinct visits per cell and step are
+#    HyperLogLog sketches (2**HLL_PRECISION one-byte registers). Sketches
+#    merge by taking the register-wise max, so any filter combination is the
+#    union of its cells' sketches, with a relative standard error of
+#    1.04 / sqrt(2**HLL_PRECISION)
+#  - events, transitions, dropoffs, times, ages and tenures are plain sums
+#    (np.bincount over the cell codes), exact as in the cube
+#  - bounced visits and backward moves need the per-visit rollup, so they
+#    come from a sample of clients (a fixed share SAMPLE_RATE of the client
+#    id hash space, taken in every cell) scaled by 1/SAMPLE_RATE, with the
+#    Horvitz-Thompson variance kept per cell so it adds up across cells
+# Error bounds are CONFIDENCE_Z standard errors. The gender and variation
+# shares are each value's estimate over the sum of the estimates of all the
+# values, so complementary shares add up like the exact ones; separate HLL
+# ratios over the client estimate do not. Exact numbers for final reports
+# stay with ENGINE=pandas or duckdb.
+
+hll_precision = int(os.getenv('HLL_PRECISION', 12))
+sample_rate = float(os.getenv('SAMPLE_RATE', 0.1))
+
+SEGMENT_KEYS = ['clnt_age', 'Variation', 'gendr']
+CONFIDENCE_Z = 1.96
+
+# Low hash bits pick the sampled clients, the high ones the HLL register
+SAMPLE_BITS = 16
+
+# (data, sketch) for the last frame the sketch cube was built from
+_built = (None, None)
+
+
+def hash_values(values):
+    # 64-bit hash of every value; categoricals hash their categories once
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = pd.util.hash_array(values.cat.categories.to_numpy())
+        return categories[np.maximum(values.cat.codes.to_numpy(), 0)]
+    return pd.util.hash_array(np.asarray(values))
+
+
+def _leading_zeros(words):
+    # Leading zero bits of every uint64, 64 for zero
+    words = words.copy()
+    zeros = np.zeros(len(words), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty_top = words < np.uint64(1) << np.uint64(64 - shift)
+        zeros[empty_top] += shift
+        words[empty_top] <<= np.uint64(shift)
+    zeros[words == 0] += 1
+    return zeros
+
+
+def hll_registers(hashes, groups, n_groups, precision=None):
+    # (n_groups, 2**precision) registers; groups[i] is the sketch row of hashes[i]
+    precision = hll_precision if precision is None else precision
+    m = 1 << precision
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rank = np.minimum(_leading_zeros(hashes << np.uint64(precision)), 64 - precision) + 1
+    registers = np.zeros(n_groups * m, dtype=np.uint8)
+    np.maximum.at(registers, groups * m + index, rank.astype(np.uint8))
+    return registers.reshape(n_groups, m)
+
+
+def hll_estimate(registers):
+    # Distinct-count estimate of every sketch along the last axis
+    registers = np.asarray(registers)
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)), axis=-1)
+    zeros = np.sum(registers == 0, axis=-1)
+    # Linear counting while the sketch is still sparse
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def hll_error(precision=None):
+    precision = hll_precision if precision is None else precision
+    return 1.04 / np.sqrt(1 << precision)
+
+
+class SketchCube:
+    def __init__(self, cells, clients, visits, precision, rate):
+        self.cells = cells
+        self.clients = clients
+        self.visits = visits
+        self.precision = precision
+        self.rate = rate
+        self.positions = pd.DataFrame({'position': np.arange(len(cells))}, index=cells.index)
+
+    def select(self, min_age, max_age, variation='All', gender='All'):
+        from Vanguard_cube import select_cells
+        return select_cells(self.positions, min_age, max_age, variation, gender)['position'].to_numpy()
+
+    def distinct_clients(self, positions):
+        if not len(positions):
+            return 0.0
+        return float(hll_estimate(self.clients[positions].max(axis=0)))
+
+    def distinct_visits(self, positions):
+        # Per funnel step
+        if not len(positions):
+            return np.zeros(len(STEP_ORDER))
+        return hll_estimate(self.visits[positions].max(axis=0))
+
+
+def _sampled_visit_sums(data, index, rate, client_hashes):
+    # Bounced visits and backward moves per cell from the sampled clients, scaled up, with their variances
+    from Vanguard_visits import build_visits
+    n_cells = len(index)
+    threshold = np.uint64(int(rate * (1 << SAMPLE_BITS)))
+    sampled = (client_hashes & np.uint64((1 << SAMPLE_BITS) - 1)) < threshold
+    sums = pd.DataFrame(0.0, index=range(n_cells),
+                        columns=['bounce_visits', 'bounce_var', 'error_steps', 'error_var', 'sample_visits'])
+    if not sampled.any():
+        return sums
+    visits = build_visits(data.take(np.flatnonzero(sampled)))
+    # A visit belongs to one client, so to one cell
+    cell = index.get_indexer(pd.MultiIndex.from_frame(visits[SEGMENT_KEYS]))
+    visits = visits.assign(cell=cell, bounce=(visits['steps'] == 1).astype(np.int64))[cell >= 0]
+    sums['sample_visits'] = np.bincount(visits['cell'], minlength=n_cells).astype(float)
+    per_client = visits.groupby(['cell', 'client_id'], observed=True)[['bounce', 'backward_steps']].sum()
+    cells = per_client.index.get_level_values('cell')
+    scale = 1 / rate
+    for column, total, variance in (('bounce', 'bounce_visits', 'bounce_var'),
+                                    ('backward_steps', 'error_steps', 'error_var')):
+        values = per_client[column].to_numpy(dtype=float)
+        sums[total] = np.bincount(cells, weights=values * scale, minlength=n_cells)
+        sums[variance] = np.bincount(cells, weights=(1 - rate) * scale * scale * values * values, minlength=n_cells)
+    return sums
+
+
+@profiled()
+def build_sketch_cube(data, precision=None, rate=None):
+    precision = hll_precision if precision is None else precision
+    rate = sample_rate if rate is None else rate
+    grouped = data.groupby(SEGMENT_KEYS, observed=True, dropna=False, sort=True)
+    cell_codes = grouped.ngroup().to_numpy()
+    index = grouped.size().index
+    n_cells = len(index)
+
+    def cell_sum(values):
+        return np.bincount(cell_codes, weights=np.asarray(values, dtype=float), minlength=n_cells)
+
+    cells = pd.DataFrame({'rows': np.bincount(cell_codes, minlength=n_cells)}, index=index)
+    for name, column in (('age', 'clnt_age'), ('tenure', 'clnt_tenure_yr')):
+        values = data[column].to_numpy(dtype=float)
+        known = ~np.isnan(values)
+        cells[name + '_sum'] = cell_sum(np.where(known, values, 0))
+        cells[name + '_count'] = cell_sum(known)
+
+    steps = pd.Categorical(data['process_step'], categories=STEP_ORDER).codes.astype(np.int64)
+    funnel_rows = steps >= 0
+    time = sum(data[column].to_numpy(dtype=float) for column in TIME_COLUMNS if column in data.columns)
+    measures = {
+        'events': np.ones(len(data)),
+        'forward': data[TRANSITION_COLUMNS].to_numpy().sum(axis=1),
+        'dropoff': data[DROPOFF_COLUMNS].to_numpy().sum(axis=1),
+        'time': time,
+        'time_sq': time * time,
+    }
+    flat = cell_codes[funnel_rows] * len(STEP_ORDER) + steps[funnel_rows]
+    for measure, values in measures.items():
+        totals = np.bincount(flat, weights=np.asarray(values, dtype=float)[funnel_rows],
+                             minlength=n_cells * len(STEP_ORDER)).reshape(n_cells, len(STEP_ORDER))
+        for position, step in enumerate(STEP_ORDER):
+            cells['%s|%s' % (measure, step)] = totals[:, position]
+
+    client_hashes = hash_values(data['client_id'])
+    clients = hll_registers(client_hashes, cell_codes, n_cells, precision)
+    visits = hll_registers(hash_values(data['visit_id'])[funnel_rows], flat, n_cells * len(STEP_ORDER), precision)
+    visits = visits.reshape(n_cells, len(STEP_ORDER), -1)
+
+    sampled = _sampled_visit_sums(data, index, rate, client_hashes)
+    cells = pd.concat([cells, sampled.set_axis(index)], axis=1)
+    return SketchCube(cells, clients, visits, precision, rate)
+
+
+def get_sketch_cube(data):
+    global _built
+    if _built[0] is not data:
+        _built = (data, build_sketch_cube(data))
+    return _built[1]
+
+
+def _by_level(sketch, positions, level):
+    values = sketch.cells.index.get_level_values(level)[positions]
+    return {value: positions[values == value] for value in pd.unique(values) if not pd.isna(value)}
+
+
+def _shares(sketch, positions, level, clients):
+    # Distinct clients per value of level, rescaled to add up to the client estimate
+    counts = {value: sketch.distinct_clients(part) for value, part in _by_level(sketch, positions, level).items()}
+    total = sum(counts.values())
+    return {value: count * clients / total for value, count in counts.items()} if total > 0 else counts
+
+
+def sketch_summary(sketch, positions):
+    # cube_summary's columns plus '<column> Error', the +/- bound of every estimated card
+    from Vanguard_engine import _summary_frame
+    cells = sketch.cells.iloc[positions]
+    clients = sketch.distinct_clients(positions)
+    genders = _shares(sketch, positions, 'gendr', clients)
+    variations = _shares(sketch, positions, 'Variation', clients)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary = _summary_frame(clients, cells['age_sum'].sum() / cells['age_count'].sum(),
+                                 cells['tenure_sum'].sum() / cells['tenure_count'].sum(), genders, variations)
+    bound = CONFIDENCE_Z * hll_error(sketch.precision)
+    summary['Clients'] = int(round(clients))
+    summary['Clients Error'] = bound * clients
+    for column in ['Percentage Male', 'Percentage Female', 'Percentage Unknown', 'Percentage Control',
+                   'Percentage Test']:
+        # Both counts carry the HLL error; their relative errors add in quadrature
+        share = summary[column].fillna(0)
+        summary[column + ' Error'] = np.minimum(share * bound * np.sqrt(2), 100)
+    return summary
+
+
+def sketch_funnel(sketch, positions):
+    # Tidy per-variation funnel table, same shape as cube_funnel
+    rows = []
+    for variation, part in _by_level(sketch, positions, 'Variation').items():
+        cells = sketch.cells.iloc[part]
+        visits = sketch.distinct_visits(part)
+        for position, step in enumerate(STEP_ORDER):
+            row = {'Variation': str(variation), 'step': step}
+            for measure in FUNNEL_MEASURES:
+                row[measure] = visits[position] if measure == 'visits' else cells['%s|%s' % (measure, step)].sum()
+            rows.append(row)
+    table = pd.DataFrame(rows, columns=['Variation', 'step'] + FUNNEL_MEASURES)
+    # Cells a variation appears in without a single event of a step count no visit there
+    table.loc[table['events'] == 0, 'visits'] = 0
+    return table
+
+
+def sketch_error_rate_bound(totals):
+    # +/- bound of the error rate of sketch_visit_totals; events are exact, only the backward moves are sampled
+    events = totals['events'].sum()
+    return CONFIDENCE_Z * np.sqrt(totals['backward_steps_var'].sum()) / events if events > 0 else np.nan
+
+
+def sketch_visit_totals(sketch, positions):
+    # Per Variation: start visits, bounces, events, backward moves, and the bounce/backward variances.
+    # Starts are rounded and bounces capped at them: in a small selection the scaled sample can
+    # exceed the HLL estimate. Without a single sampled visit the bounces are unknown (NaN).
+    totals = {}
+    for variation, part in _by_level(sketch, positions, 'Variation').items():
+        cells = sketch.cells.iloc[part]
+        starts = float(np.round(sketch.distinct_visits(part)[0])) if cells['events|start'].sum() > 0 else 0.0
+        bounces = min(cells['bounce_visits'].sum(), starts) if cells['sample_visits'].sum() > 0 else np.nan
+        totals[variation] = {'starts': starts, 'bounces': bounces, 'events': cells['rows'].sum(),
+                             'backward_steps': cells['error_steps'].sum(), 'bounces_var': cells['bounce_var'].sum(),
+                             'backward_steps_var': cells['error_var'].sum()}
+    frame = pd.DataFrame.from_dict(totals, orient='index',
+                                   columns=['starts', 'bounces', 'events', 'backward_steps', 'bounces_var',
+                                            'backward_steps_var'])
+    frame.index.name = 'Variation'
+    return frame
@@ -0,0 +1,310 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER, VARIATIONS, TRANSITION_COLUMNS, TIME_COLUMNS, STEP_LABELS, DROP_LABELS
+from Vanguard_profile import profiled
+
+# Batch A/B statistics. The tests of Data_Vanguard.ipynb (proportions_ztest and
+# weightstats.ztest, Control first and Test second) are computed from funnel
+# counts as array operations, so every step of every segment is tested in one
+# call. Mean tests only need n, sum and sum of squares, which the funnel table
+# and the segment cube already carry ('forward', 'time', 'time_sq').
+#
+# Percentile bootstrap CIs: a proportion is resampled as binomial draws of the
+# observed rate (the same distribution as resampling the 0/1 outcomes), so it
+# needs only the counts. Mean step times are resampled from the raw times
+# (step_time_samples), a block of resamples per array operation; cells large
+# enough are split over a process pool. Without the raw times (segment
+# sweeps, the approximate and DuckDB engines) they keep the normal CI from n,
+# sum and sum of squares.
+# A cell without trials, or with more successes than trials (an estimate of
+# the approximate engine), has no rate: its CI and p-value are NaN.
+#
+# Sequential tests for live monitoring: the mixture SPRT (normal mixture over
+# the Test - Control difference, Johari et al.) gives a p-value per look; the
+# running minimum over looks stays valid however often the data is checked.
+
+ALTERNATIVES = ['two-sided', 'larger', 'smaller']
+
+bootstrap_workers = int(os.getenv('BOOTSTRAP_WORKERS', os.cpu_count() or 1))
+# Resampled values (samples x resamples) below which the pool is not worth using
+POOL_THRESHOLD = 20_000_000
+BOOTSTRAP_CHUNK = 200
+
+# Mixing standard deviation of the mSPRT, in per-observation standard deviations
+MSPRT_EFFECT = float(os.getenv('MSPRT_EFFECT', 0.1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _p_values(z, alternative):
+    from scipy.special import ndtr
+    if alternative == 'two-sided':
+        return 2 * ndtr(-np.abs(z))
+    if alternative == 'larger':
+        return ndtr(-z)
+    if alternative == 'smaller':
+        return ndtr(z)
+    raise ValueError(f'alternative must be one of {ALTERNATIVES}')
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+
+
+def _valid_proportion(successes, trials):
+    with np.errstate(invalid='ignore'):
+        return (trials > 0) & (successes >= 0) & (successes <= trials)
+
+
+def proportions_ztest(count1, nobs1, count2, nobs2, alternative='two-sided'):
+    # Pooled two-sample z-test of count1/nobs1 - count2/nobs2, element-wise
+    count1, nobs1, count2, nobs2 = (np.asarray(value, dtype=float) for value in (count1, nobs1, count2, nobs2))
+    valid = _valid_proportion(count1, nobs1) & _valid_proportion(count2, nobs2)
+    pooled = np.where(valid, _ratio(count1 + count2, nobs1 + nobs2), np.nan)
+    with np.errstate(invalid='ignore'):
+        std = np.sqrt(pooled * (1 - pooled) * (_ratio(1, nobs1) + _ratio(1, nobs2)))
+    z = _ratio(_ratio(count1, nobs1) - _ratio(count2, nobs2), std)
+    return z, _p_values(z, alternative)
+
+
+def means_ztest(sum1, sumsq1, n1, sum2, sumsq2, n2, alternative='two-sided'):
+    # Two-sample z-test of mean1 - mean2 with pooled variance (weightstats.ztest, ddof=1)
+    sum1, sumsq1, n1, sum2, sumsq2, n2 = (np.asarray(value, dtype=float) for value in (sum1, sumsq1, n1, sum2, sumsq2, n2))
+    mean1, mean2 = _ratio(sum1, n1), _ratio(sum2, n2)
+    squares = (sumsq1 - n1 * mean1 ** 2) + (sumsq2 - n2 * mean2 ** 2)
+    variance = _ratio(np.maximum(squares, 0), n1 + n2 - 2) * (_ratio(1, n1) + _ratio(1, n2))
+    z = _ratio(mean1 - mean2, np.sqrt(variance))
+    return z, _p_values(z, alternative)
+
+
+def mean_normal_ci(total, total_sq, n, alpha=0.05):
+    from scipy.special import ndtri
+    total, total_sq, n = (np.asarray(value, dtype=float) for value in (total, total_sq, n))
+    mean = _ratio(total, n)
+    variance = _ratio(np.maximum(total_sq - n * mean ** 2, 0), n - 1)
+    half = ndtri(1 - alpha / 2) * np.sqrt(_ratio(variance, n))
+    return mean - half, mean + half
+
+
+def _segment_grid(table, by):
+    # (segment..., Variation, step) grid of every measure with Control/Test and all steps present
+    keys = list(by) + ['Variation', 'step']
+    table = table.dropna(subset=['Variation']).assign(
+        Variation=lambda frame: frame['Variation'].astype(str), step=lambda frame: frame['step'].astype(str))
+    grid = table.groupby(keys, observed=True)[['visits', 'forward', 'dropoff', 'time', 'time_sq']].sum()
+    segments = list(dict.fromkeys(zip(*[grid.index.get_level_values(key) for key in by]))) if by else [()]
+    full_index = pd.MultiIndex.from_tuples(
+        [(*segment, variation, step) for segment in segments for variation in ['Control', 'Test'] for step in STEP_ORDER],
+        names=keys)
+    grid = grid.reindex(full_index, fill_value=0)
+    # measure -> array of shape (segments, variation, step)
+    shape = (len(segments), 2, len(STEP_ORDER))
+    return {column: grid[column].to_numpy(dtype=float).reshape(shape) for column in grid.columns}, segments
+
+
+def _sample_mean_ci(samples, segments, n_boot, alpha, seed):
+    # Bootstrap CIs of the mean time, shaped (segments, variation, step) like the grid
+    cells = [samples.get((*segment, variation, label), ()) for segment in segments
+             for variation in VARIATIONS for label in STEP_LABELS]
+    low, high = bootstrap_mean_ci(cells, n_boot, alpha, seed)
+    shape = (len(segments), len(VARIATIONS), len(STEP_LABELS))
+    return low.reshape(shape), high.reshape(shape)
+
+
+def _proportion_test(metric, labels, successes, trials, scale, alternative, n_boot, alpha, seed):
+    z, p = proportions_ztest(successes[:, 0], trials[:, 0], successes[:, 1], trials[:, 1], alternative)
+    low, high = bootstrap_proportion_ci(successes, trials, n_boot, alpha, seed)
+    rates = np.where(_valid_proportion(successes, trials), _ratio(successes, trials), np.nan)
+    return metric, labels, scale * rates, scale * low, scale * high, z, p
+
+
+@profiled()
+def funnel_tests(table, by=(), alternative='two-sided', n_boot=2_000, alpha=0.05, seed=0, samples=None):
+    # Control vs Test for every segment of a funnel_table(data, by=by + ['Variation']):
+    # drop rate and navigation time per step and the start-to-confirm rate, with
+    # per-group bootstrap CIs. Mean times are bootstrapped from samples, the
+    # step_time_samples(data, by) of the same rows, else get a normal CI.
+    grid, segments = _segment_grid(table, by)
+    frames = []
+
+    drops, forward = grid['dropoff'][:, :, :-1], grid['forward'][:, :, :-1]
+    frames.append(_proportion_test('Drop Rate', DROP_LABELS, drops, drops + forward, 100,
+                                   alternative, n_boot, alpha, seed))
+
+    time, time_sq = grid['time'][:, :, :-1], grid['time_sq'][:, :, :-1]
+    z, p = means_ztest(time[:, 0], time_sq[:, 0], forward[:, 0], time[:, 1], time_sq[:, 1], forward[:, 1], alternative)
+    if samples is None:
+        low, high = mean_normal_ci(time, time_sq, forward, alpha)
+    else:
+        low, high = _sample_mean_ci(samples, segments, n_boot, alpha, seed)
+    frames.append(('Navigation Time', STEP_LABELS, _ratio(time, forward), low, high, z, p))
+
+    starts, confirms = grid['visits'][:, :, :1], grid['visits'][:, :, -1:]
+    frames.append(_proportion_test('Confirmation Rate', ['Start-Confirm'], confirms, starts, 1,
+                                   alternative, n_boot, alpha, seed))
+
+    tests = []
+    for metric, labels, value, low, high, z, p in frames:
+        n_segments, n_steps = z.shape
+        result = pd.DataFrame({
+            'metric': metric,
+            'step': np.tile(labels, n_segments),
+            'Control': value[:, 0].ravel(),
+            'Control Low': low[:, 0].ravel(),
+            'Control High': high[:, 0].ravel(),
+            'Test': value[:, 1].ravel(),
+            'Test Low': low[:, 1].ravel(),
+            'Test High': high[:, 1].ravel(),
+            'z': z.ravel(),
+            'p_value': p.ravel()
+        })
+        if by:
+            keys = pd.DataFrame(segments, columns=list(by)).iloc[np.repeat(np.arange(n_segments), n_steps)]
+            result = pd.concat([keys.reset_index(drop=True), result], axis=1)
+        tests.append(result)
+    return pd.concat(tests, ignore_index=True)
+
+
+def bounce_test(bounces, starts, alternative='two-sided', n_boot=2_000, alpha=0.05, seed=0):
+    # Control vs Test bounce rate (%) from [Control, Test] bounce and start visit counts
+    bounces, starts = np.asarray(bounces, dtype=float), np.asarray(starts, dtype=float)
+    z, p = proportions_ztest(bounces[0], starts[0], bounces[1], starts[1], alternative)
+    low, high = bootstrap_proportion_ci(bounces, starts, n_boot, alpha, seed)
+    rates = np.where(_valid_proportion(bounces, starts), _ratio(bounces, starts), np.nan)
+    return pd.DataFrame({
+        'metric': ['Bounce Rate'], 'step': ['Start'],
+        'Control': [100 * rates[0]], 'Control Low': [100 * low[0]], 'Control High': [100 * high[0]],
+        'Test': [100 * rates[1]], 'Test Low': [100 * low[1]], 'Test High': [100 * high[1]],
+        'z': [float(z)], 'p_value': [float(p)]
+    })
+
+
+def msprt_p_values(difference, variance, tau_sq):
+    # 1 / likelihood ratio of the N(0, tau_sq) mixture against difference == 0, capped at 1
+    difference, variance, tau_sq = (np.asarray(value, dtype=float) for value in (difference, variance, tau_sq))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ratio = 0.5 * np.log(variance / (variance + tau_sq)) + \
+            tau_sq * difference ** 2 / (2 * variance * (variance + tau_sq))
+    p = np.exp(-np.maximum(log_ratio, 0))
+    return np.where(np.isfinite(log_ratio) & (variance > 0), p, 1.0)
+
+
+def _proportion_msprt(successes, trials, effect):
+    rates = _ratio(successes, trials)
+    pooled = _ratio(successes.sum(axis=0), trials.sum(axis=0))
+    variance = rates[0] * (1 - rates[0]) / trials[0] + rates[1] * (1 - rates[1]) / trials[1]
+    tau_sq = (effect ** 2) * pooled * (1 - pooled)
+    return rates, msprt_p_values(rates[1] - rates[0], variance, tau_sq)
+
+
+def sequential_tests(table, bounces=None, effect=MSPRT_EFFECT):
+    # mSPRT p-value of this look for every dashboard metric of a per-variation funnel_table;
+    # bounces is [Control, Test] bounce visits. Keep the running minimum across looks.
+    grid, _ = _segment_grid(table, ())
+    frames = []
+
+    drops, forward = grid['dropoff'][0, :, :-1], grid['forward'][0, :, :-1]
+    rates, p = _proportion_msprt(drops, drops + forward, effect)
+    frames.append(('Drop Rate', DROP_LABELS, 100 * rates, p))
+
+    time, time_sq = grid['time'][0, :, :-1], grid['time_sq'][0, :, :-1]
+    means = _ratio(time, forward)
+    variances = _ratio(np.maximum(time_sq - forward * means ** 2, 0), forward - 1)
+    pooled = _ratio(np.maximum(time_sq.sum(axis=0) - (time.sum(axis=0) ** 2) / forward.sum(axis=0), 0),
+                    forward.sum(axis=0) - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = variances[0] / forward[0] + variances[1] / forward[1]
+    frames.append(('Navigation Time', STEP_LABELS, means, msprt_p_values(means[1] - means[0], variance,
+                                                                          effect ** 2 * pooled)))
+
+    starts, confirms = grid['visits'][0, :, :1], grid['visits'][0, :, -1:]
+    rates, p = _proportion_msprt(confirms, starts, effect)
+    frames.append(('Confirmation Rate', ['Start-Confirm'], rates, p))
+
+    if bounces is not None:
+        rates, p = _proportion_msprt(np.asarray(bounces, dtype=float)[:, None], starts, effect)
+        frames.append(('Bounce Rate', ['Start'], 100 * rates, p))
+
+    return pd.concat([pd.DataFrame({'metric': metric, 'step': labels, 'Control': value[0], 'Test': value[1],
+                                    'difference': value[1] - value[0], 'p_value': p})
+                      for metric, labels, value, p in frames], ignore_index=True)
+
+
+def bootstrap_proportion_ci(successes, trials, n_boot=10_000, alpha=0.05, seed=None):
+    successes, trials = np.asarray(successes, dtype=float), np.asarray(trials, dtype=float)
+    invalid = ~_valid_proportion(successes, trials)
+    # Approximate counts are not integers; masked cells draw nothing
+    trials = np.where(invalid, 0, np.round(np.nan_to_num(trials))).astype(np.int64)
+    rates = np.clip(np.nan_to_num(_ratio(successes, np.maximum(trials, 1))), 0, 1)
+    rng = np.random.default_rng(seed)
+    draws = rng.binomial(trials[..., None], rates[..., None], size=trials.shape + (n_boot,)) / np.maximum(trials, 1)[..., None]
+    low, high = np.percentile(draws, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=-1)
+    invalid |= trials == 0
+    return np.where(invalid, np.nan, low), np.where(invalid, np.nan, high)
+
+
+def _bootstrap_means(samples, n_boot, seed):
+    rng = np.random.default_rng(seed)
+    means = np.empty(n_boot)
+    for start in range(0, n_boot, BOOTSTRAP_CHUNK):
+        stop = min(start + BOOTSTRAP_CHUNK, n_boot)
+        indices = rng.integers(0, len(samples), size=(stop - start, len(samples)))
+        means[start:stop] = samples[indices].mean(axis=1)
+    return means
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a server with live threads is not safe
+            _pool = ProcessPoolExecutor(bootstrap_workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def bootstrap_means(cells, n_boot=10_000, seed=None, workers=None):
+    # (cells, n_boot) resampled means of every array of cells, NaN for an empty one.
+    # Independent streams per cell and worker, reproducible for a given seed and worker count.
+    workers = bootstrap_workers if workers is None else workers
+    cells = [np.asarray(samples, dtype=float) for samples in cells]
+    seeds = np.random.SeedSequence(seed).spawn(len(cells))
+    means = np.full((len(cells), n_boot), np.nan)
+    pooled = {}
+    # Large cells go to the pool first, the small ones run here meanwhile
+    for index, (samples, child) in enumerate(zip(cells, seeds)):
+        if workers > 1 and len(samples) * n_boot >= POOL_THRESHOLD:
+            sizes = [n_boot // workers + (part < n_boot % workers) for part in range(workers)]
+            pooled[index] = [_get_pool().submit(_bootstrap_means, samples, size, stream)
+                             for size, stream in zip(sizes, child.spawn(workers)) if size]
+    for index, (samples, child) in enumerate(zip(cells, seeds)):
+        if len(samples) and index not in pooled:
+            means[index] = _bootstrap_means(samples, n_boot, child)
+    for index, futures in pooled.items():
+        means[index] = np.concatenate([future.result() for future in futures])
+    return means
+
+
+def bootstrap_mean_ci(cells, n_boot=10_000, alpha=0.05, seed=None, workers=None):
+    means = bootstrap_means(cells, n_boot, seed, workers)
+    with np.errstate(invalid='ignore'):
+        low, high = np.percentile(means, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=-1)
+    return low, high
+
+
+def step_time_samples(data, by=()):
+    # Seconds spent on each step before moving forward, per (by..., Variation, step label)
+    keys = list(by) + ['Variation']
+    samples = {}
+    for label, transition, time in zip(STEP_LABELS, TRANSITION_COLUMNS, TIME_COLUMNS):
+        moved = data[data[transition] == 1]
+        for key, times in moved.groupby(keys, observed=True)[time]:
+            key = key if isinstance(key, tuple) else (key,)
+            samples[tuple(str(value) if name == 'Variation' else value for name, value in zip(keys, key)) +
+                    (label,)] = times.to_numpy(dtype=float)
+    return samples
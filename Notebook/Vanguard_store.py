@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from Vanguard_profile import profiled
+
+# Shared read-only copy of Final_DF for every session and worker process.
+# The prepared frame (Vanguard_ingest) is written once as one .npy file per
+# column: numeric and datetime columns as they are, categoricals as their
+# codes plus a small categories file. Readers np.load them with mmap_mode='r'
+# and build the DataFrame on top without copying, so the column data lives in
+# the OS page cache once however many processes open the store, and is
+# read-only (writing into a column raises instead of corrupting it).
+#
+# Layout: <store>/CURRENT names the live version directory. A refresh writes a
+# new version next to it and swaps CURRENT with os.replace; processes that
+# still map the old files keep reading them until they reopen, and only the
+# last KEEP_VERSIONS versions are kept on disk.
+#
+# Id columns with more than CODED_CATEGORIES distinct values (visit_id,
+# visitor_id) would need every process to build its own index of millions of
+# strings, so the frame carries their int codes instead: the metrics only
+# compare ids, and decode() turns codes back into the original strings.
+#
+# take() gathers only the columns asked for of a row selection (the
+# sidebar filters select rows through Vanguard_filters).
+
+data_store = os.getenv('DATA_STORE')
+
+KEEP_VERSIONS = 2
+CURRENT = 'CURRENT'
+META = 'meta.json'
+
+CODED_CATEGORIES = int(os.getenv('CODED_CATEGORIES', 4096))
+
+# (store directory, version, Dataset) for the last store opened
+_opened = (None, None, None)
+
+
+def _write_json(path, content):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump(content, handle, indent=2)
+    os.replace(tmp_path, path)
+
+
+def current_version(store_dir):
+    try:
+        with open(os.path.join(store_dir, CURRENT)) as handle:
+            return json.load(handle)['version']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_meta(store_dir, version=None):
+    version = version or current_version(store_dir)
+    if version is None:
+        return None
+    with open(os.path.join(store_dir, version, META)) as handle:
+        return json.load(handle)
+
+
+def _save_column(directory, position, column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories
+        # Text categories as fixed-width unicode, so no file needs pickle
+        values = categories.to_numpy().astype(str) if categories.dtype == object else categories.to_numpy()
+        np.save(os.path.join(directory, '%d.npy' % position), column.cat.codes.to_numpy())
+        np.save(os.path.join(directory, '%d.categories.npy' % position), values)
+        return {'name': column.name, 'kind': 'category', 'ordered': bool(column.cat.ordered),
+                'categories': len(categories)}
+    np.save(os.path.join(directory, '%d.npy' % position), column.to_numpy())
+    return {'name': column.name, 'kind': 'array', 'dtype': str(column.dtype)}
+
+
+@profiled()
+def publish(data, store_dir, source=None):
+    # Writes data as a new version and makes it the current one; returns the version name
+    os.makedirs(store_dir, exist_ok=True)
+    version = 'v%d-%d' % (time.time_ns(), os.getpid())
+    tmp_dir = os.path.join(store_dir, '.' + version + '.tmp')
+    os.makedirs(tmp_dir)
+    columns = []
+    for position, name in enumerate(data.columns):
+        column = data[name]
+        if column.dtype == object:
+            # Text columns are mapped as codes too
+            column = column.astype('category')
+        columns.append(_save_column(tmp_dir, position, column))
+    _write_json(os.path.join(tmp_dir, META), {'rows': len(data), 'columns': columns, 'source': source})
+    os.rename(tmp_dir, os.path.join(store_dir, version))
+    _write_json(os.path.join(store_dir, CURRENT), {'version': version})
+    prune(store_dir)
+    return version
+
+
+def prune(store_dir, keep=KEEP_VERSIONS):
+    # Removes all but the newest `keep` versions; open maps of removed files stay valid
+    live = current_version(store_dir)
+    versions = sorted((name for name in os.listdir(store_dir) if name.startswith('v')),
+                      key=lambda name: int(name[1:].split('-')[0]))
+    for name in versions[:-keep]:
+        if name != live:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+
+
+class Dataset:
+    def __init__(self, store_dir, version=None):
+        self.store_dir = store_dir
+        self.version = version or current_version(store_dir)
+        if self.version is None:
+            raise FileNotFoundError(f'no dataset published in {store_dir}')
+        self.meta = read_meta(store_dir, self.version)
+        self.rows = self.meta['rows']
+        self.columns = [column['name'] for column in self.meta['columns']]
+        self._specs = {column['name']: (position, column) for position, column in enumerate(self.meta['columns'])}
+        self._codes = {}
+        self._columns = {}
+        self._frame = None
+
+    def _path(self, position, suffix='npy'):
+        return os.path.join(self.store_dir, self.version, '%d.%s' % (position, suffix))
+
+    def codes(self, name):
+        # Raw mapped array: the values, or the codes of a categorical column
+        if name not in self._codes:
+            position, _ = self._specs[name]
+            self._codes[name] = np.load(self._path(position), mmap_mode='r')
+        return self._codes[name]
+
+    def column(self, name):
+        if name not in self._columns:
+            position, spec = self._specs[name]
+            values = self.codes(name)
+            if spec['kind'] == 'category' and spec['categories'] <= CODED_CATEGORIES:
+                categories = np.load(self._path(position, 'categories.npy'))
+                dtype = pd.CategoricalDtype(pd.Index(categories), ordered=spec['ordered'])
+                values = pd.Categorical.from_codes(values, dtype=dtype)
+            self._columns[name] = values
+        return self._columns[name]
+
+    def frame(self, columns=None):
+        # DataFrame over the mapped columns, nothing is copied. The full frame is built once
+        # per version so the per-frame caches (cube, client index) keep hitting.
+        if columns is None:
+            if self._frame is None:
+                self._frame = pd.DataFrame({name: self.column(name) for name in self.columns}, copy=False)
+            return self._frame
+        return pd.DataFrame({name: self.column(name) for name in columns}, copy=False)
+
+    def decode(self, name, codes):
+        # Original values of a column exposed as codes
+        position, _ = self._specs[name]
+        categories = np.load(self._path(position, 'categories.npy'), mmap_mode='r')
+        codes = np.asarray(codes)
+        return np.where(codes >= 0, categories[np.maximum(codes, 0)], None)
+
+    def take(self, rows, columns=None):
+        # Only the requested columns of the selected rows are materialized
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({name: self.column(name)[rows] for name in columns})
+
+
+def open_dataset(store_dir=None):
+    # The current version, reopened only after a refresh swapped it
+    global _opened
+    store_dir = store_dir or data_store
+    version = current_version(store_dir)
+    if _opened[0] != store_dir or _opened[1] != version or version is None:
+        _opened = (store_dir, version, Dataset(store_dir, version))
+    return _opened[2]
+
+
+def _source_stat(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def sync_store(path, store_dir=None):
+    # Publishes Final_DF from path when the store is missing or older than the CSV; returns the version
+    from Vanguard_ingest import load_final_df, clear_loaded
+    store_dir = store_dir or data_store
+    source = _source_stat(path)
+    meta = read_meta(store_dir) if os.path.isdir(store_dir) else None
+    if meta is not None and meta.get('source') == source:
+        return current_version(store_dir)
+    version = publish(load_final_df(path), store_dir, source)
+    # The private copy used to write the store is not needed any more
+    clear_loaded()
+    return version
+
+
+@profiled()
+def load_frame(path, store_dir=None):
+    store_dir = store_dir or data_store
+    sync_store(path, store_dir)
+    return open_dataset(store_dir).frame()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish Final_DF to the shared memory-mapped store.')
+    parser.add_argument('path', nargs='?', help='Final_DF CSV (default: DIR + CSV5 from .env)')
+    parser.add_argument('--store', default=data_store, help='store directory (default: DATA_STORE)')
+    parser.add_argument('--force', action='store_true', help='publish a new version even if the CSV is unchanged')
+    args = parser.parse_args()
+    if not args.store:
+        parser.error('--store or DATA_STORE is required')
+    if args.path is None:
+        from Vanguard_core import data_path
+        args.path = data_path()
+
+    if args.force:
+        from Vanguard_ingest import load_final_df
+        version = publish(load_final_df(args.path), args.store, _source_stat(args.path))
+    else:
+        version = sync_store(args.path, args.store)
+    meta = read_meta(args.store, version)
+    size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(args.store, version)))
+    print(json.dumps({'version': version, 'rows': meta['rows'], 'columns': len(meta['columns']), 'bytes': size}))
+
+
+if __name__ == '__main__':
+    main()
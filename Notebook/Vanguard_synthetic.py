@@ -0,0 +1,133 @@
+import argparse
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER
+from Vanguard_pipeline import WEB_COLUMNS, merge_chunk, derive_funnel_columns
+
+# Synthetic Final_DF-shaped data for benchmarks and load tests. Clients get
+# demographics shaped like df_final_demo.csv and a Control/Test variation;
+# their visits walk the funnel as a Markov chain (forward, back, repeat or
+# leave at every event) with the Test design slightly more likely to move
+# forward. The web events then go through the same merge and derivation as
+# Vanguard_pipeline, so every derived column is consistent with the events.
+
+EXPERIMENT_START = pd.Timestamp('2017-03-15')
+EXPERIMENT_DAYS = 90
+MAX_EVENTS = 24
+EVENTS_PER_CLIENT = 7.5
+EVENTS_PER_VISIT = 4.0
+
+GENDERS = ['U', 'M', 'F', 'X']
+GENDER_WEIGHTS = [0.34, 0.33, 0.329, 0.001]
+VARIATIONS = ['Control', 'Test']
+VARIATION_WEIGHTS = [0.47, 0.53]
+
+# Per step (start ... confirm): probability of moving forward, going back and
+# repeating the step; whatever is left is the chance of leaving the visit
+FORWARD = {'Control': [0.78, 0.74, 0.68, 0.62, 0.0], 'Test': [0.80, 0.76, 0.70, 0.64, 0.0]}
+BACKWARD = {'Control': [0.0, 0.06, 0.07, 0.08, 0.04], 'Test': [0.0, 0.07, 0.08, 0.08, 0.04]}
+REPEAT = {'Control': [0.05, 0.04, 0.04, 0.05, 0.30], 'Test': [0.05, 0.04, 0.04, 0.05, 0.32]}
+# Mean seconds spent on each step before the next event
+STEP_SECONDS = {'Control': [55, 60, 60, 62, 40], 'Test': [57, 61, 59, 64, 40]}
+
+
+def generate_clients(n_clients, seed=0):
+    rng = np.random.default_rng(seed)
+    client_id = 100_000 + rng.choice(max(9_900_000, 4 * n_clients), size=n_clients, replace=False)
+    tenure_yr = np.clip(np.round(rng.gamma(3.0, 4.0, n_clients)), 2, 62)
+    demo = pd.DataFrame({
+        'client_id': client_id,
+        'clnt_tenure_yr': tenure_yr,
+        'clnt_tenure_mnth': tenure_yr * 12 + rng.integers(0, 12, n_clients),
+        'clnt_age': np.clip(np.round(rng.normal(47, 15.5, n_clients) * 2) / 2, 17, 96),
+        'gendr': rng.choice(GENDERS, size=n_clients, p=GENDER_WEIGHTS),
+        'num_accts': np.clip(rng.poisson(0.3, n_clients) + 2, 1, 8).astype(float),
+        'bal': np.round(rng.lognormal(11, 1.1, n_clients), 2),
+        'calls_6_mnth': rng.integers(0, 8, n_clients).astype(float),
+    })
+    demo['logons_6_mnth'] = np.clip(demo['calls_6_mnth'] + rng.integers(2, 4, n_clients), 0, 9)
+    variation = pd.DataFrame({'client_id': client_id,
+                              'Variation': rng.choice(VARIATIONS, size=n_clients, p=VARIATION_WEIGHTS)})
+    return demo, variation
+
+
+def _visit_events(visit_variation, rng):
+    # Walk every visit through the funnel at once, one event per iteration
+    n_visits = len(visit_variation)
+    is_test = visit_variation == 'Test'
+    tables = {name: np.where(is_test[:, None], np.array(source['Test']), np.array(source['Control']))
+              for name, source in (('forward', FORWARD), ('backward', BACKWARD), ('repeat', REPEAT),
+                                   ('seconds', STEP_SECONDS))}
+    rows = np.arange(n_visits)
+    # Most visits land on the first page, some arrive deep-linked into a later step
+    step = np.where(rng.random(n_visits) < 0.9, 0, rng.integers(1, len(STEP_ORDER) - 1, n_visits))
+    seconds = rng.integers(0, EXPERIMENT_DAYS * 86400, n_visits)
+    alive = np.ones(n_visits, dtype=bool)
+
+    visits, steps, times = [], [], []
+    for _ in range(MAX_EVENTS):
+        live = np.flatnonzero(alive)
+        if not len(live):
+            break
+        visits.append(live)
+        steps.append(step[live])
+        times.append(seconds[live])
+
+        draw = rng.random(len(live))
+        forward = tables['forward'][rows[live], step[live]]
+        backward = forward + tables['backward'][rows[live], step[live]]
+        repeat = backward + tables['repeat'][rows[live], step[live]]
+        seconds[live] += np.ceil(rng.exponential(tables['seconds'][rows[live], step[live]])).astype(np.int64)
+        step[live] += np.where(draw < forward, 1, np.where(draw < backward, -1, 0))
+        alive[live[draw >= repeat]] = False
+    return np.concatenate(visits), np.concatenate(steps), np.concatenate(times)
+
+
+def generate_web_logs(demo, variation, n_rows, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    clients = variation.merge(demo[['client_id']], on='client_id')
+    # Visits average about four events, so this lands close to n_rows
+    n_visits = max(1, int(n_rows / EVENTS_PER_VISIT))
+    owner = rng.integers(0, len(clients), n_visits)
+    visit_client = clients['client_id'].to_numpy()[owner]
+    visit_variation = clients['Variation'].to_numpy()[owner]
+    visitor = pd.Series(rng.integers(10_000_000, 99_999_999, n_visits)).astype(str) + '_' + \
+        pd.Series(rng.integers(10_000_000_000, 99_999_999_999, n_visits)).astype(str)
+    visit = pd.Series(visit_client).astype(str) + '_' + pd.Series(rng.integers(10_000_000, 99_999_999, n_visits)).astype(str) + \
+        '_' + pd.Series(rng.integers(100_000, 999_999, n_visits)).astype(str)
+
+    event_visit, event_step, event_seconds = _visit_events(visit_variation, rng)
+    web = pd.DataFrame({
+        'client_id': visit_client[event_visit],
+        'visitor_id': visitor.to_numpy()[event_visit],
+        'visit_id': visit.to_numpy()[event_visit],
+        'process_step': np.array(STEP_ORDER)[event_step],
+        'date_time': EXPERIMENT_START + pd.to_timedelta(event_seconds, unit='s')
+    })
+    return web[WEB_COLUMNS]
+
+
+def generate_final_df(n_rows, seed=0):
+    n_clients = max(1, int(n_rows / EVENTS_PER_CLIENT))
+    demo, variation = generate_clients(n_clients, seed)
+    web = generate_web_logs(demo, variation, n_rows, seed)
+    return derive_funnel_columns(merge_chunk(web, demo, variation))
+
+
+def write_final_df(path, n_rows, seed=0):
+    data = generate_final_df(n_rows, seed)
+    data.to_csv(path, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic Final_DF-shaped CSV.')
+    parser.add_argument('output')
+    parser.add_argument('--rows', type=int, default=100_000, help='approximate number of event rows')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(write_final_df(args.output, args.rows, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from Vanguard_funnel import STEP_ORDER
+from Vanguard_profile import profiled
+
+# Materialized per-visit rollup: one row per visit_id with its variation,
+# client attributes, event and distinct step counts, first/last step,
+# backward moves and duration. Built once per loaded frame; bounce, error
+# and confirmation metrics are then reductions over this much smaller table.
+
+VISIT_ATTRIBUTES = ['client_id', 'Variation', 'clnt_age', 'gendr']
+
+# (data, visits) for the last frame the rollup was built from
+_built = (None, None)
+
+
+def _funnel_positions(data):
+    # Funnel position of every row (start=0 ... confirm=4), -1 for anything else
+    return pd.Categorical(data['process_step'], categories=STEP_ORDER).codes.astype(np.int8)
+
+
+def _distinct_steps(visit_codes, step_codes, n_visits, n_steps):
+    known = step_codes >= 0
+    if n_steps > 62:
+        pairs = pd.DataFrame({'visit': visit_codes[known], 'step': step_codes[known]})
+        return pairs.groupby('visit')['step'].nunique().reindex(range(n_visits), fill_value=0).to_numpy()
+    # One bit per step value, OR-ed per visit, then counted
+    masks = np.zeros(n_visits, dtype=np.uint64)
+    np.bitwise_or.at(masks, visit_codes[known], np.left_shift(np.uint64(1), step_codes[known].astype(np.uint64)))
+    counts = np.zeros(n_visits, dtype=np.int64)
+    for bit in range(n_steps):
+        counts += ((masks >> np.uint64(bit)) & np.uint64(1)).astype(np.int64)
+    return counts
+
+
+def visit_order(visit_codes, times):
+    # Row order that is chronological inside each visit, None when the rows already are
+    # (they usually arrive grouped by visit and sorted by time, and the sort is skipped)
+    same_visit = visit_codes[1:] == visit_codes[:-1]
+    if np.all(visit_codes[1:] >= visit_codes[:-1]) and np.all(times[1:][same_visit] >= times[:-1][same_visit]):
+        return None
+    return np.lexsort((times, visit_codes))
+
+
+@profiled()
+def build_visits(data):
+    visit_codes, visit_ids = pd.factorize(data['visit_id'])
+    n_visits = len(visit_ids)
+    times = data['date_time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    positions = _funnel_positions(data)
+    step_codes, step_names = pd.factorize(data['process_step'])
+
+    # Rows without a visit_id factorize to -1 and belong to no visit
+    kept = visit_codes >= 0
+    if kept.all():
+        order = visit_order(visit_codes, times)
+    else:
+        kept = np.flatnonzero(kept)
+        order = visit_order(visit_codes[kept], times[kept])
+        order = kept if order is None else kept[order]
+    if order is None:
+        order = np.arange(len(data))
+    else:
+        visit_codes, times, positions = visit_codes[order], times[order], positions[order]
+    same_visit = visit_codes[1:] == visit_codes[:-1]
+
+    # Sorted positions of each visit's first and last event, indexed by visit code
+    boundaries = np.flatnonzero(np.concatenate(([True], ~same_visit))) if len(order) else order
+    first_rows = np.empty(n_visits, dtype=np.int64)
+    first_rows[visit_codes[boundaries]] = boundaries
+    last_rows = np.empty(n_visits, dtype=np.int64)
+    last_rows[visit_codes[boundaries]] = np.append(boundaries[1:], len(order)) - 1
+
+    # A backward move is a funnel step lower than the previous one in the same visit
+    known = positions >= 0
+    backward = same_visit & known[1:] & known[:-1] & (positions[1:] < positions[:-1])
+
+    visits = data[VISIT_ATTRIBUTES].iloc[order[first_rows]].reset_index(drop=True)
+    visits.index = pd.Index(visit_ids, name='visit_id')
+    visits['events'] = np.bincount(visit_codes, minlength=n_visits)
+    visits['steps'] = _distinct_steps(visit_codes, step_codes[order], n_visits, len(step_names))
+    visits['first_step'] = pd.Categorical.from_codes(positions[first_rows], categories=STEP_ORDER)
+    visits['last_step'] = pd.Categorical.from_codes(positions[last_rows], categories=STEP_ORDER)
+    visits['backward_steps'] = np.bincount(visit_codes[1:][backward], minlength=n_visits)
+    visits['has_start'] = np.bincount(visit_codes[positions == 0], minlength=n_visits) > 0
+    visits['has_confirm'] = np.bincount(visit_codes[positions == len(STEP_ORDER) - 1], minlength=n_visits) > 0
+    visits['duration'] = (times[last_rows] - times[first_rows]) / 1e9
+    return visits
+
+
+def get_visits(data):
+    global _built
+    if _built[0] is not data:
+        _built = (data, build_visits(data))
+    return _built[1]
+
+
+def visit_bounce_rates(visits):
+    rates = {}
+    for group in ['Control', 'Test']:
+        group_visits = visits[visits['Variation'] == group]
+        starts = group_visits['has_start'].sum()
+        bounces = (group_visits['steps'] == 1).sum()
+        rates[group] = 100 * bounces / starts if starts > 0 else None
+    return rates
+
+
+def visit_error_rate(visits, rows):
+    # Backward moves per row; rows without a visit_id belong to no visit but
+    # still count, as in the row-level rate
+    return visits['backward_steps'].sum() / rows if rows > 0 else np.nan
+
+
+def visit_confirmation_rates(visits):
+    rates = {}
+    for group in ['Control', 'Test']:
+        group_visits = visits[visits['Variation'] == group]
+        starts = group_visits['has_start'].sum()
+        confirms = group_visits['has_confirm'].sum()
+        rates[group] = confirms / starts if starts > 0 and confirms > 0 else np.nan
+    return rates